@@ -45,6 +45,65 @@ class Config:
     THRESHOLD           = _get_env("THRESHOLD", cast=int, default="50")
     MAX_DOWNLOAD_LIMIT  = _get_env("MAX_DOWNLOAD_LIMIT", cast=int, default="10")
 
+    # Process roles: "standalone" does everything, "bot" only handles updates and
+    # enqueues jobs, "worker" claims jobs from the shared queue in STATE_DB.
+    RUN_MODE            = (_get_env("RUN_MODE", default="standalone") or "standalone").lower()
+    STATE_DB            = _get_env("STATE_DB", default="state.db") or "state.db"
+    WORKER_ID           = _get_env("WORKER_ID")
+    WORKER_CONCURRENCY  = _get_env("WORKER_CONCURRENCY", cast=int, default="2")
+
+    # Upper bounds for the Pyrogram client; the number of concurrent transfers
+    # is tuned below MAX_CONCURRENT_TRANSMISSIONS from measured throughput
+    WORKERS             = _get_env("WORKERS", cast=int, default="300")
+    MAX_CONCURRENT_TRANSMISSIONS = _get_env("MAX_CONCURRENT_TRANSMISSIONS", cast=int, default="100")
+
+    # Extra bot tokens whose clients share the downloads and uploads; they must
+    # be admins of LOG_CHANNEL and LOG_MEDIA_CHANNEL
+    HELPER_BOT_TOKENS   = [
+                           t.strip() for t in _get_env("HELPER_BOT_TOKENS", default="").split(",") if t.strip()
+                         ]
+
+    # Hours a probed job waits for a stream choice before its keyboard expires
+    # and its downloaded source is deleted (0 keeps them forever); downloads that
+    # never finished are dropped after this or DOWNLOAD_TIMEOUT_MAX, whichever is longer
+    JOURNAL_TTL_HOURS   = _get_env("JOURNAL_TTL_HOURS", cast=float, default="24")
+
+    # Seconds /restart waits for in-flight jobs before killing our ffmpeg children
+    DRAIN_TIMEOUT       = _get_env("DRAIN_TIMEOUT", cast=int, default="600")
+
+    # Seconds the fast ffprobe pass may take; the deep fallback gets four times as long
+    PROBE_TIMEOUT       = _get_env("PROBE_TIMEOUT", cast=int, default="30")
+
+    # Floors and ceilings (seconds) of the per-stage timeouts, which otherwise
+    # follow the job's size and the throughput of recent jobs
+    DOWNLOAD_TIMEOUT_MIN = _get_env("DOWNLOAD_TIMEOUT_MIN", cast=int, default="300")
+    DOWNLOAD_TIMEOUT_MAX = _get_env("DOWNLOAD_TIMEOUT_MAX", cast=int, default="21600")
+    EXTRACT_TIMEOUT_MIN  = _get_env("EXTRACT_TIMEOUT_MIN", cast=int, default="120")
+    EXTRACT_TIMEOUT_MAX  = _get_env("EXTRACT_TIMEOUT_MAX", cast=int, default="7200")
+    UPLOAD_TIMEOUT_MIN   = _get_env("UPLOAD_TIMEOUT_MIN", cast=int, default="120")
+    UPLOAD_TIMEOUT_MAX   = _get_env("UPLOAD_TIMEOUT_MAX", cast=int, default="7200")
+
+    # Threads for blocking filesystem work (deletions, disk checks), and how
+    # often (seconds) the cached disk usage readings are refreshed
+    FS_THREADS          = _get_env("FS_THREADS", cast=int, default="2")
+    DISK_USAGE_REFRESH  = _get_env("DISK_USAGE_REFRESH", cast=float, default="5")
+
+    # Subtitles up to MEMORY_OUTPUT_MAX_MB are extracted and uploaded without
+    # temporary files, holding at most MEMORY_OUTPUT_BUDGET_MB in memory at once
+    MEMORY_OUTPUT_MAX_MB    = _get_env("MEMORY_OUTPUT_MAX_MB", cast=int, default="8")
+    MEMORY_OUTPUT_BUDGET_MB = _get_env("MEMORY_OUTPUT_BUDGET_MB", cast=int, default="64")
+
+    # Per-user quotas per QUOTA_WINDOW_HOURS (0 disables one); QUOTA_TIERS scales
+    # them per user as "user_id:multiplier,...", where 0 exempts the user
+    QUOTA_WINDOW_HOURS  = _get_env("QUOTA_WINDOW_HOURS", cast=float, default="1")
+    QUOTA_DOWNLOAD_GB   = _get_env("QUOTA_DOWNLOAD_GB", cast=float, default="20")
+    QUOTA_UPLOAD_GB     = _get_env("QUOTA_UPLOAD_GB", cast=float, default="5")
+    QUOTA_CPU_MINUTES   = _get_env("QUOTA_CPU_MINUTES", cast=float, default="30")
+    QUOTA_TIERS         = _get_env("QUOTA_TIERS", default="")
+
+    if RUN_MODE not in ("standalone", "bot", "worker"):
+        raise ValueError(f"RUN_MODE must be standalone, bot or worker (got {RUN_MODE!r})")
+
     # Warnings for truly optional variables
     if not LOG_CHANNEL:
         logger.info("LOG_CHANNEL is not set; media logs will not be sent.")
@@ -0,0 +1,470 @@
+import asyncio
+import math
+import os
+import secrets
+import sqlite3
+import time
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.types import Message
+
+from config import Config
+from helpers import job_history, lifecycle, quota, sources, stage_timeouts, state_db, workspace
+from helpers.download import SourceJob, admit, dismiss, low_disk
+from helpers.ffmpeg import (
+    codec_path, demux_subtitle, extract_stream, extract_to_memory, output_ext, output_size, release_output
+)
+from helpers.keyboards import batch_progress_keyboard
+from helpers.logger import logger, log_context
+from helpers.message_editor import edit_message
+from helpers.probe import probe, stream_entries
+from helpers.progress import download_progress
+from helpers.rate_limiter import REPLY
+from helpers.upload import deliver_stream
+
+# Stage concurrency: downloads and uploads are network-bound, extraction is CPU/disk-bound
+DOWNLOAD_WORKERS = 2
+EXTRACT_WORKERS = max(1, min(2, os.cpu_count() or 1))
+UPLOAD_WORKERS = 2
+MAX_BATCH_FILES = 30
+REFRESH_INTERVAL = 5.0
+
+# Stream policies offered for a batch: code -> (button label, {stream type: languages or None for all})
+POLICIES: Dict[str, Tuple[str, Dict[str, Optional[set]]]] = {
+    "eng": ("ENG AUDIO + ALL SUBTITLES", {"audio": {"eng", "en"}, "subtitle": None}),
+    "subs": ("ALL SUBTITLES", {"subtitle": None}),
+    "audio": ("ALL AUDIO", {"audio": None}),
+    "all": ("ALL AUDIO + SUBTITLES", {"audio": None, "subtitle": None}),
+}
+
+_ICONS = {
+    "queued": "⏳", "downloading": "⬇️", "extracting": "⚙️", "uploading": "⬆️",
+    "done": "✅", "skipped": "➖", "failed": "❌",
+}
+
+# Batch prompts awaiting a policy choice, batches currently running, and the
+# running ones a user cancelled
+_prompts: Dict[str, Dict[str, Any]] = {}
+_running: Dict[str, asyncio.Task] = {}
+_cancelled: Set[str] = set()
+
+# In bot mode batches run in worker processes: the bot records cancel requests
+# in STATE_DB and the worker running the batch polls for them. Requests for
+# batches that never show up are pruned after CANCEL_TTL seconds.
+CANCEL_TTL = 86400.0
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS batch_cancels (
+    token     TEXT PRIMARY KEY,
+    requested REAL NOT NULL
+);
+""")
+
+
+def _request_cancel(conn: sqlite3.Connection, token: str) -> None:
+    now = time.time()
+    conn.execute("DELETE FROM batch_cancels WHERE requested < ?", (now - CANCEL_TTL,))
+    conn.execute(
+        "INSERT OR REPLACE INTO batch_cancels (token, requested) VALUES (?, ?)", (token, now)
+    )
+
+
+def _take_cancel(conn: sqlite3.Connection, token: str) -> bool:
+    return conn.execute("DELETE FROM batch_cancels WHERE token = ?", (token,)).rowcount > 0
+
+
+def file_hint(message: Message) -> Tuple[int, Optional[str]]:
+    """
+    (size, name) of a message's file, for run-time predictions.
+    """
+    media = message.document or message.video
+    return getattr(media, "file_size", 0) or 0, getattr(media, "file_name", None)
+
+
+def register_prompt(messages: List[Message]) -> str:
+    """
+    Remember the files of a batch prompt; returns the token its buttons carry.
+    """
+    token = secrets.token_urlsafe(6)
+    _prompts[token] = {
+        "chat_id": messages[0].chat.id,
+        "user_id": messages[0].from_user.id,
+        "message_ids": [m.id for m in messages[:MAX_BATCH_FILES]],
+        # (size, name) per file, for the queue's run-time prediction
+        "files": [file_hint(m) for m in messages[:MAX_BATCH_FILES]],
+    }
+    return token
+
+
+def take_prompt(token: str) -> Optional[Dict[str, Any]]:
+    return _prompts.pop(token, None)
+
+
+async def cancel(token: str) -> bool:
+    """
+    Drop a pending batch prompt or cancel a running batch. True if one was
+    found here; in bot mode anything else may be a batch running in a worker,
+    which is asked to cancel it through STATE_DB.
+    """
+    prompt = _prompts.pop(token, None)
+    task = _running.get(token)
+    if task:
+        _cancelled.add(token)
+        task.cancel()
+    elif not prompt and Config.RUN_MODE == "bot":
+        await state_db.run(_request_cancel, token)
+    return bool(prompt or task)
+
+
+async def _watch_cancel(token: str, task: asyncio.Task) -> None:
+    """
+    Cancel `task` once the bot records a cancel request for the batch.
+    """
+    while not task.done():
+        try:
+            if await state_db.run(_take_cancel, token):
+                _cancelled.add(token)
+                task.cancel()
+                return
+        except Exception as e:
+            logger.warning(f"[batch] Cancel check for {token} failed: {e}")
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+
+def select(entries: Dict[str, Dict[str, Any]], policy: str) -> List[Dict[str, Any]]:
+    """
+    The stream entries of one file that a batch policy asks for.
+    """
+    wanted = POLICIES[policy][1]
+    chosen = []
+    for entry in entries.values():
+        if entry["type"] not in wanted:
+            continue
+        langs = wanted[entry["type"]]
+        if langs is None or entry["meta"].get("language", "und").lower() in langs:
+            chosen.append(entry)
+    return chosen
+
+
+class _Item:
+    """
+    One file of a batch as it moves through the stages.
+    """
+
+    def __init__(self, message: Message) -> None:
+        self.message = message
+        self.doc = message.document or message.video
+        self.name = getattr(self.doc, "file_name", None) or f"file {message.id}"
+        self.state = "queued"
+        self.detail = ""
+        self.source: Optional[Path] = None
+        self.pinned = False
+        self.chosen: List[Dict[str, Any]] = []
+        self.outputs: List[Tuple[Dict[str, Any], Union[Path, BytesIO]]] = []
+        # (job, part) of the workspace holding on-disk outputs, once created
+        self.workspace: Optional[Tuple[str, int]] = None
+
+    @property
+    def progress_key(self) -> str:
+        return f"{self.message.chat.id}_{self.message.id}"
+
+    def line(self) -> str:
+        text = f"{_ICONS[self.state]} {self.name}"
+        if self.state == "downloading":
+            pct = download_progress.get(f"{self.progress_key}_dl", {}).get("progress")
+            if pct is not None:
+                text += f" `{pct:.1f}%`"
+        if self.detail:
+            text += f" — {self.detail}"
+        return text
+
+    async def release(self) -> None:
+        """
+        Give up this item's hold on its source and outputs (idempotent).
+        """
+        if self.pinned:
+            self.pinned = False
+            sources.unpin(self.doc.file_unique_id)
+            if self.source:
+                await sources.release(self.source)
+        for _, output in self.outputs:
+            release_output(output)
+        if self.workspace:
+            await workspace.remove(*self.workspace)
+            self.workspace = None
+        for suffix in ("dl", "upload"):
+            download_progress.pop(f"{self.progress_key}_{suffix}", None)
+
+
+class _Batch:
+    def __init__(
+        self, client: Client, token: str, status_msg: Message,
+        messages: List[Message], policy: str
+    ) -> None:
+        self.client = client
+        self.token = token
+        self.status_msg = status_msg
+        self.policy = policy
+        self.items = [_Item(m) for m in messages]
+        self.user = messages[0].from_user
+        self.started = time.monotonic()
+
+    def render(self) -> str:
+        finished = sum(item.state in ("done", "skipped", "failed") for item in self.items)
+        lines = [
+            f"📦 **Batch** — {POLICIES[self.policy][0]}",
+            f"`{finished}/{len(self.items)}` finished\n",
+        ]
+        lines.extend(item.line() for item in self.items)
+        return "\n".join(lines)
+
+    async def refresh(self) -> None:
+        await edit_message(self.client, self.status_msg, self.render(),
+            reply_markup=batch_progress_keyboard(self.token),
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    # ---- stages ----
+
+    async def download(self, item: _Item) -> Optional[_Item]:
+        # Admitted like single downloads: each file takes one of the user's
+        # download slots while it transfers, and none start on a full disk
+        slot = f"batch-{self.token}-{item.message.id}"
+        refusal = await low_disk() or await admit(self.user.id, slot)
+        if refusal:
+            item.state, item.detail = "skipped", refusal.removeprefix("⚠️ ")
+            return None
+        try:
+            return await self._download(item)
+        finally:
+            await dismiss(self.user.id, slot)
+
+    async def _download(self, item: _Item) -> Optional[_Item]:
+        size = getattr(item.doc, "file_size", 0) or 0
+        wait = await quota.reserve(self.user.id, quota.DOWNLOAD, size)
+        if wait:
+            item.state, item.detail = "skipped", f"download quota, resumes in {math.ceil(wait / 60)} min"
+            return None
+        item.state = "downloading"
+        # Progress is tracked per file, not on the shared status message, and a
+        # crash mid-download restarts the file as a single download
+        source = SourceJob(self.client, item.message, None, self.user.id,
+                           f"batch-{self.token}-{item.message.id}", item.name, size)
+        await source.begin()
+        item.pinned = True
+        try:
+            results = await source.run(probe, report=False)
+        finally:
+            item.source = source.path
+            # The item holds the source until its streams are extracted
+            await source.finish(keep_source=True)
+        if not item.source:
+            raise RuntimeError("download failed")
+        info = results["probe"]
+        entries, _ = stream_entries(info, item.source, item.name, self.user, None)
+        item.chosen = select(entries, self.policy)
+        if not item.chosen:
+            item.state, item.detail = "skipped", "no matching streams"
+            await item.release()
+            return None
+        item.state, item.detail = "queued", f"{len(item.chosen)} stream(s) to extract"
+        return item
+
+    async def extract(self, item: _Item) -> Optional[_Item]:
+        item.state = "extracting"
+        part = (f"batch-{self.token}", item.message.id)
+        output_dir = workspace.path(*part)
+        stem = Path(item.name).stem
+        timed_out = False
+        for entry in item.chosen:
+            lang = entry["meta"].get("language", "und")
+            out = output_dir / f"{stem}.{entry['map']}.{lang}.{output_ext(entry)}"
+            started = time.monotonic()
+            try:
+                # Text subtitles in Matroska are read without ffmpeg
+                demuxed = await demux_subtitle(item.source, entry, out)
+                if demuxed is not None:
+                    if not isinstance(demuxed, BytesIO):
+                        # Written into the workspace, which it created
+                        item.workspace, demuxed = part, out
+                    item.outputs.append((entry, demuxed))
+                    await self._record_extract(item, entry, started, "demux")
+                    continue
+                # Small subtitles stay in memory; everything else goes to disk
+                buf = await extract_to_memory(item.source, entry, out.name)
+                if buf:
+                    item.outputs.append((entry, buf))
+                    await self._record_extract(item, entry, started)
+                    continue
+                if not item.workspace:
+                    item.workspace = part
+                    workspace.create(*part)
+                if await extract_stream(item.source, entry, out):
+                    item.outputs.append((entry, out))
+                    await self._record_extract(item, entry, started)
+            except stage_timeouts.StageTimeout:
+                # The other streams of a file this slow would hang too
+                timed_out = True
+                break
+        # The source is no longer needed by this batch
+        if item.pinned:
+            item.pinned = False
+            sources.unpin(item.doc.file_unique_id)
+            await sources.release(item.source)
+        if not item.outputs:
+            raise RuntimeError("extraction timed out" if timed_out else "extraction failed")
+        failed = len(item.chosen) - len(item.outputs)
+        item.state, item.detail = "queued", f"{len(item.outputs)} file(s) to upload"
+        if failed:
+            item.detail += f", {failed} failed"
+        return item
+
+    async def _record_extract(
+        self, item: _Item, entry: Dict[str, Any], started: float, path: Optional[str] = None
+    ) -> None:
+        await job_history.record(
+            job_history.EXTRACT, time.monotonic() - started, getattr(item.doc, "file_size", 0),
+            item.name, path or codec_path(entry), entry.get("name", "")
+        )
+
+    async def upload(self, item: _Item) -> None:
+        item.state = "uploading"
+        start = time.monotonic()
+        for entry, output in item.outputs:
+            started = time.monotonic()
+            await deliver_stream(
+                self.client, entry["type"], item.message.chat.id,
+                output if isinstance(output, BytesIO) else str(output),
+                self.user.first_name or "<unknown>", self.user.id, entry.get("meta"),
+                ("upload", None, start, item.message),
+                reply_to_message_id=item.message.id
+            )
+            await quota.charge(self.user.id, quota.UPLOAD, output_size(output))
+            await job_history.record(job_history.UPLOAD, time.monotonic() - started, output_size(output),
+                                     item.name, entry["type"], entry.get("name", ""))
+        item.state, item.detail = "done", ""
+        await item.release()
+
+    # ---- pipeline ----
+
+    async def _stage(
+        self,
+        fn: Callable[[_Item], Awaitable[Optional[_Item]]],
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue],
+        workers: int,
+        next_workers: int
+    ) -> None:
+        async def work() -> None:
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    return
+                try:
+                    result = await fn(item)
+                except Exception as e:
+                    logger.exception(f"[batch] {fn.__name__} failed for {item.name}")
+                    item.state, item.detail = "failed", str(e) or type(e).__name__
+                    await item.release()
+                    continue
+                if result is not None and outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(work() for _ in range(workers)))
+        if outbox is not None:
+            for _ in range(next_workers):
+                await outbox.put(None)
+
+    async def _refresher(self, done: asyncio.Event) -> None:
+        while not done.is_set():
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"[batch] progress update failed: {e}")
+            try:
+                await asyncio.wait_for(done.wait(), REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> None:
+        # Bounded hand-off queues keep downloads at most a couple of files ahead
+        downloads: asyncio.Queue = asyncio.Queue()
+        extracts: asyncio.Queue = asyncio.Queue(maxsize=EXTRACT_WORKERS)
+        uploads: asyncio.Queue = asyncio.Queue(maxsize=UPLOAD_WORKERS)
+        for item in self.items:
+            downloads.put_nowait(item)
+        for _ in range(DOWNLOAD_WORKERS):
+            downloads.put_nowait(None)
+
+        done = asyncio.Event()
+        refresher = asyncio.create_task(self._refresher(done))
+        try:
+            await asyncio.gather(
+                self._stage(self.download, downloads, extracts, DOWNLOAD_WORKERS, EXTRACT_WORKERS),
+                self._stage(self.extract, extracts, uploads, EXTRACT_WORKERS, UPLOAD_WORKERS),
+                self._stage(self.upload, uploads, None, UPLOAD_WORKERS, 0),
+            )
+        except asyncio.CancelledError:
+            for item in self.items:
+                if item.state not in ("done", "skipped", "failed"):
+                    item.state, item.detail = "failed", "cancelled"
+            raise
+        finally:
+            done.set()
+            await refresher
+            for item in self.items:
+                await item.release()
+            elapsed = int(time.monotonic() - self.started)
+            try:
+                await edit_message(self.client, self.status_msg,
+                    self.render() + f"\n\nFinished in `{elapsed}s`.",
+                    parse_mode=ParseMode.MARKDOWN,
+                    priority=REPLY,
+                    final=True
+                )
+            except Exception as e:
+                logger.warning(f"[batch] final update failed: {e}")
+
+
+async def run_batch(
+    client: Client,
+    token: str,
+    status_msg: Message,
+    messages: List[Message],
+    policy: str
+) -> None:
+    """
+    Run a batch of files through pipelined download → extract → upload stages,
+    so file N+1 downloads while file N extracts and file N-1 uploads.
+    """
+    messages = [m for m in messages if m and not m.empty and (m.document or m.video)]
+    if not messages:
+        await edit_message(client, status_msg, "❌ None of the batch files are available any more.",
+                           priority=REPLY, final=True)
+        return
+    batch = _Batch(client, token, status_msg, messages, policy)
+    label = f"batch of {len(messages)} for user {batch.user.id}"
+    watcher = None
+    try:
+        with lifecycle.track_job(f"batch-{token}", label), \
+                log_context(job=f"batch-{token}", user=batch.user.id, stage="batch"):
+            logger.info(f"[batch] Starting {label} with policy {policy}")
+            # Its own task, so cancelling the batch never cancels the caller
+            # (in a worker, the job loop that claimed it)
+            task = _running[token] = asyncio.create_task(batch.run())
+            if Config.RUN_MODE == "worker":
+                watcher = asyncio.create_task(_watch_cancel(token, task))
+            await task
+    except asyncio.CancelledError:
+        if token not in _cancelled:
+            raise
+        logger.info(f"[batch] {token} cancelled")
+    finally:
+        if watcher:
+            watcher.cancel()
+        _running.pop(token, None)
+        _cancelled.discard(token)
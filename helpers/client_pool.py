@@ -0,0 +1,172 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pyrogram import Client
+
+from config import Config
+from helpers.logger import logger
+
+# Weight of the latest transfer in a client's smoothed throughput
+_EWMA = 0.3
+
+
+def _rate(value: float) -> str:
+    return f"{value / (1024 * 1024):.2f} MB/s"
+
+
+class _Member:
+    """
+    One bot identity that transfers files, with its load and throughput.
+    """
+
+    def __init__(self, name: str, client: Optional[Client], primary: bool) -> None:
+        self.name = name
+        self.client = client
+        self.primary = primary
+        self.active = 0
+        self.transfers = 0
+        self.failures = 0
+        self.floods = 0
+        self.bytes = 0
+        self.throughput = 0.0
+        self.blocked_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.blocked_until
+
+
+class ClientPool:
+    """
+    Helper bots (HELPER_BOT_TOKENS) that take transfers off the primary bot.
+
+    Helpers never talk to users: they can only reach files through the log
+    channels, so a helper download reads the log-channel copy of the user's
+    file and a helper upload posts to LOG_CHANNEL for the primary bot to copy
+    on to the user. Each transfer goes to the least loaded client that is not
+    sitting out a FloodWait; without helpers everything stays on the primary.
+    """
+
+    def __init__(self) -> None:
+        self.primary = _Member("primary", None, True)
+        self.helpers: List[_Member] = []
+
+    async def start(self, primary: Client, tokens: List[str]) -> None:
+        """
+        Start one client per helper token. Helpers that fail to start are skipped.
+        """
+        self.primary.client = primary
+        for n, token in enumerate(tokens, 1):
+            client = Client(
+                f"{primary.name}-helper-{n}",
+                bot_token=token,
+                api_id=Config.APP_ID,
+                api_hash=Config.API_HASH,
+                no_updates=True,
+                max_concurrent_transmissions=Config.MAX_CONCURRENT_TRANSMISSIONS,
+            )
+            try:
+                await client.start()
+                me = await client.get_me()
+            except Exception as e:
+                logger.error(f"[pool] Helper bot {n} failed to start: {e}")
+                continue
+            self.helpers.append(_Member(f"@{me.username}", client, False))
+        if self.helpers:
+            logger.info(f"[pool] Started {len(self.helpers)} helper bot(s): "
+                        f"{', '.join(m.name for m in self.helpers)}")
+
+    async def stop(self) -> None:
+        for member in self.helpers:
+            try:
+                await member.client.stop()
+            except Exception as e:
+                logger.warning(f"[pool] Failed to stop {member.name}: {e}")
+        self.helpers.clear()
+
+    def _pick(self, helpers_ok: bool) -> _Member:
+        now = time.monotonic()
+        candidates = [m for m in self.helpers if helpers_ok and m.available(now)]
+        if self.primary.available(now) or not candidates:
+            candidates.append(self.primary)
+        # Ties go to helpers, keeping the primary free for user interaction
+        return min(candidates, key=lambda m: (m.active, m.primary))
+
+    def prefers_helper(self) -> bool:
+        """
+        Whether a transfer leased now would go to a helper bot.
+        """
+        return not self._pick(True).primary
+
+    @asynccontextmanager
+    async def lease(self, helpers_ok: bool = True) -> AsyncIterator[_Member]:
+        """
+        The client to run one transfer on. A yielded primary member means "use
+        your own client"; `helpers_ok=False` pins the transfer to the primary.
+        """
+        member = self._pick(helpers_ok)
+        member.active += 1
+        try:
+            yield member
+        except Exception:
+            member.failures += 1
+            raise
+        finally:
+            member.active -= 1
+
+    def record(self, member: _Member, size: int, elapsed: float) -> None:
+        """
+        Account a finished transfer of `size` bytes.
+        """
+        member.transfers += 1
+        member.bytes += size
+        if elapsed > 0:
+            rate = size / elapsed
+            member.throughput = rate if not member.throughput else (
+                _EWMA * rate + (1 - _EWMA) * member.throughput
+            )
+
+    def flood(self, member: _Member, seconds: float) -> None:
+        """
+        Take a client out of rotation for a FloodWait; its transfers fail over.
+        """
+        member.floods += 1
+        member.blocked_until = time.monotonic() + seconds
+        logger.warning(f"[pool] {member.name} hit FloodWait {seconds:.0f}s; failing over")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "name": m.name,
+                "active": m.active,
+                "transfers": m.transfers,
+                "failures": m.failures,
+                "floods": m.floods,
+                "bytes": m.bytes,
+                "throughput": m.throughput,
+                "blocked": max(0.0, m.blocked_until - now),
+            }
+            for m in [self.primary, *self.helpers]
+        ]
+
+
+def format_pool(title: str, snap: List[Dict[str, Any]]) -> List[str]:
+    """
+    /status lines for a pool snapshot; nothing when there are no helpers.
+    """
+    if len(snap) < 2:
+        return []
+    lines = [f"**{title}**:"]
+    for m in snap:
+        blocked = f", flood wait `{m['blocked']:.0f}s`" if m["blocked"] else ""
+        lines.append(
+            f"• `{m['name']}`: `{m['active']}` active, `{m['transfers']}` done, "
+            f"`{_rate(m['throughput'])}`, `{m['floods']}` floods{blocked}"
+        )
+    lines.append("")
+    return lines
+
+
+# Shared by every download and upload in this process
+pool = ClientPool()
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from helpers import sources, stage_timeouts, workspace
+from helpers.logger import logger
+from helpers.message_editor import edit_message
+from helpers.probe import probe
+from helpers.progress import human_readable_bytes
+from helpers.tools import execute
+from helpers.transfer_control import transfers
+
+# Telegram serves files in 1 MiB chunks; partial downloads work in whole chunks
+CHUNK = 1024 * 1024
+# Container headers (MP4 moov, MKV SeekHead/Tracks) sit at the start and
+# indexes (MKV Cues, a trailing moov) usually at the end
+HEAD_CHUNKS = 4
+TAIL_CHUNKS = 8
+# Clips needing more than this share of the file are downloaded in full
+MAX_PARTIAL_SHARE = 0.5
+# Ranges estimated from the average bitrate are widened by this share of the
+# file on each side to absorb bitrate variation
+ESTIMATE_MARGIN = 0.02
+# The fetched packets must reach this close (seconds) to the clip edges
+EDGE_TOLERANCE = 2.0
+
+_TS = r"\d+(?::\d{1,2}){0,2}(?:\.\d+)?"
+_CLIP_RE = re.compile(rf"\bclip\s+({_TS})\s*-\s*({_TS})\b", re.IGNORECASE)
+
+Clip = Tuple[float, float]
+
+
+def parse_timestamp(value: str) -> float:
+    """
+    Seconds in "SS", "MM:SS" or "HH:MM:SS" (each optionally with a fraction).
+    """
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def format_timestamp(seconds: float) -> str:
+    h, rest = divmod(int(seconds), 3600)
+    m, s = divmod(rest, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
+def parse_clip(text: Optional[str]) -> Optional[Clip]:
+    """
+    The (start, end) time range of a "clip 01:02:03-01:02:13" caption, if any.
+    """
+    match = _CLIP_RE.search(text or "")
+    if not match:
+        return None
+    start, end = parse_timestamp(match.group(1)), parse_timestamp(match.group(2))
+    if end <= start:
+        return None
+    return start, end
+
+
+def format_clip(clip: Clip) -> str:
+    return f"{format_timestamp(clip[0])}–{format_timestamp(clip[1])}"
+
+
+def apply_clip(entries: Dict[str, Dict[str, Any]], clip: Clip) -> None:
+    """
+    Restrict probed extraction entries to a time range.
+    """
+    for entry in entries.values():
+        entry["clip"] = list(clip)
+        entry["meta"]["duration"] = int(clip[1] - clip[0])
+
+
+def seek_args(entry: Dict[str, Any]) -> List[str]:
+    """
+    Input-side seek options for an entry's clip: ffmpeg jumps through the
+    container index instead of reading up to the start. Stream copy cuts at
+    the nearest packet boundary; re-encoding decodes from there and trims exactly.
+    """
+    clip = entry.get("clip")
+    if not clip:
+        return []
+    return ["-ss", f"{clip[0]:.3f}", "-to", f"{clip[1]:.3f}"]
+
+
+# ---- partial download ----
+
+class _SparseFile:
+    """
+    A file of the full media size holding only the chunks fetched so far.
+    """
+
+    def __init__(self, client: Client, media: Message, path: Path, size: int, key: str) -> None:
+        self.client = client
+        self.media = media
+        self.path = path
+        self.size = size
+        self.key = key
+        self.chunks = -(-size // CHUNK)
+        self.have: Set[int] = set()
+        self.fetched = 0
+
+    def _create(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.truncate(self.size)
+
+    async def create(self) -> None:
+        await asyncio.to_thread(self._create)
+
+    def covers(self, pos: int, size: int) -> bool:
+        last = max(pos, pos + size - 1)
+        return all(i in self.have for i in range(pos // CHUNK, last // CHUNK + 1))
+
+    async def fetch(self, wanted: Iterable[int]) -> None:
+        """
+        Download the missing chunks among `wanted`, one request per contiguous run.
+        """
+        missing = sorted({i for i in wanted if 0 <= i < self.chunks} - self.have)
+        runs: List[List[int]] = []
+        for i in missing:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+
+        async def fetch_run(fd: int, run: List[int]) -> None:
+            index = run[0]
+            async for data in self.client.stream_media(self.media, offset=run[0], limit=len(run)):
+                await asyncio.to_thread(os.pwrite, fd, data, index * CHUNK)
+                self.have.add(index)
+                self.fetched += len(data)
+                transfers.record(self.key, self.fetched)
+                index += 1
+
+        fd = await asyncio.to_thread(os.open, self.path, os.O_WRONLY)
+        try:
+            for run in runs:
+                async with transfers.slot():
+                    # A stalled run raises StageTimeout; the caller falls back
+                    # to a full download
+                    await stage_timeouts.bounded(
+                        stage_timeouts.DOWNLOAD, "clip", len(run) * CHUNK, self.path.name, fetch_run(fd, run)
+                    )
+        finally:
+            await asyncio.to_thread(os.close, fd)
+
+    def byte_chunks(self, start: int, end: int) -> range:
+        start = max(0, start)
+        end = min(self.size, end)
+        return range(start // CHUNK, max(start, end - 1) // CHUNK + 1)
+
+
+async def _clip_packets(path: Path, clip: Clip) -> List[Dict[str, Any]]:
+    """
+    Packets (time, byte position, size) of every stream inside the clip. For
+    MP4/MOV the positions come straight from the sample index, so they are
+    exact even where the data itself hasn't been fetched yet.
+    """
+    cmd = [
+        "ffprobe", "-v", "quiet",
+        "-read_intervals", f"{clip[0]:.3f}%{clip[1]:.3f}",
+        "-show_entries", "packet=pts_time,pos,size",
+        "-print_format", "json",
+        str(path)
+    ]
+    out, err, code, _ = await execute(cmd)
+    if code != 0:
+        return []
+    packets = []
+    for packet in json.loads(out or "{}").get("packets", []):
+        try:
+            packets.append({
+                "time": float(packet["pts_time"]),
+                "pos": int(packet["pos"]),
+                "size": int(packet.get("size", 0)),
+            })
+        except (KeyError, TypeError, ValueError):
+            continue
+    return packets
+
+
+def _reaches(packets: List[Dict[str, Any]], clip: Clip, duration: float) -> bool:
+    if not packets:
+        return False
+    first = min(p["time"] for p in packets)
+    last = max(p["time"] for p in packets)
+    return (
+        first <= clip[0] + EDGE_TOLERANCE
+        and last >= min(clip[1], duration) - EDGE_TOLERANCE
+    )
+
+
+async def fetch_clip_source(
+    client: Client,
+    media: Message,
+    status_msg: Message,
+    clip: Clip,
+    job: str
+) -> Tuple[Optional[Path], int]:
+    """
+    Download only the parts of `media` that a clip needs: the container header
+    and index, plus the byte range holding the clip's packets (taken from the
+    index for MP4/MOV, estimated from the bitrate otherwise). The result is a
+    sparse file of the full size that ffmpeg can seek in.
+
+    Returns (sparse file, bytes fetched). The path is None when a partial
+    download can't be trusted; the caller then downloads the whole file.
+    """
+    doc = media.document or media.video
+    size = getattr(doc, "file_size", 0)
+    fname = getattr(doc, "file_name", None) or "media"
+    if not size or size <= (HEAD_CHUNKS + TAIL_CHUNKS) * CHUNK:
+        return None, 0
+
+    # Kept apart from the shared source directory: a sparse file of the right
+    # size must never be mistaken for a complete download
+    path = workspace.path(job, "clip", fname)
+    sparse = _SparseFile(client, media, path, size, f"{job}_clip")
+    try:
+        await sparse.create()
+        await edit_message(client, status_msg, f"✂️ Reading the index of **{fname}**…")
+        await sparse.fetch(list(range(HEAD_CHUNKS)) + list(range(sparse.chunks - TAIL_CHUNKS, sparse.chunks)))
+
+        info = await probe(path)
+        fmt = info.get("format", {})
+        duration = float(fmt.get("duration") or 0)
+        if duration <= 0 or clip[0] >= duration:
+            logger.info(f"[clip] {fname}: no usable duration ({duration}), downloading in full")
+            return await _abandon(path), sparse.fetched
+
+        share = (min(clip[1], duration) - clip[0]) / duration
+        if share > MAX_PARTIAL_SHARE:
+            logger.info(f"[clip] {fname}: clip covers {share:.0%} of the file, downloading in full")
+            return await _abandon(path), sparse.fetched
+
+        wanted: Set[int] = set()
+        if "mp4" in fmt.get("format_name", "") or "mov" in fmt.get("format_name", ""):
+            packets = await _clip_packets(path, clip)
+            if _reaches(packets, clip, duration):
+                low = min(p["pos"] for p in packets)
+                high = max(p["pos"] + p["size"] for p in packets)
+                wanted.update(sparse.byte_chunks(low, high))
+        if not wanted:
+            margin = size * ESTIMATE_MARGIN
+            wanted.update(sparse.byte_chunks(
+                int(size * clip[0] / duration - margin),
+                int(size * min(clip[1], duration) / duration + margin)
+            ))
+
+        await edit_message(client, status_msg,
+            f"✂️ Fetching clip {format_clip(clip)} of **{fname}** "
+            f"(`{human_readable_bytes(len(wanted) * CHUNK)}` of `{human_readable_bytes(size)}`)…")
+        await sparse.fetch(wanted)
+
+        # Re-read the clip from what was fetched; any packet outside the
+        # fetched chunks (or a clip cut short) means the estimate missed
+        packets = await _clip_packets(path, clip)
+        if not _reaches(packets, clip, duration):
+            logger.info(f"[clip] {fname}: fetched range misses the clip, downloading in full")
+            return await _abandon(path), sparse.fetched
+        outside = {
+            i for p in packets if not sparse.covers(p["pos"], p["size"])
+            for i in sparse.byte_chunks(p["pos"], p["pos"] + p["size"])
+        }
+        if outside:
+            if len(sparse.have) + len(outside) > sparse.chunks * MAX_PARTIAL_SHARE:
+                return await _abandon(path), sparse.fetched
+            await sparse.fetch(outside)
+
+        logger.info(
+            f"[clip] {fname}: fetched {human_readable_bytes(sparse.fetched)} "
+            f"of {human_readable_bytes(size)} for {format_clip(clip)}"
+        )
+        return path.resolve(), sparse.fetched
+
+    except asyncio.CancelledError:
+        await _abandon(path)
+        raise
+    except Exception:
+        logger.exception(f"[clip] Partial download of {fname} failed")
+        return await _abandon(path), sparse.fetched
+
+
+async def _abandon(path: Path) -> None:
+    await sources.release(path)
+    return None
@@ -1,18 +1,29 @@
 import asyncio
-import json
-import shutil
+import os
+import secrets
+import socket
+import sqlite3
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from pyrogram import Client
 from pyrogram.enums import ParseMode
-from pyrogram.errors import MessageNotModified, UsernameNotOccupied
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
+from pyrogram.errors import FloodWait, UsernameNotOccupied
+from pyrogram.types import Message
 
 from config import Config
-from helpers.logger import logger
+from helpers import fs, job_history, journal, lifecycle, pipeline, quota, sources, stage_timeouts, state_db
+from helpers.client_pool import pool
+from helpers.clip import Clip, apply_clip, fetch_clip_source, format_clip, parse_clip
+from helpers.keyboards import DOWNLOAD_PROGRESS_KEYBOARD, stream_keyboard
+from helpers.logger import logger, log_context
+from helpers.message_editor import edit_message
+from helpers.rate_limiter import api_call, REPLY, LOG
+from helpers.probe import probe, stream_entries
 from helpers.progress import progress_func, download_progress, callback_progress
-from helpers.tools import execute, clean_up
+from helpers.tools import clean_up
+from helpers.transfer_control import transfers
 
 # --- Configuration & Shared State ---
 MAX_DOWNLOADS_PER_USER = Config.MAX_DOWNLOAD_LIMIT
@@ -20,9 +31,26 @@ THRESHOLD_BYTES = Config.THRESHOLD * 1024 ** 3
 MOUNT_POINT = Path(Config.MOUNT_POINT)
 LOG_CHANNEL = Config.LOG_MEDIA_CHANNEL or Config.LOG_CHANNEL
 
-_LOCK = asyncio.Lock()
-_user_download_counts: Dict[int, int] = {}
-_active_downloads: Dict[str, Any] = {}
+# Download slots live in STATE_DB, so MAX_DOWNLOAD_LIMIT holds per user
+# across all bot-mode workers. Each process refreshes its slots every
+# SLOT_REFRESH seconds; slots older than SLOT_STALE belong to a dead process.
+SLOT_REFRESH = 15.0
+SLOT_STALE = 60.0
+_OWNER = f"{socket.gethostname()}-{os.getpid()}"
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS download_slots (
+    key      TEXT PRIMARY KEY,
+    user_id  INTEGER NOT NULL,
+    owner    TEXT NOT NULL,
+    updated  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS download_slots_user ON download_slots(user_id);
+""")
+
+# Slots held by this process: key -> user_id
+_active_downloads: Dict[str, int] = {}
+_slot_keeper: Optional[asyncio.Task] = None
 
 
 async def download_file(client: Client, message: Message) -> None:
@@ -30,32 +58,43 @@ async def download_file(client: Client, message: Message) -> None:
     Handle a user's download request:
       1. Enforce per-user and global download limits
       2. Validate media and disk space
-      3. Download with retries and progress tracking
-      4. Forward to log channel
-      5. Probe streams and prompt user for extraction
+      3. Download with retries and progress tracking (only the needed byte
+         ranges when the caption asks for a clip)
+      4. Probe streams and prompt user for extraction, while the file is
+         forwarded to the log channel
     """
+    job = journal.job_key(message.chat.id, message.id)
+    with log_context(job=job, user=message.from_user.id, stage="download"):
+        await _download_file(client, message)
+
+
+async def _download_file(client: Client, message: Message) -> None:
     user_id = message.from_user.id
     op_msg: Optional[Message] = None
-    download_path: Optional[Path] = None
+    source: Optional[SourceJob] = None
     unique_key = f"{message.chat.id}_{message.id}_dl"
+    job = journal.job_key(message.chat.id, message.id)
+    keep_journal = False
+    # Download quota taken at admission, settled by the source job
+    reserved = 0
+
+    if lifecycle.is_draining():
+        await api_call(message.chat.id, REPLY, message.reply_text, lifecycle.DRAIN_MESSAGE)
+        return
 
     # Reserve a download slot
-    async with _LOCK:
-        _user_download_counts.setdefault(user_id, 0)
-        if _user_download_counts[user_id] >= MAX_DOWNLOADS_PER_USER:
-            await message.reply_text(f"⚠️ You already have {MAX_DOWNLOADS_PER_USER} active downloads.")
-            return
-        if len(_active_downloads) >= int(MAX_DOWNLOADS_PER_USER)*5:
-            await message.reply_text(f"⚠️ Server busy with {len(_active_downloads)} downloads. Please try later.")
-            return
-        _user_download_counts[user_id] += 1
-        _active_downloads[unique_key] = {}
+    refusal = await admit(user_id, unique_key)
+    if refusal:
+        await api_call(message.chat.id, REPLY, message.reply_text, refusal)
+        return
+    # Under the job's key, which its source job takes over once it begins
+    lifecycle.begin_job(job, f"download for user {user_id}")
 
     try:
         # Validate replied media
         media = message
         if not media or not (media.document or media.video):
-            await message.reply_text("⚠️ Please reply to a valid media file.")
+            await api_call(message.chat.id, REPLY, message.reply_text, "⚠️ Please reply to a valid media file.")
             return
 
         doc = media.document or media.video
@@ -64,19 +103,25 @@ async def download_file(client: Client, message: Message) -> None:
         nice_size = f"{fsize / (1024**2):.2f} MB" if fsize else "Unknown size"
 
         # Disk space check
-        free_bytes = shutil.disk_usage(MOUNT_POINT)[2]
-        if free_bytes < THRESHOLD_BYTES:
-            await message.reply_text(f"⚠️ Low disk space ({free_bytes / (1024**3):.2f} GB available).")
+        refusal = await low_disk()
+        if refusal:
+            await api_call(message.chat.id, REPLY, message.reply_text, refusal)
+            return
+
+        # Per-user bandwidth quota, reserved up front and settled once the
+        # real transfer size is known
+        wait = await quota.reserve(user_id, quota.DOWNLOAD, fsize)
+        if wait:
+            await api_call(message.chat.id, REPLY, message.reply_text, quota.exhausted_message(quota.DOWNLOAD, wait))
             return
+        reserved = fsize
 
         # Initial status message with progress button
-        op_msg = await client.send_message(
+        op_msg = await api_call(message.chat.id, REPLY, client.send_message,
             chat_id=message.chat.id,
             text=f"▶️ Downloading **{fname}** ({nice_size})...",
             reply_to_message_id=media.id,
-            reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("Check Progress", callback_data="progress_msg_download")]]
-            ),
+            reply_markup=DOWNLOAD_PROGRESS_KEYBOARD,
             parse_mode=ParseMode.MARKDOWN
         )
         # mark callback tracking
@@ -91,53 +136,372 @@ async def download_file(client: Client, message: Message) -> None:
             "eta": "calculating"
         }
 
-        # Download media with retry logic
-        download_path = await _download_with_retries(
-            client, media, op_msg, original_size=fsize
-        )
-        if not download_path:
-            await op_msg.edit_text(f"❌ Failed to download **{fname}** after retries.")
-            return
+        # A "clip HH:MM:SS-HH:MM:SS" caption only needs part of the file,
+        # unless a complete copy is already on disk
+        clip = parse_clip(message.caption)
+        source = SourceJob(client, media, op_msg, user_id, job, fname, reserved)
+        await source.begin()
 
-        # Forward to logging channel
-        await _forward_to_log(client, media, fname)
+        async def ask(path: Path) -> bool:
+            return await _probe_and_ask_streams(client, path, fname, op_msg, message, clip)
 
-        # Probe streams and prompt user
-        await _probe_and_ask_streams(client, download_path, fname, op_msg, message)
+        results = await source.run(ask, clip=clip)
+        keep_journal = bool(results["probe"])
 
+    except asyncio.CancelledError:
+        # Shutting down mid-job: leave the journal entry so the job resumes
+        keep_journal = True
+        raise
     except Exception:
         logger.exception("download_file: unexpected error")
         if message:
-            await message.reply_text("❌ An internal error occurred.")
+            await api_call(message.chat.id, REPLY, message.reply_text, "❌ An internal error occurred.")
     finally:
+        if source:
+            await source.finish(keep_journal)
+        elif reserved:
+            await quota.charge(user_id, quota.DOWNLOAD, -reserved)
         # Cleanup progress tracking
         if op_msg:
             callback_progress.pop(f"{op_msg.chat.id}_{op_msg.id}_callback", None)
         # Release slot
-        async with _LOCK:
-            _user_download_counts[user_id] = max(0, _user_download_counts.get(user_id, 1) - 1)
-            _active_downloads.pop(unique_key, None)
-            download_progress.pop(unique_key, None)
+        await dismiss(user_id, unique_key)
+        download_progress.pop(unique_key, None)
+        lifecycle.end_job(job)
+
+
+def _take_slot(conn: sqlite3.Connection, key: str, user_id: int, owner: str) -> Optional[str]:
+    now = time.time()
+    conn.execute("DELETE FROM download_slots WHERE updated < ?", (now - SLOT_STALE,))
+    held = conn.execute("SELECT COUNT(*) FROM download_slots WHERE user_id = ?", (user_id,)).fetchone()[0]
+    if held >= MAX_DOWNLOADS_PER_USER:
+        return f"⚠️ You already have {MAX_DOWNLOADS_PER_USER} active downloads."
+    active = conn.execute("SELECT COUNT(*) FROM download_slots").fetchone()[0]
+    if active >= int(MAX_DOWNLOADS_PER_USER)*5:
+        return f"⚠️ Server busy with {active} downloads. Please try later."
+    conn.execute(
+        "INSERT OR REPLACE INTO download_slots (key, user_id, owner, updated) VALUES (?, ?, ?, ?)",
+        (key, user_id, owner, now),
+    )
+    return None
+
+
+def _give_slot(conn: sqlite3.Connection, key: str, owner: str) -> None:
+    conn.execute("DELETE FROM download_slots WHERE key = ? AND owner = ?", (key, owner))
+
+
+def _refresh_slots(conn: sqlite3.Connection, owner: str) -> None:
+    conn.execute("UPDATE download_slots SET updated = ? WHERE owner = ?", (time.time(), owner))
+
+
+async def _keep_slots() -> None:
+    while _active_downloads:
+        await asyncio.sleep(SLOT_REFRESH)
+        try:
+            await state_db.run(_refresh_slots, _OWNER)
+        except Exception as e:
+            logger.warning(f"Failed to refresh download slots: {e}")
+
+
+async def admit(user_id: int, key: str) -> Optional[str]:
+    """
+    Take one of the user's MAX_DOWNLOAD_LIMIT download slots, and one of the
+    server's, under `key`. Returns why the download was refused, or None.
+    """
+    global _slot_keeper
+    try:
+        refusal = await state_db.run(_take_slot, key, user_id, _OWNER)
+    except Exception as e:
+        # Limits protect fairness, not correctness; never block a job on them
+        logger.error(f"Download slot for {user_id} failed: {e}")
+        refusal = None
+    if refusal:
+        return refusal
+    _active_downloads[key] = user_id
+    if _slot_keeper is None or _slot_keeper.done():
+        _slot_keeper = asyncio.create_task(_keep_slots())
+    return None
+
+
+async def dismiss(user_id: int, key: str) -> None:
+    """
+    Give back a slot taken by `admit`.
+    """
+    if _active_downloads.pop(key, None) is None:
+        return
+    try:
+        await state_db.run(_give_slot, key, _OWNER)
+    except Exception as e:
+        logger.error(f"Releasing download slot {key} failed: {e}")
+
+
+async def low_disk() -> Optional[str]:
+    """
+    Why no download may start while free space is below THRESHOLD, or None.
+    """
+    free_bytes = (await fs.disk_usage(MOUNT_POINT)).free
+    if free_bytes < THRESHOLD_BYTES:
+        return f"⚠️ Low disk space ({free_bytes / (1024**3):.2f} GB available)."
+    return None
+
+
+def source_stages(
+    fetch: Callable[[pipeline.Results], Awaitable[Any]],
+    log: Callable[[pipeline.Results], Awaitable[Any]],
+    probe_fn: Callable[[pipeline.Results], Awaitable[Any]]
+) -> List[pipeline.Stage]:
+    """
+    The "download", "log" (log-channel copy) and "probe" stages of a job.
+
+    The copy runs alongside probing and may finish after the job, so the
+    user never waits on the rate-limited log channel. Only a download that
+    lands on a helper bot makes it up front (see LogCopy).
+    """
+    return [
+        pipeline.Stage("download", fetch),
+        pipeline.Stage("log", log, after=("download",), critical=False, detach=True),
+        pipeline.Stage("probe", probe_fn, after=("download",)),
+    ]
+
+
+class LogCopy:
+    """
+    The log-channel copy of a user's file, made at most once. Helper bots
+    reach the file only through it, so a download leased to a helper makes
+    it first; otherwise the job's "log" stage makes it after the download.
+    """
+
+    def __init__(self, client: Client, media: Message, fname: str) -> None:
+        self.client = client
+        self.media = media
+        self.fname = fname
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def failed(self) -> bool:
+        """
+        Whether the copy was attempted and there is none to read.
+        """
+        if not LOG_CHANNEL:
+            return True
+        return bool(self._task and self._task.done() and not self._task.cancelled() and not self._task.result())
+
+    async def get(self) -> Optional[Message]:
+        if self._task is None:
+            self._task = asyncio.create_task(forward_to_log(self.client, self.media, self.fname))
+        # Shielded: the download and the log stage may both be waiting on it
+        return await asyncio.shield(self._task)
+
+
+class SourceJob:
+    """
+    A job fetching a user's file, as single downloads and batch items share
+    it: the file is pinned and journaled while it downloads, the download
+    quota reserved at admission is settled on the bytes actually transferred,
+    and the download, log-channel copy and probe run as the job's source stages.
+    Batch items have no `status_msg` of their own and run without `report`.
+    """
+
+    def __init__(
+        self, client: Client, media: Message, status_msg: Optional[Message], user_id: int,
+        job: str, name: str, reserved: int
+    ) -> None:
+        self.client = client
+        self.media = media
+        self.status_msg = status_msg
+        self.user_id = user_id
+        self.job = job
+        self.name = name
+        self.doc = media.document or media.video
+        self.size = getattr(self.doc, "file_size", 0) or 0
+        self.reserved = reserved
+        self.used = 0
+        self.path: Optional[Path] = None
+        self.pinned = False
+
+    async def begin(self) -> None:
+        """
+        Pin the file and journal the job as downloading; a drain waits for it.
+        """
+        lifecycle.begin_job(self.job, f"download of {self.name} for user {self.user_id}")
+        sources.pin(self.doc.file_unique_id)
+        self.pinned = True
+        await journal.record_download(
+            self.job, self.user_id, self.media.chat.id, self.media.id, self.name,
+            self.status_msg.id if self.status_msg else None
+        )
+
+    async def run(
+        self,
+        probe_fn: Callable[[Path], Awaitable[Any]],
+        clip: Optional[Clip] = None,
+        report: bool = True
+    ) -> pipeline.Results:
+        """
+        Fetch the file (only `clip`'s byte ranges when given, unless a complete
+        copy is on disk), then run `probe_fn` on it while the log-channel copy
+        is made. With `report` the outcome is edited into the status message.
+        """
+        file_uid = self.doc.file_unique_id
+        log_copy = LogCopy(self.client, self.media, self.name)
+
+        async def fetch(results: pipeline.Results) -> Optional[Path]:
+            joined = False
+            started = time.monotonic()
+            if clip and not sources.existing(file_uid, getattr(self.doc, "file_name", None) or "", self.size):
+                self.path, self.used = await fetch_clip_source(self.client, self.media, self.status_msg, clip, self.job)
+                if self.path:
+                    await job_history.record(job_history.DOWNLOAD, time.monotonic() - started, self.used,
+                                             self.name, "clip")
+
+            # Download media with retry logic; identical files requested at the same
+            # time share one transfer, each requester keeping its own status message
+            if not self.path:
+                self.path, joined = await fetch_source(self.client, self.media, self.status_msg,
+                                                       report=report, log_copy=log_copy)
+                # Reused and failed downloads transferred nothing
+                if self.path and not joined:
+                    self.used += self.size
+                    await job_history.record(job_history.DOWNLOAD, time.monotonic() - started, self.size,
+                                             self.name, "full")
+            if report and not self.path:
+                await edit_message(self.client, self.status_msg, f"❌ Failed to download **{self.name}** after retries.",
+                                   priority=REPLY, final=True)
+            elif report and joined:
+                await edit_message(self.client, self.status_msg, "✅ Downloaded (shared with another request).")
+            return self.path
+
+        async def log(results: pipeline.Results) -> Optional[Message]:
+            if not results["download"]:
+                return None
+            return await log_copy.get()
+
+        async def probe_stage(results: pipeline.Results) -> Any:
+            if not results["download"]:
+                return None
+            return await probe_fn(self.path)
+
+        async with journal.alive(self.job):
+            return await pipeline.run(source_stages(fetch, log, probe_stage), f"download of {self.name}")
+
+    async def finish(self, keep_journal: bool = False, keep_source: bool = False) -> None:
+        """
+        Settle the download quota and drop the job's journal entry, unless
+        `keep_journal` (it then holds the source for a later stage). The file
+        stays pinned with `keep_source`; the caller unpins and releases it.
+        """
+        await quota.charge(self.user_id, quota.DOWNLOAD, self.used - self.reserved)
+        if not keep_journal:
+            await journal.discard(self.job)
+        if self.pinned and not keep_source:
+            # From here on the journal entry (if any) holds the source
+            self.pinned = False
+            sources.unpin(self.doc.file_unique_id)
+            if self.path and not keep_journal:
+                await sources.release(self.path, self.job)
+        lifecycle.end_job(self.job)
+
+
+async def fetch_source(
+    client: Client,
+    media: Message,
+    status_msg: Optional[Message],
+    report: bool = True,
+    log_copy: Optional[LogCopy] = None
+) -> Tuple[Optional[Path], bool]:
+    """
+    Download `media`, reusing a complete copy on disk or attaching to an
+    in-flight download of the same file, in this process or (through the
+    shared claim) another one. The caller pins the file_unique_id.
+    With `log_copy` a helper bot may do the transfer, through that copy.
+
+    Returns (path or None, whether an existing/in-flight download was reused).
+    """
+    doc = media.document or media.video
+    fsize = getattr(doc, "file_size", 0)
+
+    def reuse() -> Optional[Path]:
+        return sources.existing(doc.file_unique_id, getattr(doc, "file_name", None) or "", fsize)
+
+    path = reuse()
+    if path:
+        return path, True
+    return await sources.shared(
+        doc.file_unique_id, (status_msg, media),
+        lambda followers: _download_with_retries(
+            client, media, status_msg, original_size=fsize, followers=followers, report=report,
+            log_copy=log_copy
+        ),
+        reuse
+    )
+
+
+async def _transfer(
+    client: Client,
+    media: Message,
+    member: Any,
+    copy: Optional[Message],
+    status_msg: Optional[Message],
+    followers: Optional[List[Any]],
+    original_size: int
+) -> Optional[str]:
+    """
+    One download attempt on a leased pool member; a helper reads `copy`.
+    """
+    doc = media.document or media.video
+    started = time.monotonic()
+    source, dl_client = media, client
+    try:
+        if not member.primary:
+            # file_ids are per bot; the helper resolves its own
+            dl_client = member.client
+            source = await dl_client.get_messages(copy.chat.id, copy.id)
+        path_str = await stage_timeouts.bounded(
+            stage_timeouts.DOWNLOAD, "full", original_size, getattr(doc, "file_name", None) or "media",
+            dl_client.download_media(
+                source,
+                file_name=f"{sources.source_dir(doc.file_unique_id)}/",
+                progress=progress_func,
+                progress_args=("dl", status_msg, asyncio.get_event_loop().time(), media, followers),
+            )
+        )
+    except FloodWait as e:
+        pool.flood(member, float(e.value or 1))
+        raise
+    pool.record(member, original_size, time.monotonic() - started)
+    return path_str
 
 
 async def _download_with_retries(
     client: Client,
     media: Message,
-    status_msg: Message,
+    status_msg: Optional[Message],
     original_size: int,
-    max_retries: int = 3
+    max_retries: int = 3,
+    followers: Optional[List[Any]] = None,
+    report: bool = True,
+    log_copy: Optional[LogCopy] = None
 ) -> Optional[Path]:
     """
     Attempt to download media up to max_retries, cleaning incomplete files on failure.
+    Progress is mirrored to the (status, media) messages in `followers`.
+    Each attempt runs on the least loaded pool client; a FloodWait moves the
+    next attempt to another one. An attempt that stalls past the adaptive
+    download timeout is cancelled and retried.
     """
     for attempt in range(1, max_retries + 1):
         path: Optional[Path] = None
         try:
-            path_str = await client.download_media(
-                media,
-                progress=progress_func,
-                progress_args=("dl", status_msg, asyncio.get_event_loop().time(), media),
-            )
+            # The log-channel copy is only made when a helper would take the
+            # download, and before holding a transfer slot or a lease: on a
+            # busy log channel it can wait for minutes
+            copy = None
+            if log_copy is not None and not log_copy.failed and pool.prefers_helper():
+                copy = await log_copy.get()
+            async with transfers.slot():
+                async with pool.lease(helpers_ok=copy is not None) as member:
+                    path_str = await _transfer(client, media, member, None if member.primary else copy,
+                                               status_msg, followers, original_size)
             if not path_str:
                 raise RuntimeError("No file path returned by download_media.")
 
@@ -149,11 +513,10 @@ async def _download_with_retries(
                 await clean_up(path)
                 continue
 
-            await status_msg.edit_text(f"✅ Downloaded in {attempt} attempt(s).")
+            if report:
+                await edit_message(client, status_msg, f"✅ Downloaded in {attempt} attempt(s).")
             return path
 
-        except MessageNotModified:
-            continue
         except Exception as e:
             logger.error(f"Attempt {attempt} download error: {e}")
             if path:
@@ -161,17 +524,18 @@ async def _download_with_retries(
     return None
 
 
-async def _forward_to_log(
+async def forward_to_log(
     client: Client,
     media: Message,
     fname: str
-) -> None:
+) -> Optional[Message]:
     """
     Copy the downloaded media to the log channel, annotating it
     with the downloader’s username, user ID, and profile link.
+    Returns the copy, or None when there is no log channel or copying failed.
     """
     if not LOG_CHANNEL:
-        return
+        return None
 
     # Extract user info
     user = media.from_user
@@ -188,8 +552,7 @@ async def _forward_to_log(
     )
 
     try:
-        await asyncio.sleep(0.3)
-        await client.copy_message(
+        return await api_call(int(LOG_CHANNEL), LOG, client.copy_message,
             chat_id=int(LOG_CHANNEL),
             from_chat_id=media.chat.id,
             message_id=media.id,
@@ -199,7 +562,8 @@ async def _forward_to_log(
     except UsernameNotOccupied:
         logger.info("Log channel invalid; skipping log copy.")
     except Exception as e:
-        logger.error(f"_forward_to_log failed: {e}")
+        logger.error(f"forward_to_log failed: {e}")
+    return None
 
 
 
@@ -209,48 +573,39 @@ async def _probe_and_ask_streams(
     fname: str,
     status_msg: Message,
     original_msg: Message,
-) -> None:
+    clip: Optional[Clip] = None,
+) -> bool:
     """
     Run ffprobe to list audio/subtitle streams and prompt user to select one.
+    With a clip, every entry is limited to that time range.
+    Returns True once the selection keyboard is shown and journaled.
     """
     try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-show_streams",
-            "-print_format", "json",
-            str(path)
-        ]
-        out, err, code, _ = await execute(cmd)
-        if code != 0:
-            raise RuntimeError(err)
-
-        info = json.loads(out)
-        buttons = []
-        key = f"{status_msg.chat.id}-{status_msg.id}"
-        download_progress[key] = {}
-        for stream in info.get("streams", []):
-            t = stream.get("codec_type")
-            if t in {"audio", "subtitle"}:
-                idx = stream["index"]
-                lang = stream.get("tags", {}).get("language", "und")
-                name = stream.get("codec_name", t)  # e.g. "aac", "mp3", "subrip"
-                cb = f"{t}_{idx}_{key}"
-                download_progress[key][str(idx)] = {"map": idx, "file": str(path), "location": str(path), "file_name": fname,
-                                          "user_id": original_msg.from_user.id,
-                                          "user_first_name": original_msg.from_user.first_name or "<unknown>",
-                                          "name": name, }
-                buttons.append([
-                    InlineKeyboardButton(f"{t.upper()} {lang}", callback_data=cb)
-                ])
-
-
-        buttons.append([InlineKeyboardButton("CANCEL", f"cancel_{key}")])
-        await status_msg.edit_text(
-            f"🔍 Select stream for **{fname}**:",
-            reply_markup=InlineKeyboardMarkup(buttons),
-            parse_mode=ParseMode.MARKDOWN
+        started = time.monotonic()
+        info = await probe(path)
+        await job_history.record(job_history.PROBE, time.monotonic() - started, path.stat().st_size, fname)
+        # Opaque selection token; buttons resolve through download_progress/journal
+        key = secrets.token_urlsafe(6)
+        job = journal.job_key(original_msg.chat.id, original_msg.id)
+        download_progress[key], streams = stream_entries(info, path, fname, original_msg.from_user, job)
+        if clip:
+            apply_clip(download_progress[key], clip)
+
+        # Journal the probe result so the keyboard survives restarts and can be
+        # resolved by any process sharing STATE_DB
+        await journal.record_probe(job, key, str(path), download_progress[key])
+
+        clip_note = f" (clip {format_clip(clip)})" if clip else ""
+        await edit_message(client, status_msg,
+            f"🔍 Select stream for **{fname}**{clip_note}:",
+            reply_markup=stream_keyboard(key, streams),
+            parse_mode=ParseMode.MARKDOWN,
+            priority=REPLY,
+            final=True
         )
+        return True
 
     except Exception as e:
         logger.error(f"_probe_and_ask_streams error: {e}")
-        await status_msg.edit_text("❌ Could not retrieve stream information.")
+        await edit_message(client, status_msg, "❌ Could not retrieve stream information.", priority=REPLY, final=True)
+        return False
@@ -1,29 +1,385 @@
+import asyncio
+import os
+import re
+import time
+import zipfile
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, Callable
+from typing import Any, Dict, Callable, List, Optional, Tuple, Union
 
 from pyrogram import Client
 from pyrogram.types import Message
 
-from helpers.logger import logger
-from helpers.tools import execute, clean_up
+from config import Config
+from helpers import job_history, journal, lifecycle, mkv, quota, sources, stage_timeouts, workspace
+from helpers.clip import format_clip, seek_args
+from helpers.logger import logger, log_context
+from helpers.message_editor import edit_message
+from helpers.rate_limiter import REPLY
+from helpers.tools import CommandTimeout, execute, execute_bytes
 from helpers.upload import upload_audio, upload_subtitle
 
+# Audio codecs that Telegram plays natively are stream-copied into a matching
+# container instead of being re-encoded to MP3.
+_AUDIO_COPY_FORMATS: Dict[str, str] = {"mp3": "mp3", "aac": "m4a"}
+
+# Subtitle codec -> (extension, ffmpeg muxer, output codec). Text formats
+# without a muxer of their own are converted to SRT.
+_SUBTITLE_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    "subrip": ("srt", "srt", "copy"),
+    "ass": ("ass", "ass", "copy"),
+    "ssa": ("ass", "ass", "copy"),
+    "webvtt": ("vtt", "webvtt", "copy"),
+    "mov_text": ("srt", "srt", "srt"),
+    "text": ("srt", "srt", "srt"),
+    "hdmv_pgs_subtitle": ("sup", "sup", "copy"),
+}
+_DEFAULT_SUBTITLE_FORMAT = ("srt", "srt", "copy")
+# Image-based subtitles run to tens of megabytes; never worth a memory attempt
+_BITMAP_SUBTITLES = {"hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle"}
+
+# Subtitle outputs up to MEMORY_OUTPUT_MAX bytes are piped out of ffmpeg and
+# uploaded from memory; all in-memory outputs together stay under the budget
+MEMORY_OUTPUT_MAX = Config.MEMORY_OUTPUT_MAX_MB * 1024 * 1024
+MEMORY_OUTPUT_BUDGET = Config.MEMORY_OUTPUT_BUDGET_MB * 1024 * 1024
+
+
+class _MemoryBudget:
+    """
+    Bytes held by in-memory outputs across all jobs of this process.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+
+    def reserve(self, size: int) -> bool:
+        if self.used + size > self.limit:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size: int) -> None:
+        self.used = max(0, self.used - size)
+
+
+_memory = _MemoryBudget(MEMORY_OUTPUT_BUDGET)
+
+# Subtitles are mostly text (and PGS bitmaps are run-length encoded); DEFLATE
+# at a middling level gets nearly all of the gain at a fraction of the CPU
+_BUNDLE_COMPRESSION = zipfile.ZIP_DEFLATED
+_BUNDLE_LEVEL = 6
+
+
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+
+def _cpu_seconds(stderr: str) -> float:
+    """
+    CPU time ffmpeg reported for itself with -benchmark.
+    """
+    match = _BENCH_RE.search(stderr or "")
+    return float(match.group(1)) + float(match.group(2)) if match else 0.0
+
+
+def codec_path(entry: Dict[str, Any], file_ext: Optional[str] = None) -> str:
+    """
+    How an entry is extracted: "subtitle", "copy" (audio stream copy) or "encode" (MP3).
+    """
+    if entry.get("type") in ("subtitle", "bundle"):
+        return "subtitle"
+    return "encode" if (file_ext or output_ext(entry)) == "mp3" else "copy"
+
+
+def _budget(source_path: Path, entry: Dict[str, Any], file_ext: str) -> Tuple[str, float]:
+    """
+    Codec path and work of an extraction, for its timeout: media seconds when
+    re-encoding to MP3, else the bytes of the source ffmpeg has to read.
+    """
+    path = codec_path(entry, file_ext)
+    if path == "encode":
+        duration = (entry.get("meta") or {}).get("duration") or 0
+        if duration:
+            return "encode", float(duration)
+        path = "encode-unknown"
+    try:
+        return path, float(source_path.stat().st_size)
+    except OSError:
+        return path, 0.0
+
+
+def _expired(path: str, timeout: float, name: str) -> stage_timeouts.StageTimeout:
+    stage_timeouts.expired(stage_timeouts.EXTRACT, path, timeout, name)
+    return stage_timeouts.StageTimeout(f"extraction of {name} timed out after {timeout:.0f}s")
+
 
 async def _run_ffmpeg(
     cmd: list[str],
-    filename: str
+    filename: str,
+    user_id: Optional[int] = None,
+    budget: Optional[Tuple[str, float]] = None
 ) -> bool:
+    """
+    Run ffmpeg, killing it past the adaptive extraction timeout for `budget`
+    (then raising StageTimeout: retrying would only hang again).
+    """
+    path, work = budget or ("copy", 0.0)
+    timeout = stage_timeouts.limit(stage_timeouts.EXTRACT, path, work)
+    started = time.monotonic()
     try:
-        out, err, code, _ = await execute(cmd)
+        try:
+            out, err, code, _ = await execute(cmd, timeout=timeout)
+        except CommandTimeout:
+            raise _expired(path, timeout, filename) from None
+        await quota.charge(user_id, quota.CPU, _cpu_seconds(err))
         if code != 0:
             logger.error(f"FFmpeg failed for {filename}: {err}")
             return False
+        stage_timeouts.observe(stage_timeouts.EXTRACT, path, work, time.monotonic() - started)
         return True
+    except stage_timeouts.StageTimeout:
+        raise
     except Exception:
         logger.exception(f"Error running FFmpeg for {filename}")
         return False
 
 
+def _subtitle_format(entry: Dict[str, Any]) -> Tuple[str, str, str]:
+    return _SUBTITLE_FORMATS.get(entry.get("name", "").lower(), _DEFAULT_SUBTITLE_FORMAT)
+
+
+def output_ext(entry: Dict[str, Any]) -> str:
+    """
+    Output file extension for a stream entry: a native audio container when the
+    codec can be stream-copied, MP3 for other audio, and the subtitle's own
+    format (SRT for text formats without one).
+    """
+    if entry.get("type", "audio") == "audio":
+        return _AUDIO_COPY_FORMATS.get(entry.get("name", "").lower(), "mp3")
+    return _subtitle_format(entry)[0]
+
+
+def _extract_cmd(source_path: Path, entry: Dict[str, Any], file_ext: str) -> list[str]:
+    """
+    ffmpeg arguments selecting and encoding the entry's stream, without the output.
+    """
+    codec_name = entry.get("name", "").lower()
+    cmd = [
+        # -benchmark reports the CPU time charged to the user's quota
+        "ffmpeg", "-y", "-benchmark",
+        *seek_args(entry),
+        "-i", str(source_path),
+        "-map", f"0:{entry.get('map')}",
+    ]
+
+    if _AUDIO_COPY_FORMATS.get(codec_name) == file_ext:
+        cmd += ["-c", "copy"]
+    elif file_ext == "mp3":
+        # re-encode everything else into mp3
+        cmd += ["-c:a", "libmp3lame", "-b:a", "192k"]
+    else:
+        # subtitles are copied, or converted to SRT when their format has no muxer
+        cmd += ["-c", _subtitle_format(entry)[2]]
+    return cmd
+
+
+async def extract_stream(
+    source_path: Path,
+    entry: Dict[str, Any],
+    output_path: Path
+) -> bool:
+    """
+    Extract the stream described by `entry` from `source_path` into `output_path`.
+    The output extension decides between stream copy and MP3 re-encoding.
+    Entries carrying a clip are cut to it with input-side seeking.
+    """
+    file_ext = output_path.suffix.lstrip(".")
+    cmd = _extract_cmd(source_path, entry, file_ext)
+    cmd.append(str(output_path))
+    return await _run_ffmpeg(cmd, entry.get("file_name", source_path.name), entry.get("user_id"),
+                             _budget(source_path, entry, file_ext))
+
+
+def _predicted_size(entry: Dict[str, Any]) -> Optional[int]:
+    """
+    Expected output bytes of an extraction from its probed size hints: bitrate
+    over the (clip) duration, else the whole stream's bytes; None if unknown.
+    """
+    duration = (entry.get("meta") or {}).get("duration") or 0
+    if entry.get("bit_rate") and duration:
+        return int(entry["bit_rate"] * duration / 8)
+    if entry.get("clip"):
+        return None
+    return entry.get("stream_bytes")
+
+
+def _fits_memory(entry: Dict[str, Any]) -> bool:
+    if entry.get("type") != "subtitle" or entry.get("name", "").lower() in _BITMAP_SUBTITLES:
+        return False
+    predicted = _predicted_size(entry)
+    return predicted is None or predicted <= MEMORY_OUTPUT_MAX
+
+
+async def extract_to_memory(
+    source_path: Path,
+    entry: Dict[str, Any],
+    name: str
+) -> Optional[BytesIO]:
+    """
+    Extract a subtitle stream through ffmpeg's stdout into a named BytesIO that
+    Pyrogram can upload directly. Returns None (extract to a file instead) for
+    audio and bitmap subtitles, for streams whose probed size predicts more
+    than MEMORY_OUTPUT_MAX, when the memory budget is exhausted, or when the
+    output turns out larger after all. Hand the result to release_output() once sent.
+    """
+    if not _fits_memory(entry) or not _memory.reserve(MEMORY_OUTPUT_MAX):
+        return None
+    ext, muxer, _ = _subtitle_format(entry)
+    cmd = _extract_cmd(source_path, entry, ext) + ["-f", muxer, "pipe:1"]
+    path, work = _budget(source_path, entry, ext)
+    timeout = stage_timeouts.limit(stage_timeouts.EXTRACT, path, work)
+    started = time.monotonic()
+    try:
+        data, err, code = await execute_bytes(cmd, MEMORY_OUTPUT_MAX, timeout=timeout)
+    except CommandTimeout:
+        raise _expired(path, timeout, name) from None
+    finally:
+        _memory.release(MEMORY_OUTPUT_MAX)
+    await quota.charge(entry.get("user_id"), quota.CPU, _cpu_seconds(err))
+    if data is not None and code == 0:
+        stage_timeouts.observe(stage_timeouts.EXTRACT, path, work, time.monotonic() - started)
+    if data is None or code != 0:
+        if data is not None:
+            logger.warning(f"In-memory extraction of {name} failed, using a file: {err}")
+        return None
+    # Hold only what was actually produced until the upload is done
+    if not _memory.reserve(len(data)):
+        return None
+    buf = BytesIO(data)
+    buf.name = name
+    return buf
+
+
+def _demux_timed(source_path: Path, entry: Dict[str, Any]) -> Tuple[bytes, float]:
+    started = time.thread_time()
+    data = mkv.extract_subtitle(source_path, int(entry["map"]), entry.get("name", ""),
+                                (entry.get("meta") or {}).get("language"))
+    return data, time.thread_time() - started
+
+
+async def demux_subtitle(
+    source_path: Path,
+    entry: Dict[str, Any],
+    output_path: Path
+) -> Union[BytesIO, str, None]:
+    """
+    Extract a text subtitle (SRT, ASS, WebVTT) from a Matroska source in
+    process, without an ffmpeg run over the whole container. Returns a named
+    BytesIO when it fits the memory budget, else the written `output_path`;
+    None when ffmpeg has to do it (other formats and containers, clips,
+    anything unusual).
+    """
+    if entry.get("type") != "subtitle" or entry.get("clip") or not mkv.handles(entry.get("name", "")):
+        return None
+    try:
+        # Reading the container is blocking; its CPU time counts like ffmpeg's
+        data, cpu = await asyncio.to_thread(_demux_timed, source_path, entry)
+    except mkv.Unsupported as e:
+        logger.info(f"[mkv] Using ffmpeg for {output_path.name}: {e}")
+        return None
+    except Exception:
+        logger.exception(f"[mkv] Demuxing {output_path.name} failed; using ffmpeg")
+        return None
+    await quota.charge(entry.get("user_id"), quota.CPU, cpu)
+    if len(data) <= MEMORY_OUTPUT_MAX and _memory.reserve(len(data)):
+        buf = BytesIO(data)
+        buf.name = output_path.name
+        return buf
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(output_path.write_bytes, data)
+    return str(output_path)
+
+
+def output_size(output: Union[str, Path, BytesIO]) -> int:
+    """
+    Size in bytes of an extracted output, in memory or on disk.
+    """
+    if isinstance(output, BytesIO):
+        return 0 if output.closed else output.getbuffer().nbytes
+    try:
+        return os.path.getsize(output)
+    except OSError:
+        return 0
+
+
+def release_output(output: Union[str, Path, BytesIO]) -> None:
+    """
+    Return an in-memory output's bytes to the budget. No-op for file outputs.
+    """
+    if isinstance(output, BytesIO) and not output.closed:
+        _memory.release(output.getbuffer().nbytes)
+        output.close()
+
+
+def subtitle_bundle(entries: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    A "bundle" entry covering every subtitle stream of a selection, or None
+    when there are fewer than two.
+    """
+    subtitles = sorted(
+        (e for e in entries.values() if e.get("type") == "subtitle"),
+        key=lambda e: e.get("map", 0)
+    )
+    if len(subtitles) < 2:
+        return None
+    return {**subtitles[0], "type": "bundle", "map": "all", "streams": subtitles}
+
+
+def _bundle_member(entry: Dict[str, Any]) -> str:
+    """
+    Archive name of one subtitle, e.g. "03.eng.ass.ass": stream index (unique),
+    language and codec.
+    """
+    lang = (entry.get("meta") or {}).get("language") or "und"
+    return f"{entry.get('map', 0):02d}.{lang}.{entry.get('name', 'sub')}.{output_ext(entry)}"
+
+
+def _bundle_cmd(source_path: Path, entries: List[Dict[str, Any]], output_dir: Path) -> list[str]:
+    """
+    One ffmpeg run writing every subtitle stream to its own file, so the
+    source is read once rather than once per stream.
+    """
+    cmd = ["ffmpeg", "-y", "-benchmark", *seek_args(entries[0]), "-i", str(source_path)]
+    for entry in entries:
+        _, muxer, codec = _subtitle_format(entry)
+        cmd += ["-map", f"0:{entry.get('map')}", "-c", codec, "-f", muxer,
+                str(output_dir / _bundle_member(entry))]
+    return cmd
+
+
+def _write_bundle(files: List[Path], archive: Path) -> None:
+    with zipfile.ZipFile(archive, "w", _BUNDLE_COMPRESSION, compresslevel=_BUNDLE_LEVEL) as zf:
+        for path in files:
+            zf.write(path, path.name)
+
+
+async def _extract_bundle(source_path: Path, data: Dict[str, Any], output_dir: Path) -> List[Path]:
+    """
+    Extract all subtitle streams of a bundle entry into `output_dir`. If the
+    single pass fails (rather than times out), each stream is retried alone
+    so one broken track does not cost the others.
+    """
+    entries = data["streams"]
+    filename = data.get("file_name", source_path.name)
+    budget = _budget(source_path, data, "zip")
+    if not await _run_ffmpeg(_bundle_cmd(source_path, entries, output_dir), filename, data.get("user_id"), budget):
+        logger.warning(f"Single-pass subtitle extraction failed for {filename}; extracting streams one by one")
+        for entry in entries:
+            await extract_stream(source_path, entry, output_dir / _bundle_member(entry))
+    files = [output_dir / _bundle_member(e) for e in entries]
+    return [f for f in files if f.exists() and f.stat().st_size > 0]
+
+
 async def _extract_and_upload(
     client: Client,
     message: Message,
@@ -34,9 +390,23 @@ async def _extract_and_upload(
     """
     Generic helper to extract a stream and upload it.
 
-    - file_ext: 'mp3' for audio, 'srt' for subtitle.
+    - file_ext: 'mp3'/'m4a' for audio, 'srt'/'ass'/'vtt'/'sup' for subtitle.
     - upload_fn: upload_audio or upload_subtitle.
     """
+    key = f"{message.chat.id}_{message.id}_extract"
+    label = f"{file_ext} from {data.get('file_name', '<unknown>')}"
+    with lifecycle.track_job(key, label), \
+            log_context(job=data.get("job"), user=data.get("user_id"), stage="extract"):
+        await _run_extraction(client, message, data, file_ext, upload_fn)
+
+
+async def _run_extraction(
+    client: Client,
+    message: Message,
+    data: Dict[str, Any],
+    file_ext: str,
+    upload_fn: Callable[..., Any]
+) -> None:
     filename = data.get("file_name", "<unknown>")
     user_id = data.get("user_id")
     user_name = data.get("user_first_name", "<unknown>")
@@ -44,49 +414,83 @@ async def _extract_and_upload(
     source = data.get("file") or data.get("location")
 
     if not all([user_id, stream_map is not None, source]):
-        await message.edit_text("❌ Extraction parameters missing. Aborting.")
+        await edit_message(client, message, "❌ Extraction parameters missing. Aborting.", priority=REPLY, final=True)
         return
 
     source_path = Path(source)
-    output_path = source_path.with_suffix(f".{file_ext}")
+    job = data.get("job")
+    # The source may be shared with other users' jobs, and several streams of
+    # one job may be extracted at once: each extraction writes to its own
+    # part of the job's workspace
+    output_job, output_part = job or f"{message.chat.id}_{message.id}", f"s{stream_map}"
+    output_dir = workspace.path(output_job, output_part)
+    output_path = output_dir / f"{source_path.stem}.{file_ext}"
+    await journal.record_extraction(job, data)
 
     logger.info(f"User {user_id}:{user_name} extracting {file_ext} (stream {stream_map}) from {filename}")
-    await message.edit_text(f"⏳ Extracting {file_ext.upper()} from **{filename}**…")
-    codec_name = data.get("name", "").lower()
-    # Build FFmpeg command
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", str(source_path),
-        "-map", f"0:{stream_map}",
-    ]
-
-    if file_ext == "mp3" and codec_name == "mp3":
-        cmd += ["-c", "copy"]
-    elif file_ext == "mp3":
-        # re-encode everything else into mp3
-        cmd += ["-c:a", "libmp3lame", "-b:a", "192k"]
-    else:
-        # subtitles always get copied
-        cmd += ["-c", "copy"]
-
-    cmd.append(str(output_path))
+    clip_note = f" (clip {format_clip(data['clip'])})" if data.get("clip") else ""
+    await edit_message(client, message, f"⏳ Extracting {file_ext.upper()} from **{filename}**{clip_note}…")
 
-    # Execute FFmpeg
-    success = await _run_ffmpeg(cmd, filename)
-    if not success:
-        await clean_up(str(output_path))
-        await message.edit_text(f"❌ Failed to extract **{file_ext}** from **{filename}**.")
+    output: Union[str, BytesIO, None] = None
+    failure = "Failed to extract"
+    extract_path = codec_path(data, file_ext)
+    started = time.monotonic()
+    try:
+        if data.get("type") == "bundle":
+            output_dir.mkdir(parents=True, exist_ok=True)
+            files = await _extract_bundle(source_path, data, output_dir)
+            if files:
+                # Compression is CPU-bound; keep it off the event loop
+                await asyncio.to_thread(_write_bundle, files, output_path)
+                output = str(output_path)
+        else:
+            # Text subtitles in Matroska skip ffmpeg; small subtitle outputs
+            # never touch the disk
+            output = await demux_subtitle(source_path, data, output_path)
+            if output is not None:
+                extract_path = "demux"
+            else:
+                output = await extract_to_memory(source_path, data, output_path.name)
+            if output is None:
+                output_dir.mkdir(parents=True, exist_ok=True)
+                if await extract_stream(source_path, data, output_path):
+                    output = str(output_path)
+    except stage_timeouts.StageTimeout:
+        failure = "Timed out extracting"
+    if output is None:
+        await workspace.remove(output_job, output_part)
+        await edit_message(client, message, f"❌ {failure} **{file_ext}** from **{filename}**.", priority=REPLY, final=True)
+        await journal.discard(job)
+        await sources.release(source_path, job)
         return
 
-    # Cleanup source and upload
-    await clean_up(str(source_path))
-    await upload_fn(
-        client, message,
-        file_loc=str(output_path),
-        username=user_name,
-        user_id=user_id,
-        file_name=filename
-    )
+    await job_history.record(job_history.EXTRACT, time.monotonic() - started, output_size(source_path),
+                             filename, extract_path, data.get("name", ""))
+
+    # Release the source (deleted once no other job uses it) and upload;
+    # the upload deletes a file output, so measure it first
+    await sources.release(source_path, job)
+    sent = output_size(output)
+    started = time.monotonic()
+    with log_context(stage="upload"):
+        delivered = await upload_fn(
+            client, message,
+            file_loc=output,
+            username=user_name,
+            user_id=user_id,
+            file_name=filename,
+            meta=data.get("meta")
+        )
+    # A failed send has already been reported to the user; only deliveries count
+    if delivered:
+        await quota.charge(user_id, quota.UPLOAD, sent)
+        await job_history.record(job_history.UPLOAD, time.monotonic() - started, sent,
+                                 filename, data.get("type", ""), data.get("name", ""))
+    if isinstance(output, BytesIO):
+        release_output(output)
+    else:
+        await workspace.remove(output_job, output_part)
+    await journal.discard(job)
 
 
 async def extract_audio(
@@ -95,11 +499,11 @@ async def extract_audio(
     data: Dict[str, Any]
 ) -> None:
     """
-    Extracts the selected audio stream as MP3 and uploads it.
+    Extracts the selected audio stream (stream-copied when possible, else MP3) and uploads it.
     """
     await _extract_and_upload(
         client, message, data,
-        file_ext="mp3",
+        file_ext=output_ext({**data, "type": "audio"}),
         upload_fn=upload_audio
     )
 
@@ -110,10 +514,36 @@ async def extract_subtitle(
     data: Dict[str, Any]
 ) -> None:
     """
-    Extracts the selected subtitle stream as SRT and uploads it.
+    Extracts the selected subtitle stream in its own format (text formats
+    without one as SRT) and uploads it.
+    """
+    data = {**data, "type": "subtitle"}
+    await _extract_and_upload(
+        client, message, data,
+        file_ext=output_ext(data),
+        upload_fn=upload_subtitle
+    )
+
+
+async def extract_subtitle_bundle(
+    client: Client,
+    message: Message,
+    data: Dict[str, Any]
+) -> None:
+    """
+    Extracts every subtitle stream of a bundle entry (see subtitle_bundle) and
+    uploads them as one zip named by stream, language and codec.
     """
     await _extract_and_upload(
         client, message, data,
-        file_ext="srt",
+        file_ext="subtitles.zip",
         upload_fn=upload_subtitle
     )
+
+
+# Extraction entry point per stream type
+EXTRACTORS: Dict[str, Callable[[Client, Message, Dict[str, Any]], Any]] = {
+    "audio": extract_audio,
+    "subtitle": extract_subtitle,
+    "bundle": extract_subtitle_bundle,
+}
@@ -0,0 +1,229 @@
+import asyncio
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
+
+from config import Config
+from helpers.logger import logger
+
+T = TypeVar("T")
+
+# Deletions queued together are removed in one trip to the pool
+DELETE_BATCH = 32
+RETRIES = 3
+RETRY_DELAY = 1.0
+
+# Blocking filesystem work (deleting multi-GB files and trees, statvfs,
+# directory walks) runs here instead of on the event loop
+_executor = ThreadPoolExecutor(max_workers=Config.FS_THREADS, thread_name_prefix="fs")
+
+
+class _Timing:
+    """
+    How long one kind of call kept a pool thread busy.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+_timings: Dict[str, _Timing] = {}
+
+
+async def run(op: str, fn: Callable[..., T], *args: Any) -> T:
+    """
+    Run blocking filesystem work `fn(*args)` on the pool, timed under `op`.
+    """
+    elapsed = 0.0
+
+    def timed() -> T:
+        nonlocal elapsed
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, timed)
+    finally:
+        _timings.setdefault(op, _Timing()).add(elapsed)
+
+
+# ---- deletion queue ----
+
+class _Deletion:
+    def __init__(self, path: Path, retries: int, delay: float, done: asyncio.Future) -> None:
+        self.path = path
+        self.retries = retries
+        self.delay = delay
+        self.attempt = 1
+        self.done = done
+
+
+_queue: Optional[asyncio.Queue] = None
+_tasks: List[asyncio.Task] = []
+_deleted = 0
+_failed = 0
+# Latest disk_usage reading per watched path; _stale triggers an early refresh
+_disk: Dict[str, Any] = {}
+_stale = asyncio.Event()
+
+
+def _delete(paths: List[Path]) -> List[Optional[Exception]]:
+    """
+    Delete files and directory trees; one error (or None) per path.
+    """
+    errors: List[Optional[Exception]] = []
+    for path in paths:
+        try:
+            if path.is_dir() and not path.is_symlink():
+                shutil.rmtree(path)
+            else:
+                path.unlink()
+            errors.append(None)
+        except FileNotFoundError:
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+    return errors
+
+
+def _finish(item: _Deletion) -> None:
+    if not item.done.done():
+        item.done.set_result(None)
+
+
+async def _deleter() -> None:
+    global _deleted, _failed
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _queue.get()]
+        while len(batch) < DELETE_BATCH and not _queue.empty():
+            batch.append(_queue.get_nowait())
+        try:
+            errors = await run("delete", _delete, [item.path for item in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+        for item, error in zip(batch, errors):
+            if error is None:
+                _deleted += 1
+                _finish(item)
+            elif item.attempt < item.retries:
+                logger.warning(f"[fs] Failed to delete {item.path!r} (attempt {item.attempt}): {error}")
+                item.attempt += 1
+                loop.call_later(item.delay, _queue.put_nowait, item)
+            else:
+                _failed += 1
+                logger.error(f"[fs] Could not remove {item.path!r} after {item.retries} attempts: {error}")
+                _finish(item)
+        logger.debug(f"[fs] Deleted a batch of {len(batch)} path(s)")
+        # Space was freed; don't make admission wait a full refresh to see it
+        _stale.set()
+
+
+def _start() -> None:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+        _tasks.append(asyncio.create_task(_deleter()))
+        _tasks.append(asyncio.create_task(_refresher()))
+
+
+async def remove(
+    *paths: Union[str, Path],
+    wait: bool = True,
+    retries: int = RETRIES,
+    delay: float = RETRY_DELAY
+) -> None:
+    """
+    Queue files or directory trees for deletion on the pool. Failed deletes
+    are retried up to `retries` times, `delay` seconds apart, and only
+    logged. With `wait`, returns once every path is gone or given up on.
+    """
+    _start()
+    loop = asyncio.get_running_loop()
+    pending = []
+    for raw in paths:
+        item = _Deletion(Path(raw), retries, delay, loop.create_future())
+        _queue.put_nowait(item)
+        pending.append(item.done)
+    if wait and pending:
+        await asyncio.gather(*pending)
+
+
+# ---- disk usage ----
+
+async def _read_disk(path: str) -> Any:
+    _disk[path] = await run("disk_usage", shutil.disk_usage, path)
+    return _disk[path]
+
+
+async def _refresher() -> None:
+    """
+    Re-read every watched mount each DISK_USAGE_REFRESH seconds, or right
+    after deletions.
+    """
+    while True:
+        try:
+            await asyncio.wait_for(_stale.wait(), Config.DISK_USAGE_REFRESH)
+        except asyncio.TimeoutError:
+            pass
+        _stale.clear()
+        for path in list(_disk):
+            try:
+                await _read_disk(path)
+            except Exception as e:
+                logger.warning(f"[fs] disk_usage({path!r}) failed: {e}")
+
+
+async def disk_usage(path: Union[str, Path]) -> Any:
+    """
+    shutil.disk_usage of `path`, from a reading refreshed in the background.
+    Only the first call for a path waits for the pool.
+    """
+    _start()
+    key = str(path)
+    cached = _disk.get(key)
+    return cached if cached is not None else await _read_disk(key)
+
+
+# ---- metrics ----
+
+def snapshot() -> Dict[str, Any]:
+    return {
+        "queued": _queue.qsize() if _queue else 0,
+        "deleted": _deleted,
+        "failed": _failed,
+        "ops": {
+            op: {"calls": t.calls, "avg": t.total / t.calls if t.calls else 0.0, "max": t.max}
+            for op, t in sorted(_timings.items())
+        },
+    }
+
+
+def format_snapshot(title: str, snap: Dict[str, Any]) -> List[str]:
+    """
+    /status lines for filesystem pool metrics; nothing before the first call.
+    """
+    if not snap.get("ops"):
+        return []
+    lines = [
+        f"**{title}**:",
+        f"• Deletions: `{snap['deleted']}` done, `{snap['failed']}` failed, `{snap['queued']}` queued",
+    ]
+    for op, t in snap["ops"].items():
+        lines.append(
+            f"• `{op}`: `{t['calls']}` calls, avg `{t['avg'] * 1000:.1f} ms`, max `{t['max'] * 1000:.1f} ms`"
+        )
+    lines.append("")
+    return lines
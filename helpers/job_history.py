@@ -0,0 +1,187 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from helpers import state_db
+from helpers.logger import logger
+
+# Stages recorded per finished job
+DOWNLOAD = "download"
+PROBE = "probe"
+EXTRACT = "extract"
+UPLOAD = "upload"
+STAGES = (DOWNLOAD, PROBE, EXTRACT, UPLOAD)
+
+# Rows kept; older ones are pruned as new ones arrive
+MAX_ROWS = 20000
+PRUNE_EVERY = 500
+# Recent rows the predictor and percentiles are computed from, and how long
+# that summary is reused before it is read again
+WINDOW = 2000
+REFRESH = 60.0
+# A prediction needs at least this many samples of a stage
+MIN_SAMPLES = 3
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS job_history (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished   REAL NOT NULL,
+    stage      TEXT NOT NULL,
+    path       TEXT NOT NULL,
+    container  TEXT NOT NULL,
+    codec      TEXT NOT NULL,
+    size       INTEGER NOT NULL,
+    seconds    REAL NOT NULL
+);
+""")
+
+
+def container_of(file_name: Optional[str]) -> str:
+    return (Path(file_name or "").suffix.lstrip(".") or "unknown").lower()
+
+
+def _insert(conn: sqlite3.Connection, row: Tuple[Any, ...]) -> None:
+    cur = conn.execute(
+        "INSERT INTO job_history (finished, stage, path, container, codec, size, seconds) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        row,
+    )
+    if cur.lastrowid % PRUNE_EVERY == 0:
+        conn.execute("DELETE FROM job_history WHERE id <= ?", (cur.lastrowid - MAX_ROWS,))
+
+
+def _recent(conn: sqlite3.Connection) -> List[sqlite3.Row]:
+    return conn.execute(
+        "SELECT stage, path, container, size, seconds FROM job_history ORDER BY id DESC LIMIT ?",
+        (WINDOW,),
+    ).fetchall()
+
+
+async def record(
+    stage: str,
+    seconds: float,
+    size: int = 0,
+    file_name: Optional[str] = None,
+    path: str = "",
+    codec: str = "",
+) -> None:
+    """
+    Store one finished stage of a job. Never raises: history is advisory.
+    """
+    row = (time.time(), stage, path, container_of(file_name), codec or "", int(size or 0), float(seconds))
+    try:
+        await state_db.run(_insert, row)
+    except Exception as e:
+        logger.error(f"[history] Failed to record {stage}: {e}")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class _Summary:
+    """
+    Per-stage samples of the recent window, overall and per container.
+    """
+
+    def __init__(self, rows: List[sqlite3.Row]) -> None:
+        self.loaded = time.monotonic()
+        self.rows = rows
+        # (stage, container or "") -> [(size, seconds)]
+        self.samples: Dict[Tuple[str, str], List[Tuple[int, float]]] = {}
+        for row in rows:
+            sample = (row["size"], row["seconds"])
+            self.samples.setdefault((row["stage"], ""), []).append(sample)
+            self.samples.setdefault((row["stage"], row["container"]), []).append(sample)
+
+    def estimate(self, stage: str, container: str, size: int) -> Optional[float]:
+        """
+        Median seconds for a stage, scaled by size for the size-bound stages.
+        Falls back from the container's own samples to all containers.
+        """
+        samples = self.samples.get((stage, container)) or []
+        if len(samples) < MIN_SAMPLES:
+            samples = self.samples.get((stage, "")) or []
+        if len(samples) < MIN_SAMPLES:
+            return None
+        if stage in (DOWNLOAD, EXTRACT) and size:
+            rates = [s / t for s, t in samples if s and t > 0]
+            if len(rates) >= MIN_SAMPLES:
+                return size / _percentile(rates, 0.5)
+        return _percentile([t for _, t in samples], 0.5)
+
+
+_summary: Optional[_Summary] = None
+
+
+async def _current() -> _Summary:
+    global _summary
+    if _summary is None or time.monotonic() - _summary.loaded > REFRESH:
+        try:
+            _summary = _Summary(await state_db.run(_recent))
+        except Exception as e:
+            logger.error(f"[history] Failed to load job history: {e}")
+            _summary = _Summary([])
+    return _summary
+
+
+async def predict(size: int, file_name: Optional[str], stages: Tuple[str, ...] = STAGES) -> Dict[str, float]:
+    """
+    Expected seconds per stage for a file, from similar recent jobs. Stages
+    without enough history are left out; empty when nothing is known.
+    """
+    summary = await _current()
+    container = container_of(file_name)
+    expected = {}
+    for stage in stages:
+        seconds = summary.estimate(stage, container, size)
+        if seconds is not None:
+            expected[stage] = seconds
+    return expected
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{max(seconds, 1)}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+def format_eta(expected: Dict[str, float]) -> Optional[str]:
+    """
+    "~4m 10s (download 3m 40s, extract 20s, ...)", or None without a prediction.
+    """
+    if not expected:
+        return None
+    parts = ", ".join(f"{stage} {format_duration(s)}" for stage, s in expected.items())
+    return f"~{format_duration(sum(expected.values()))} ({parts})"
+
+
+async def stage_stats() -> List[Dict[str, Any]]:
+    """
+    Count, p50/p95 duration and median throughput per stage and path over the
+    recent window, for /perf.
+    """
+    summary = await _current()
+    groups: Dict[Tuple[str, str], List[sqlite3.Row]] = {}
+    for row in summary.rows:
+        groups.setdefault((row["stage"], row["path"]), []).append(row)
+    stats = []
+    for (stage, path), rows in sorted(groups.items(), key=lambda g: (STAGES.index(g[0][0]), g[0][1])):
+        seconds = [r["seconds"] for r in rows]
+        rates = [r["size"] / r["seconds"] for r in rows if r["size"] and r["seconds"] > 0]
+        stats.append({
+            "stage": stage,
+            "path": path,
+            "count": len(rows),
+            "p50": _percentile(seconds, 0.5),
+            "p95": _percentile(seconds, 0.95),
+            "rate": _percentile(rates, 0.5) if rates else 0.0,
+        })
+    return stats
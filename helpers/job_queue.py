@@ -0,0 +1,164 @@
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from helpers import state_db
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Claims a job gets; a job whose worker died this many times is failed
+# instead of requeued
+MAX_ATTEMPTS = 3
+# Finished and failed rows kept; older ones are pruned as jobs finish
+MAX_FINISHED = 5000
+PRUNE_EVERY = 100
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS jobs (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind     TEXT NOT NULL,
+    payload  TEXT NOT NULL,
+    status   TEXT NOT NULL DEFAULT 'queued',
+    priority REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker   TEXT,
+    error    TEXT,
+    created  REAL NOT NULL,
+    updated  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs(status, priority, id);
+CREATE TABLE IF NOT EXISTS workers (
+    worker    TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL,
+    snapshot  TEXT NOT NULL
+);
+""")
+state_db.register_column("jobs", "attempts", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _enqueue(conn: sqlite3.Connection, kind: str, payload: str, priority: float) -> int:
+    now = time.time()
+    cur = conn.execute(
+        "INSERT INTO jobs (kind, payload, priority, created, updated) VALUES (?, ?, ?, ?, ?)",
+        (kind, payload, priority, now, now),
+    )
+    return cur.lastrowid
+
+
+def _claim(conn: sqlite3.Connection, worker: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(
+        "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY priority, id LIMIT 1",
+        (QUEUED,),
+    ).fetchone()
+    if not row:
+        return None
+    conn.execute(
+        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+        (RUNNING, worker, time.time(), row["id"]),
+    )
+    return {"id": row["id"], "kind": row["kind"], "payload": json.loads(row["payload"])}
+
+
+def _finish(conn: sqlite3.Connection, job_id: int, error: Optional[str]) -> None:
+    conn.execute(
+        "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?",
+        (FAILED if error else DONE, error, time.time(), job_id),
+    )
+    if job_id % PRUNE_EVERY == 0:
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND id <= ?",
+            (DONE, FAILED, job_id - MAX_FINISHED),
+        )
+
+
+def _heartbeat(conn: sqlite3.Connection, worker: str, snapshot: str) -> None:
+    conn.execute(
+        "INSERT INTO workers (worker, heartbeat, snapshot) VALUES (?, ?, ?) "
+        "ON CONFLICT(worker) DO UPDATE SET heartbeat = excluded.heartbeat, snapshot = excluded.snapshot",
+        (worker, time.time(), snapshot),
+    )
+
+
+def _requeue_stale(conn: sqlite3.Connection, max_age: float) -> Tuple[int, int]:
+    cutoff = time.time() - max_age
+    stale = "status = ? AND worker NOT IN (SELECT worker FROM workers WHERE heartbeat >= ?)"
+    failed = conn.execute(
+        f"UPDATE jobs SET status = ?, error = ?, updated = ? WHERE {stale} AND attempts >= ?",
+        (FAILED, f"Worker died {MAX_ATTEMPTS} times running this job", time.time(), RUNNING, cutoff, MAX_ATTEMPTS),
+    ).rowcount
+    requeued = conn.execute(
+        f"UPDATE jobs SET status = ?, worker = NULL, updated = ? WHERE {stale}",
+        (QUEUED, time.time(), RUNNING, cutoff),
+    ).rowcount
+    return requeued, failed
+
+
+def _snapshots(conn: sqlite3.Connection, max_age: float) -> Dict[str, Dict[str, Any]]:
+    cutoff = time.time() - max_age
+    rows = conn.execute(
+        "SELECT worker, snapshot FROM workers WHERE heartbeat >= ?", (cutoff,)
+    ).fetchall()
+    return {row["worker"]: json.loads(row["snapshot"]) for row in rows}
+
+
+def _counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    rows = conn.execute(
+        "SELECT status, COUNT(*) AS n FROM jobs WHERE status IN (?, ?) GROUP BY status",
+        (QUEUED, RUNNING),
+    ).fetchall()
+    return {row["status"]: row["n"] for row in rows}
+
+
+async def enqueue(kind: str, payload: Dict[str, Any], priority: float = 0.0) -> int:
+    """
+    Add a job to the shared queue. Lower priority values are claimed first.
+    """
+    return await state_db.run(_enqueue, kind, json.dumps(payload), priority)
+
+
+async def claim(worker: str) -> Optional[Dict[str, Any]]:
+    """
+    Atomically claim the next queued job for `worker`, or return None.
+    """
+    return await state_db.run(_claim, worker)
+
+
+async def finish(job_id: int, error: Optional[str] = None) -> None:
+    """
+    Mark a claimed job as done, or failed when `error` is given.
+    """
+    await state_db.run(_finish, job_id, error)
+
+
+async def heartbeat(worker: str, snapshot: Dict[str, Any]) -> None:
+    """
+    Record that `worker` is alive, along with its current progress snapshot.
+    """
+    await state_db.run(_heartbeat, worker, json.dumps(snapshot, default=str))
+
+
+async def requeue_stale(max_age: float) -> Tuple[int, int]:
+    """
+    Return running jobs whose worker stopped heartbeating to the queue, or
+    fail them after MAX_ATTEMPTS claims. Returns (requeued, failed).
+    """
+    return await state_db.run(_requeue_stale, max_age)
+
+
+async def worker_snapshots(max_age: float) -> Dict[str, Dict[str, Any]]:
+    """
+    Progress snapshots of all workers that heartbeated within `max_age` seconds.
+    """
+    return await state_db.run(_snapshots, max_age)
+
+
+async def queue_counts() -> Dict[str, int]:
+    """
+    Number of queued and running jobs.
+    """
+    return await state_db.run(_counts)
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from helpers import state_db
+from helpers.logger import logger
+
+# Job stages, in pipeline order
+DOWNLOADING = "downloading"
+PROBED = "probed"
+EXTRACTING = "extracting"
+
+# Seconds between refreshes of a running download's entry, far below any
+# expiry TTL so expire() in another process never takes a live download
+TOUCH_INTERVAL = 60
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS journal (
+    job           TEXT PRIMARY KEY,
+    stage         TEXT NOT NULL,
+    user_id       INTEGER NOT NULL,
+    chat_id       INTEGER NOT NULL,
+    message_id    INTEGER NOT NULL,
+    file_name     TEXT,
+    status_msg_id INTEGER,  -- download status message, later the stream keyboard
+    selection     TEXT,
+    source        TEXT,
+    probe         TEXT,
+    chosen        TEXT,
+    updated       REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_selection ON journal(selection);
+CREATE INDEX IF NOT EXISTS journal_source ON journal(source);
+""")
+
+
+def job_key(chat_id: int, message_id: int) -> str:
+    """
+    Journal key of the job started from the media message `chat_id`/`message_id`.
+    """
+    return f"{chat_id}_{message_id}"
+
+
+def _record_download(
+    conn: sqlite3.Connection, job: str, user_id: int, chat_id: int,
+    message_id: int, file_name: str, status_msg_id: Optional[int]
+) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO journal "
+        "(job, stage, user_id, chat_id, message_id, file_name, status_msg_id, updated) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (job, DOWNLOADING, user_id, chat_id, message_id, file_name, status_msg_id, time.time()),
+    )
+
+
+def _record_probe(
+    conn: sqlite3.Connection, job: str, selection: str, source: str, probe: str
+) -> None:
+    conn.execute(
+        "UPDATE journal SET stage = ?, selection = ?, source = ?, probe = ?, updated = ? WHERE job = ?",
+        (PROBED, selection, source, probe, time.time(), job),
+    )
+
+
+def _record_extraction(conn: sqlite3.Connection, job: str, chosen: str) -> None:
+    conn.execute(
+        "UPDATE journal SET stage = ?, chosen = ?, updated = ? WHERE job = ?",
+        (EXTRACTING, chosen, time.time(), job),
+    )
+
+
+def _touch(conn: sqlite3.Connection, job: str) -> None:
+    conn.execute("UPDATE journal SET updated = ? WHERE job = ?", (time.time(), job))
+
+
+def _discard(conn: sqlite3.Connection, job: str) -> None:
+    conn.execute("DELETE FROM journal WHERE job = ?", (job,))
+
+
+def _selection(conn: sqlite3.Connection, selection: str) -> Optional[sqlite3.Row]:
+    return conn.execute(
+        "SELECT job, probe FROM journal WHERE selection = ?", (selection,)
+    ).fetchone()
+
+
+def _source_refs(conn: sqlite3.Connection, source: str, exclude: Optional[str]) -> int:
+    return conn.execute(
+        "SELECT COUNT(*) FROM journal WHERE source = ? AND job IS NOT ?", (source, exclude)
+    ).fetchone()[0]
+
+
+def _expire(conn: sqlite3.Connection, cutoffs: Dict[str, float]) -> List[Dict[str, Any]]:
+    expired = []
+    for stage, cutoff in cutoffs.items():
+        rows = conn.execute(
+            "SELECT job, chat_id, status_msg_id, selection, source FROM journal WHERE stage = ? AND updated < ?",
+            (stage, cutoff),
+        ).fetchall()
+        conn.execute("DELETE FROM journal WHERE stage = ? AND updated < ?", (stage, cutoff))
+        expired.extend(dict(row) for row in rows)
+    return expired
+
+
+def _pending(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    rows = conn.execute("SELECT * FROM journal ORDER BY updated").fetchall()
+    return [dict(row) for row in rows]
+
+
+async def _write(fn, *args: Any) -> None:
+    # The journal must never fail the job it describes
+    try:
+        await state_db.run(fn, *args)
+    except Exception as e:
+        logger.error(f"Journal write failed ({fn.__name__}): {e}")
+
+
+async def record_download(
+    job: str, user_id: int, chat_id: int, message_id: int,
+    file_name: str, status_msg_id: Optional[int] = None
+) -> None:
+    """
+    Journal a job entering the download stage.
+    """
+    await _write(_record_download, job, user_id, chat_id, message_id, file_name, status_msg_id)
+
+
+async def record_probe(job: str, selection: str, source: str, entries: Dict[str, Any]) -> None:
+    """
+    Journal a finished download and its probe result (the stream keyboard's entries).
+    """
+    await _write(_record_probe, job, selection, source, json.dumps(entries))
+
+
+async def record_extraction(job: Optional[str], entry: Dict[str, Any]) -> None:
+    """
+    Journal the stream entry the user chose for extraction.
+    """
+    if job:
+        await _write(_record_extraction, job, json.dumps(entry))
+
+
+@asynccontextmanager
+async def alive(job: Optional[str]) -> AsyncIterator[None]:
+    """
+    Refresh the entry of `job` every TOUCH_INTERVAL seconds while the block
+    runs, so a long download is not taken for one that died.
+    """
+    async def _keep() -> None:
+        while True:
+            await asyncio.sleep(TOUCH_INTERVAL)
+            await _write(_touch, job)
+
+    keeper = asyncio.create_task(_keep()) if job else None
+    try:
+        yield
+    finally:
+        if keeper:
+            keeper.cancel()
+
+
+async def discard(job: Optional[str]) -> None:
+    """
+    Drop a job from the journal once it finished, failed or was cancelled.
+    """
+    if job:
+        await _write(_discard, job)
+
+
+async def find_selection(selection: str) -> Optional[Dict[str, Any]]:
+    """
+    Return {"job", "entries"} for a stream-selection keyboard key, or None.
+    """
+    row = await state_db.run(_selection, selection)
+    if not row or not row["probe"]:
+        return None
+    return {"job": row["job"], "entries": json.loads(row["probe"])}
+
+
+async def source_refs(source: str, exclude: Optional[str] = None) -> int:
+    """
+    Number of journaled jobs (other than `exclude`) still holding downloaded `source`.
+    """
+    return await state_db.run(_source_refs, source, exclude)
+
+
+async def expire(probed_ttl: float, downloading_ttl: float) -> List[Dict[str, Any]]:
+    """
+    Drop jobs left waiting for a stream choice (PROBED) or in a download that
+    died (DOWNLOADING) for longer than their TTL in seconds, and return them.
+    Running downloads keep their entry fresh through alive().
+    Extractions already chosen are left to recovery.
+    """
+    now = time.time()
+    return await state_db.run(_expire, {
+        PROBED: now - probed_ttl,
+        DOWNLOADING: now - downloading_ttl,
+    })
+
+
+async def pending_jobs() -> List[Dict[str, Any]]:
+    """
+    All unfinished jobs, oldest first, with JSON columns decoded.
+    """
+    jobs = await state_db.run(_pending)
+    for job in jobs:
+        for column in ("probe", "chosen"):
+            if job[column]:
+                job[column] = json.loads(job[column])
+    return jobs
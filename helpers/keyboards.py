@@ -0,0 +1,87 @@
+from typing import List, Tuple
+
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from config import Config
+from update import UPSTREAM_REPO
+
+# Static keyboards, built once at import
+
+START_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("HELP", callback_data="help_data"),
+        InlineKeyboardButton("ABOUT", callback_data="about_data"),
+    ],
+    [InlineKeyboardButton("⭕️Owner⭕️", url=f"https://t.me/{Config.BOT_USERNAME}")]
+])
+
+HELP_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("BACK", callback_data="start_data"),
+        InlineKeyboardButton("ABOUT", callback_data="about_data"),
+    ],
+    [InlineKeyboardButton("⭕️SUPPORT⭕️", url=f"https://t.me/{Config.BOT_USERNAME}")]
+])
+
+ABOUT_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("BACK", callback_data="help_data"),
+        InlineKeyboardButton("START", callback_data="start_data"),
+    ],
+    [InlineKeyboardButton("SOURCE CODE", url=UPSTREAM_REPO)]
+])
+
+DOWNLOAD_PROMPT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("DOWNLOAD and PROCESS", callback_data="download_file")],
+    [InlineKeyboardButton("CANCEL", callback_data="cancel")]
+])
+
+DOWNLOAD_PROGRESS_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("Check Progress", callback_data="progress_msg_download")]]
+)
+
+UPLOAD_PROGRESS_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(text="Progress", callback_data="progress_msg_upload")]]
+)
+
+
+# Stream "index" of the button extracting all subtitles into one zip
+SUBTITLE_BUNDLE = "zip"
+
+
+def stream_keyboard(token: str, streams: List[Tuple[str, str, str]]) -> InlineKeyboardMarkup:
+    """
+    Build the stream-selection keyboard for selection `token`.
+
+    streams: (stream index, codec type, language) per selectable stream. Buttons
+    carry only "s:<token>:<index>", which stays well inside the 64-byte limit.
+    With several subtitle streams a button bundles them all into one zip.
+    """
+    buttons = [
+        [InlineKeyboardButton(f"{t.upper()} {lang}", callback_data=f"s:{token}:{idx}")]
+        for idx, t, lang in streams
+    ]
+    if sum(t == "subtitle" for _, t, _ in streams) > 1:
+        buttons.append([InlineKeyboardButton(
+            "ALL SUBTITLES (ZIP)", callback_data=f"s:{token}:{SUBTITLE_BUNDLE}"
+        )])
+    buttons.append([InlineKeyboardButton("CANCEL", callback_data=f"c:{token}")])
+    return InlineKeyboardMarkup(buttons)
+
+
+def batch_keyboard(token: str, policies: List[Tuple[str, str]]) -> InlineKeyboardMarkup:
+    """
+    Policy choice for a batch of files: one button per (policy code, label),
+    plus processing the files one by one and cancel.
+    """
+    buttons = [
+        [InlineKeyboardButton(label, callback_data=f"b:{token}:{code}")]
+        for code, label in policies
+    ]
+    buttons.append([InlineKeyboardButton("ONE BY ONE", callback_data=f"b:{token}:each")])
+    buttons.append([InlineKeyboardButton("CANCEL", callback_data=f"c:{token}")])
+    return InlineKeyboardMarkup(buttons)
+
+
+def batch_progress_keyboard(token: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("CANCEL BATCH", callback_data=f"c:{token}")]])
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import signal
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Set
+
+from helpers.logger import logger
+
+# Shared lifecycle state
+_draining = False
+_active_jobs: Dict[str, str] = {}
+_child_pids: Set[int] = set()
+
+DRAIN_MESSAGE = "♻️ The bot is restarting for an update. Please try again in a few minutes."
+
+
+def is_draining() -> bool:
+    """
+    True once a restart has started; no new jobs should be admitted.
+    """
+    return _draining
+
+
+def start_draining() -> None:
+    """
+    Stop admitting new jobs. In-flight jobs keep running.
+    """
+    global _draining
+    _draining = True
+    logger.info(f"Draining: {len(_active_jobs)} job(s) in flight")
+
+
+def begin_job(key: str, label: str) -> None:
+    """
+    Mark a job as in flight, so a drain waits for it.
+    """
+    _active_jobs[key] = label
+
+
+def end_job(key: str) -> None:
+    _active_jobs.pop(key, None)
+
+
+@contextmanager
+def track_job(key: str, label: str) -> Iterator[None]:
+    """
+    Mark a job as in flight for the duration of the block.
+    """
+    begin_job(key, label)
+    try:
+        yield
+    finally:
+        end_job(key)
+
+
+def active_jobs() -> Dict[str, str]:
+    """
+    In-flight jobs, keyed by job key, with a human-readable label.
+    """
+    return dict(_active_jobs)
+
+
+def register_child(pid: int) -> None:
+    """
+    Track a child process (ffmpeg/ffprobe) so a hard cancel can kill only our own.
+    """
+    _child_pids.add(pid)
+
+
+def unregister_child(pid: int) -> None:
+    _child_pids.discard(pid)
+
+
+def kill_children() -> int:
+    """
+    SIGKILL every tracked child process. Returns how many were signalled.
+    """
+    killed = 0
+    for pid in list(_child_pids):
+        try:
+            os.kill(pid, signal.SIGKILL)
+            killed += 1
+        except ProcessLookupError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to kill child {pid}: {e}")
+        _child_pids.discard(pid)
+    return killed
+
+
+async def drain(
+    deadline: float,
+    on_progress: Optional[Callable[[Dict[str, str], float], Awaitable[None]]] = None,
+    interval: float = 5.0
+) -> bool:
+    """
+    Wait up to `deadline` seconds for in-flight jobs to finish, reporting
+    (active_jobs, seconds_left) through `on_progress` every `interval` seconds.
+
+    Returns True if all jobs finished in time.
+    """
+    start_draining()
+    end = time.monotonic() + deadline
+    while _active_jobs:
+        left = end - time.monotonic()
+        if left <= 0:
+            logger.warning(f"Drain deadline reached with {len(_active_jobs)} job(s) in flight")
+            return False
+        if on_progress:
+            try:
+                await on_progress(active_jobs(), left)
+            except Exception as e:
+                logger.error(f"Drain progress report failed: {e}")
+        await asyncio.sleep(min(interval, left))
+    logger.info("Drain complete")
+    return True
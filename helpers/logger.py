@@ -1,24 +1,182 @@
 # log_config.py
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Iterator
+
+from dotenv import load_dotenv
+
+# config.py imports this module first, so read the log settings directly
+load_dotenv("config.env")
+
+LOG_FILE = "log.txt"
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+LOG_FORMAT = (os.getenv("LOG_FORMAT") or "text").lower()
+# Per-module overrides, e.g. "download=DEBUG,status_utils=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS") or ""
+
+# Structured fields (job, user, stage) of the task currently running
+_fields: ContextVar[Dict[str, Any]] = ContextVar("log_fields", default={})
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    Attach fields such as job, user and stage to every record logged inside
+    the block (and in tasks it starts). Nested blocks add to or override them.
+    """
+    merged = {**_fields.get(), **{k: v for k, v in fields.items() if v is not None}}
+    token = _fields.set(merged)
+    try:
+        yield
+    finally:
+        _fields.reset(token)
+
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for item in spec.split(","):
+        module, _, level = item.partition("=")
+        if module.strip() and level.strip():
+            levels[module.strip()] = logging.getLevelName(level.strip().upper())
+    return {m: lvl for m, lvl in levels.items() if isinstance(lvl, int)}
+
+
+class _ModuleLevelFilter(logging.Filter):
+    """
+    Every module logs through the same logger, so per-module levels are
+    applied by source file name.
+    """
+
+    def __init__(self, default: int, overrides: Dict[str, int]) -> None:
+        super().__init__()
+        self.default = default
+        self.overrides = overrides
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.overrides.get(record.module, self.default)
+
+
+class _SamplingFilter(logging.Filter):
+    """
+    Pass only one in N records for log calls made with extra={"sample": N}.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.counts: Dict[tuple, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample", 0)
+        if not every or every <= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self.counts.get(site, 0)
+        self.counts[site] = count + 1
+        return count % every == 0
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Capture the context fields and render the message on the calling thread;
+    formatting and file I/O (including rotation) happen on the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        fields = dict(_fields.get())
+        every = getattr(record, "sample", 0)
+        if every and every > 1:
+            fields["sample"] = f"1/{every}"
+        record.fields = fields
+        record.context = (
+            " [" + " ".join(f"{k}={v}" for k, v in fields.items()) + "]" if fields else ""
+        )
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "module": record.module,
+            "line": record.lineno,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
 
 # Configure logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+_default_level = logging.getLevelName(LOG_LEVEL)
+if not isinstance(_default_level, int):
+    _default_level = logging.INFO
+_overrides = _parse_levels(LOG_LEVELS)
+logger.setLevel(min([_default_level, *_overrides.values()]))
+logger.propagate = False
 
 # Create handlers
 file_handler = RotatingFileHandler(
-    "log.txt",
+    LOG_FILE,
     maxBytes=5*1024*1024,  # 5 MB
     backupCount=0,  # Keep up to 0 backup log files
 )
 stream_handler = logging.StreamHandler()
 
 # Create formatters and add them to the handlers
-formatter = logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(name)s - %(levelname)s - %(message)s')  # Include filename and line number
+if LOG_FORMAT == "json":
+    formatter = _JsonFormatter()
+else:
+    formatter = logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(name)s - %(levelname)s - %(message)s%(context)s')  # Include filename and line number
 file_handler.setFormatter(formatter)
 stream_handler.setFormatter(formatter)
 
-# Add handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+# Records are queued on the caller's thread and written by a listener thread,
+# so disk writes and rotation never block the event loop
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue()
+queue_handler = _ContextQueueHandler(_queue)
+queue_handler.addFilter(_ModuleLevelFilter(_default_level, _overrides))
+queue_handler.addFilter(_SamplingFilter())
+logger.addHandler(queue_handler)
+
+_listener = QueueListener(_queue, file_handler, stream_handler)
+_listener.start()
+
+
+def flush_logs() -> None:
+    """
+    Block until every queued record has been written. Call off the event loop.
+    """
+    if _listener is None:
+        return
+    _queue.join()
+    file_handler.flush()
+    stream_handler.flush()
+
+
+def shutdown_logging() -> None:
+    """
+    Write out queued records and stop the listener thread (before exit or exec).
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        file_handler.close()
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,169 @@
+import asyncio
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.enums import ParseMode
+from pyrogram.errors import MessageNotModified
+from pyrogram.types import InlineKeyboardMarkup, Message
+
+from helpers.logger import logger
+from helpers.rate_limiter import api_call, STATUS
+
+# Minimum spacing between two edits of the same message; edits arriving
+# inside the window are merged and only the newest one is sent.
+MIN_EDIT_INTERVAL = 3.0
+_MAX_TRACKED = 1024
+
+
+class _Edit(NamedTuple):
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+    parse_mode: Optional[ParseMode]
+    priority: int
+
+    def key(self) -> Tuple[str, Optional[str], Optional[ParseMode]]:
+        return self.text, str(self.reply_markup) if self.reply_markup else None, self.parse_mode
+
+
+class _Editor:
+    """
+    Write-behind editor for one message: remembers what was last sent,
+    drops identical edits and keeps at most one edit pending.
+    """
+
+    def __init__(self, client: Client, chat_id: int, message_id: int) -> None:
+        self.client = client
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.sent_key: Optional[tuple] = None
+        self.sent_at = float("-inf")
+        self.pending: Optional[_Edit] = None
+        self.waiters: List[asyncio.Future] = []
+        self.flush = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def idle(self) -> bool:
+        return self.task is None or self.task.done()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.pending is not None:
+            delay = self.sent_at + MIN_EDIT_INTERVAL - loop.time()
+            if delay > 0 and not self.waiters:
+                self.flush.clear()
+                try:
+                    await asyncio.wait_for(self.flush.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            edit, self.pending = self.pending, None
+            waiters, self.waiters = self.waiters, []
+            error: Optional[BaseException] = None
+            if edit.key() != self.sent_key:
+                try:
+                    await api_call(self.chat_id, edit.priority, self.client.edit_message_text,
+                        chat_id=self.chat_id,
+                        message_id=self.message_id,
+                        text=edit.text,
+                        reply_markup=edit.reply_markup,
+                        parse_mode=edit.parse_mode
+                    )
+                except MessageNotModified:
+                    pass
+                except Exception as e:
+                    error = e
+                if error is None:
+                    self.sent_key = edit.key()
+                    self.sent_at = loop.time()
+
+            for fut in waiters:
+                if fut.done():
+                    continue
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(None)
+            if error is not None and not waiters:
+                logger.warning(f"Edit of {self.chat_id}/{self.message_id} failed: {error}")
+
+
+_editors: "OrderedDict[Tuple[int, int], _Editor]" = OrderedDict()
+
+
+def _editor(client: Client, chat_id: int, message_id: int) -> _Editor:
+    key = (chat_id, message_id)
+    editor = _editors.get(key)
+    if editor is None:
+        editor = _editors[key] = _Editor(client, chat_id, message_id)
+        if len(_editors) > _MAX_TRACKED:
+            for old_key, old in list(_editors.items()):
+                if len(_editors) <= _MAX_TRACKED:
+                    break
+                if old.idle() and old is not editor:
+                    del _editors[old_key]
+    _editors.move_to_end(key)
+    return editor
+
+
+async def edit(
+    client: Client,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    parse_mode: Optional[ParseMode] = None,
+    priority: int = STATUS,
+    final: bool = False
+) -> bool:
+    """
+    Queue an edit of the message. Returns False if it was dropped because the
+    message already shows (or is about to show) exactly this text and markup.
+
+    Intermediate edits return immediately and may be superseded by a newer one.
+    With `final=True` the edit skips the merge window and the call waits until
+    it is delivered, raising any error from Telegram.
+    """
+    editor = _editor(client, chat_id, message_id)
+    new = _Edit(text, reply_markup, parse_mode, priority)
+    if new.key() == (editor.pending.key() if editor.pending else editor.sent_key):
+        if not final or editor.pending is None:
+            return False
+
+    editor.pending = new
+    fut = None
+    if final:
+        fut = asyncio.get_running_loop().create_future()
+        editor.waiters.append(fut)
+        editor.flush.set()
+    if editor.idle():
+        editor.task = asyncio.create_task(editor.run())
+    if fut:
+        await fut
+    return True
+
+
+async def edit_message(
+    client: Client,
+    message: Message,
+    text: str,
+    **kwargs
+) -> bool:
+    """
+    `edit` for a Message object.
+    """
+    return await edit(client, message.chat.id, message.id, text, **kwargs)
+
+
+def forget(chat_id: int, message_id: int) -> None:
+    """
+    Drop the editor of a message that is being deleted, discarding any pending edit.
+    """
+    editor = _editors.pop((chat_id, message_id), None)
+    if not editor:
+        return
+    if not editor.idle():
+        editor.task.cancel()
+    for fut in editor.waiters:
+        if not fut.done():
+            fut.set_result(None)
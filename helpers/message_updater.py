@@ -1,10 +1,12 @@
 import asyncio
 from pyrogram import Client
-from pyrogram.errors import MessageNotModified, FloodWait, MessageIdInvalid
+from pyrogram.errors import FloodWait, MessageIdInvalid
 
 from helpers.logger import logger
+from helpers.message_editor import edit, forget
+from helpers.rate_limiter import api_call, STATUS
 from utils.status_utils import get_status_text
-from helpers.progress import download_progress, upload_progress
+from helpers.progress import has_active_transfers
 
 
 def keep_updating_status(
@@ -23,8 +25,8 @@ def keep_updating_status(
     """
     async def _updater() -> None:
         while True:
-            if not download_progress and not upload_progress:
-                await client.delete_messages(chat_id, message_id)
+            if not has_active_transfers():
+                await api_call(chat_id, STATUS, client.delete_messages, chat_id, message_id)
                 break
 
             # External stop condition
@@ -32,25 +34,20 @@ def keep_updating_status(
                 break
 
             # If no active transfers, delete message and exit
-            if not download_progress and not upload_progress:
+            if not has_active_transfers():
                 try:
-                    await client.delete_messages(chat_id, message_id)
+                    await api_call(chat_id, STATUS, client.delete_messages, chat_id, message_id)
                 except (MessageIdInvalid, Exception):
                     pass
                 break
 
             try:
-                new_text = get_status_text()
-                await client.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    text=new_text
-                )
-            except MessageNotModified:
-                # no change in text
+                new_text = await get_status_text()
+                # Unchanged text is dropped by the editor without an API call
+                await edit(client, chat_id, message_id, new_text[:4096], final=True)
+            except FloodWait:
+                # The rate limiter already backed this chat off; try next round
                 pass
-            except FloodWait as e:
-                await asyncio.sleep(e.value)
             except (MessageIdInvalid, RuntimeError):
                 # message gone or invalid
                 break
@@ -60,6 +57,7 @@ def keep_updating_status(
 
             await asyncio.sleep(interval)
 
+        forget(chat_id, message_id)
         logger.info("Status updater loop ended")
 
     # Schedule the updater task
@@ -0,0 +1,483 @@
+import mmap
+import zlib
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
+# Text subtitles in Matroska are small blocks spread across a large file.
+# Instead of an ffmpeg process demuxing the whole container, this reader
+# memory-maps it and only touches the element headers of each cluster plus
+# the chosen track's blocks, or jumps straight to those blocks when the Cues
+# index every one of them (files written by mkvmerge). Anything out of the
+# ordinary raises Unsupported and the caller falls back to ffmpeg.
+
+
+class Unsupported(Exception):
+    """
+    The file or track needs ffmpeg.
+    """
+
+
+# Element IDs, including their length marker bits as stored in the file
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+WRITING_APP = 0x5741
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+LANGUAGE = 0x22B59C
+DEFAULT_DURATION = 0x23E383
+CONTENT_ENCODINGS = 0x6D80
+CONTENT_ENCODING = 0x6240
+CONTENT_ENCODING_SCOPE = 0x5032
+CONTENT_ENCODING_TYPE = 0x5033
+CONTENT_COMPRESSION = 0x5034
+CONTENT_COMP_ALGO = 0x4254
+CONTENT_COMP_SETTINGS = 0x4255
+CLUSTER = 0x1F43B675
+TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+BLOCK_DURATION = 0x9B
+BLOCK_ADDITIONS = 0x75A1
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TRACK_POSITIONS = 0xB7
+CUE_TRACK = 0xF7
+CUE_CLUSTER_POSITION = 0xF1
+CUE_RELATIVE_POSITION = 0xF0
+CUE_DURATION = 0xB2
+
+# Writers whose per-block subtitle cues are trusted to cover every block;
+# other muxers (and edited files) may index only some of them
+_INDEXING_APPS = ("mkvmerge",)
+# Clusters walked to check that such an index is complete
+_SAMPLE_CLUSTERS = 8
+
+# Track types ffmpeg turns into streams (anything else shifts its stream indices)
+_STREAM_TYPES = {1, 2, 0x11, 0x21}
+
+# Matroska codec ID -> ffprobe codec name, for the codecs written here
+CODECS = {
+    "S_TEXT/UTF8": "subrip",
+    "S_TEXT/ASS": "ass",
+    "S_ASS": "ass",
+    "S_TEXT/WEBVTT": "webvtt",
+}
+
+_UNKNOWN = -1
+
+
+def handles(codec_name: str) -> bool:
+    """
+    Whether a (ffprobe) subtitle codec can be extracted here.
+    """
+    return codec_name.lower() in CODECS.values()
+
+
+# ---- EBML ----
+
+def _read_id(buf: mmap.mmap, pos: int) -> Tuple[int, int]:
+    first = buf[pos]
+    length = 9 - first.bit_length()
+    if length > 4:
+        raise Unsupported(f"invalid element ID at {pos}")
+    return int.from_bytes(buf[pos:pos + length], "big"), pos + length
+
+
+def _read_size(buf: mmap.mmap, pos: int) -> Tuple[int, int]:
+    """
+    A variable-size integer (element size, track number): (value, next position).
+    """
+    first = buf[pos]
+    length = 9 - first.bit_length()
+    if length > 8:
+        raise Unsupported(f"invalid size at {pos}")
+    value = first & (0xFF >> length)
+    if length > 1:
+        value = (value << 8 * (length - 1)) | int.from_bytes(buf[pos + 1:pos + length], "big")
+    if value == (1 << 7 * length) - 1:
+        return _UNKNOWN, pos + length
+    return value, pos + length
+
+
+def _header(buf: mmap.mmap, pos: int, end: int) -> Tuple[int, int, int]:
+    """
+    (ID, data start, data end) of the element at `pos`.
+    """
+    eid, pos = _read_id(buf, pos)
+    size, pos = _read_size(buf, pos)
+    if size == _UNKNOWN:
+        raise Unsupported("element of unknown size")
+    if pos + size > end:
+        raise Unsupported("truncated element")
+    return eid, pos, pos + size
+
+
+def _children(buf: mmap.mmap, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    pos = start
+    while pos < end:
+        eid, data, pos = _header(buf, pos, end)
+        yield eid, data, pos
+
+
+def _uint(buf: mmap.mmap, start: int, end: int) -> int:
+    return int.from_bytes(buf[start:end], "big")
+
+
+def _text(buf: mmap.mmap, start: int, end: int) -> str:
+    return buf[start:end].rstrip(b"\0").decode("utf-8")
+
+
+# ---- tracks ----
+
+class _Track:
+    def __init__(self) -> None:
+        self.number = 0
+        self.type = 0
+        self.codec = ""
+        self.private = b""
+        self.language = "eng"
+        self.default_duration = 0
+        # (algorithm, settings, scope) of a ContentCompression
+        self.compression: Optional[Tuple[int, bytes, int]] = None
+
+    def decode(self, data: bytes, scope: int = 1) -> bytes:
+        if not self.compression or not self.compression[2] & scope:
+            return data
+        algo, settings, _ = self.compression
+        if algo == 0:
+            return zlib.decompress(data)
+        if algo == 3:
+            # Header stripping
+            return settings + data
+        raise Unsupported(f"compression algorithm {algo}")
+
+
+def _encoding(buf: mmap.mmap, start: int, end: int, track: _Track) -> None:
+    encodings = [c for c in _children(buf, start, end) if c[0] == CONTENT_ENCODING]
+    if len(encodings) > 1:
+        raise Unsupported("chained content encodings")
+    for _, a, b in encodings:
+        scope, kind, algo, settings = 1, 0, 0, b""
+        for eid, ca, cb in _children(buf, a, b):
+            if eid == CONTENT_ENCODING_SCOPE:
+                scope = _uint(buf, ca, cb)
+            elif eid == CONTENT_ENCODING_TYPE:
+                kind = _uint(buf, ca, cb)
+            elif eid == CONTENT_COMPRESSION:
+                for sid, sa, sb in _children(buf, ca, cb):
+                    if sid == CONTENT_COMP_ALGO:
+                        algo = _uint(buf, sa, sb)
+                    elif sid == CONTENT_COMP_SETTINGS:
+                        settings = buf[sa:sb]
+        if kind != 0:
+            raise Unsupported("encrypted track")
+        track.compression = (algo, settings, scope)
+
+
+def _tracks(buf: mmap.mmap, start: int, end: int) -> List[_Track]:
+    tracks = []
+    for eid, a, b in _children(buf, start, end):
+        if eid != TRACK_ENTRY:
+            continue
+        track = _Track()
+        for tid, ta, tb in _children(buf, a, b):
+            if tid == TRACK_NUMBER:
+                track.number = _uint(buf, ta, tb)
+            elif tid == TRACK_TYPE:
+                track.type = _uint(buf, ta, tb)
+            elif tid == CODEC_ID:
+                track.codec = _text(buf, ta, tb)
+            elif tid == CODEC_PRIVATE:
+                track.private = buf[ta:tb]
+            elif tid == LANGUAGE:
+                track.language = _text(buf, ta, tb)
+            elif tid == DEFAULT_DURATION:
+                track.default_duration = _uint(buf, ta, tb)
+            elif tid == CONTENT_ENCODINGS:
+                _encoding(buf, ta, tb, track)
+        if track.type not in _STREAM_TYPES or not track.codec:
+            # ffmpeg skips such tracks, so its stream index wouldn't match ours
+            raise Unsupported(f"track {track.number} of type {track.type} ({track.codec or 'no codec'})")
+        tracks.append(track)
+    return tracks
+
+
+# ---- blocks ----
+
+class _Frame(NamedTuple):
+    start: int  # ns
+    end: int  # ns
+    data: bytes
+
+
+class _Reader:
+    def __init__(self, buf: mmap.mmap, track: _Track, scale: int) -> None:
+        self.buf = buf
+        self.track = track
+        self.scale = scale
+
+    def block(self, start: int, end: int, cluster_time: int, duration: Optional[int]) -> Optional[_Frame]:
+        """
+        The frame of a (Simple)Block's data, or None if it's another track's.
+        """
+        number, pos = _read_size(self.buf, start)
+        if number != self.track.number:
+            return None
+        relative = int.from_bytes(self.buf[pos:pos + 2], "big", signed=True)
+        if self.buf[pos + 2] & 0x06:
+            raise Unsupported("laced subtitle block")
+        begin = (cluster_time + relative) * self.scale
+        if duration is not None:
+            length = duration * self.scale
+        elif self.track.default_duration:
+            length = self.track.default_duration
+        else:
+            raise Unsupported("subtitle block without a duration")
+        return _Frame(begin, begin + length, self.track.decode(self.buf[pos + 3:end]))
+
+    def group(self, start: int, end: int, cluster_time: int) -> Optional[_Frame]:
+        block, duration, additions = None, None, False
+        for eid, a, b in _children(self.buf, start, end):
+            if eid == BLOCK:
+                block = (a, b)
+            elif eid == BLOCK_DURATION:
+                duration = _uint(self.buf, a, b)
+            elif eid == BLOCK_ADDITIONS:
+                additions = True
+        if not block:
+            return None
+        frame = self.block(block[0], block[1], cluster_time, duration)
+        if frame and additions:
+            # WebVTT cue settings and the like
+            raise Unsupported("block additions")
+        return frame
+
+    def element(self, eid: int, start: int, end: int, cluster_time: int) -> Optional[_Frame]:
+        if eid == SIMPLE_BLOCK:
+            return self.block(start, end, cluster_time, None)
+        if eid == BLOCK_GROUP:
+            return self.group(start, end, cluster_time)
+        return None
+
+    def walk(self, first_cluster: int, end: int) -> List[_Frame]:
+        """
+        Every frame of the track, reading only element headers elsewhere.
+        """
+        frames = []
+        for eid, a, b in _children(self.buf, first_cluster, end):
+            if eid != CLUSTER:
+                continue
+            cluster_time = 0
+            for cid, ca, cb in _children(self.buf, a, b):
+                if cid == TIMECODE:
+                    cluster_time = _uint(self.buf, ca, cb)
+                    continue
+                frame = self.element(cid, ca, cb, cluster_time)
+                if frame:
+                    frames.append(frame)
+        return frames
+
+    def indexed(
+        self, cues: Tuple[int, int], segment: int, first_cluster: int, end: int
+    ) -> Optional[List[_Frame]]:
+        """
+        The track's frames read straight from the Cues, when they index every
+        frame of it (mkvmerge does for subtitles, storing a duration and block
+        position per cue); None to walk the clusters instead. Only called for
+        files from _INDEXING_APPS, and _SAMPLE_CLUSTERS clusters are walked
+        to check that the index misses none of their frames.
+        """
+        targets = set()
+        for eid, a, b in _children(self.buf, *cues):
+            if eid != CUE_POINT:
+                continue
+            for pid, pa, pb in _children(self.buf, a, b):
+                if pid != CUE_TRACK_POSITIONS:
+                    continue
+                fields = {fid: _uint(self.buf, fa, fb) for fid, fa, fb in _children(self.buf, pa, pb)}
+                if fields.get(CUE_TRACK) != self.track.number:
+                    continue
+                if CUE_RELATIVE_POSITION not in fields or CUE_DURATION not in fields:
+                    return None
+                targets.add((fields[CUE_CLUSTER_POSITION], fields[CUE_RELATIVE_POSITION]))
+        if not targets:
+            return None
+        frames = []
+        times = {}
+        # Indexed frames per cluster
+        counts = {}
+        for cluster, relative in sorted(targets):
+            eid, data, cluster_end = _header(self.buf, segment + cluster, end)
+            if eid != CLUSTER:
+                return None
+            if cluster not in times:
+                times[cluster] = next(
+                    (_uint(self.buf, a, b) for cid, a, b in _children(self.buf, data, cluster_end) if cid == TIMECODE),
+                    0
+                )
+            eid, a, b = _header(self.buf, data + relative, cluster_end)
+            frame = self.element(eid, a, b, times[cluster])
+            if not frame:
+                return None
+            frames.append(frame)
+            counts[cluster] = counts.get(cluster, 0) + 1
+
+        # Spot-check the index against clusters spread over the whole file
+        # (cluster headers are cheap to list): any of them holding frames
+        # the index skipped means it is incomplete
+        clusters = []
+        pos = first_cluster
+        while pos < end:
+            eid, _, next_pos = _header(self.buf, pos, end)
+            if eid == CLUSTER:
+                clusters.append((pos, next_pos))
+            pos = next_pos
+        step = max(1, len(clusters) // _SAMPLE_CLUSTERS)
+        for start, cluster_end in clusters[step // 2::step]:
+            if len(self.walk(start, cluster_end)) != counts.get(start - segment, 0):
+                return None
+        return frames
+
+
+# ---- output ----
+
+def _clock(ns: int, fraction: str, digits: int, hour_width: int = 2) -> str:
+    ms = max(0, ns) // 1_000_000
+    hours, ms = divmod(ms, 3_600_000)
+    minutes, ms = divmod(ms, 60_000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:0{hour_width}d}:{minutes:02d}:{seconds:02d}{fraction}{ms // 10 ** (3 - digits):0{digits}d}"
+
+
+def _srt(track: _Track, frames: List[_Frame]) -> bytes:
+    out = []
+    for n, f in enumerate(frames, 1):
+        timing = f"{n}\n{_clock(f.start, ',', 3)} --> {_clock(f.end, ',', 3)}\n".encode()
+        out.append(timing + f.data.rstrip(b"\r\n") + b"\n\n")
+    return b"".join(out)
+
+
+def _webvtt(track: _Track, frames: List[_Frame]) -> bytes:
+    header = track.decode(track.private, 2).strip() or b"WEBVTT"
+    out = [header + b"\n\n"]
+    for f in frames:
+        timing = f"{_clock(f.start, '.', 3)} --> {_clock(f.end, '.', 3)}\n".encode()
+        out.append(timing + f.data.rstrip(b"\r\n") + b"\n\n")
+    return b"".join(out)
+
+
+def _ass(track: _Track, frames: List[_Frame]) -> bytes:
+    header = track.decode(track.private, 2).rstrip()
+    if b"[Events]" not in header:
+        raise Unsupported("ASS header without an [Events] section")
+    events = []
+    for f in frames:
+        # "ReadOrder,Layer,Style,Name,MarginL,MarginR,MarginV,Effect,Text"
+        order, layer, rest = f.data.split(b",", 2)
+        timing = f"{_clock(f.start, '.', 2, 1)},{_clock(f.end, '.', 2, 1)}".encode()
+        events.append((int(order), b"Dialogue: " + layer + b"," + timing + b"," + rest.rstrip(b"\r\n")))
+    events.sort(key=lambda e: e[0])
+    return b"\n".join([header] + [line for _, line in events]) + b"\n"
+
+
+_WRITERS = {"subrip": _srt, "webvtt": _webvtt, "ass": _ass}
+
+
+# ---- entry point ----
+
+def _extract(buf: mmap.mmap, index: int, codec_name: str, language: Optional[str]) -> bytes:
+    eid, data, end = _header(buf, 0, len(buf))
+    if eid != EBML:
+        raise Unsupported("not an EBML file")
+    doc_type = next((_text(buf, a, b) for cid, a, b in _children(buf, data, end) if cid == DOC_TYPE), "")
+    if doc_type not in ("matroska", "webm"):
+        raise Unsupported(f"document type {doc_type!r}")
+
+    eid, pos = _read_id(buf, end)
+    size, segment = _read_size(buf, pos)
+    if eid != SEGMENT:
+        raise Unsupported("no segment")
+    segment_end = len(buf) if size == _UNKNOWN else min(len(buf), segment + size)
+
+    # Top-level elements up to the first cluster; the SeekHead points at the rest
+    found = {}
+    first_cluster = pos = segment
+    while pos < segment_end:
+        eid, a, b = _header(buf, pos, segment_end)
+        if eid == CLUSTER:
+            break
+        first_cluster = pos = b
+        found.setdefault(eid, (a, b))
+        if eid == SEEK_HEAD:
+            for sid, sa, sb in _children(buf, a, b):
+                if sid != SEEK:
+                    continue
+                fields = {fid: (fa, fb) for fid, fa, fb in _children(buf, sa, sb)}
+                if SEEK_ID in fields and SEEK_POSITION in fields:
+                    target = _uint(buf, *fields[SEEK_ID])
+                    if target not in found and target in (TRACKS, INFO, CUES):
+                        at = segment + _uint(buf, *fields[SEEK_POSITION])
+                        tid, ta, tb = _header(buf, at, segment_end)
+                        if tid == target:
+                            found[target] = (ta, tb)
+    if TRACKS not in found:
+        raise Unsupported("no tracks")
+
+    scale = 1_000_000
+    writing_app = ""
+    if INFO in found:
+        for cid, a, b in _children(buf, *found[INFO]):
+            if cid == TIMECODE_SCALE:
+                scale = _uint(buf, a, b)
+            elif cid == WRITING_APP:
+                writing_app = _text(buf, a, b)
+
+    tracks = _tracks(buf, *found[TRACKS])
+    if not 0 <= index < len(tracks):
+        raise Unsupported(f"no track for stream {index}")
+    track = tracks[index]
+    if CODECS.get(track.codec) != codec_name.lower():
+        raise Unsupported(f"stream {index} is {track.codec}, expected {codec_name}")
+    if language and language != "und" and language != track.language:
+        raise Unsupported(f"stream {index} is in {track.language}, expected {language}")
+
+    reader = _Reader(buf, track, scale)
+    frames = None
+    if CUES in found and writing_app.lower().startswith(_INDEXING_APPS):
+        frames = reader.indexed(found[CUES], segment, first_cluster, segment_end)
+    if frames is None:
+        frames = reader.walk(first_cluster, segment_end)
+    frames.sort(key=lambda f: f.start)
+    return _WRITERS[codec_name.lower()](track, frames)
+
+
+def extract_subtitle(source: Union[str, Path], index: int, codec_name: str, language: Optional[str] = None) -> bytes:
+    """
+    The text subtitle of ffprobe stream `index` as an SRT, ASS or WebVTT file
+    (the format of `codec_name`). Blocking. Raises Unsupported for anything
+    ffmpeg should handle instead.
+    """
+    if not handles(codec_name):
+        raise Unsupported(f"codec {codec_name}")
+    try:
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if hasattr(buf, "madvise"):
+                # Only headers and a few blocks are read: no readahead of the rest
+                buf.madvise(mmap.MADV_RANDOM)
+            return _extract(buf, index, codec_name, language)
+    except Unsupported:
+        raise
+    except (IndexError, ValueError, KeyError, zlib.error, UnicodeDecodeError, OSError) as e:
+        raise Unsupported(f"{type(e).__name__}: {e}") from e
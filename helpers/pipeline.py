@@ -0,0 +1,70 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Set, Tuple
+
+from helpers.logger import logger
+
+Results = Dict[str, Any]
+
+
+class Stage(NamedTuple):
+    """
+    One step of a job. `run` gets the results of the stages finished so far.
+    """
+    name: str
+    run: Callable[[Results], Awaitable[Any]]
+    # Stages that must finish first; they must be listed before this one
+    after: Tuple[str, ...] = ()
+    # A critical failure fails the job; any other failure is logged and the
+    # stage's result is None
+    critical: bool = True
+    # May still be running when the job returns (non-critical stages only)
+    detach: bool = False
+
+
+# Detached stages still running, kept referenced until they finish
+_detached: Set[asyncio.Task] = set()
+
+
+async def _run_stage(stage: Stage, tasks: Dict[str, asyncio.Task], results: Results, what: str) -> None:
+    if stage.after:
+        await asyncio.gather(*(tasks[name] for name in stage.after))
+    started = time.monotonic()
+    try:
+        results[stage.name] = await stage.run(results)
+    except Exception as e:
+        if stage.critical:
+            raise
+        logger.warning(f"[pipeline] {stage.name} of {what} failed: {e}")
+        results[stage.name] = None
+    logger.debug(f"[pipeline] {stage.name} of {what} took {time.monotonic() - started:.2f}s")
+
+
+async def run(stages: Iterable[Stage], what: str) -> Results:
+    """
+    Run a job's stages, each as soon as the stages it comes after have
+    finished, so independent stages overlap. Returns the results by stage name.
+
+    Stages after a failed non-critical stage still run. The first critical
+    failure cancels every other stage and is raised. Detached stages that
+    are still running when the rest are done finish in the background.
+    """
+    stages = list(stages)
+    results: Results = {}
+    tasks: Dict[str, asyncio.Task] = {}
+    for stage in stages:
+        if stage.detach and stage.critical:
+            raise ValueError(f"critical stage {stage.name} cannot be detached")
+        tasks[stage.name] = asyncio.create_task(_run_stage(stage, tasks, results, what))
+    try:
+        await asyncio.gather(*(tasks[s.name] for s in stages if not s.detach))
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    for task in tasks.values():
+        if not task.done():
+            _detached.add(task)
+            task.add_done_callback(_detached.discard)
+    return results
@@ -0,0 +1,240 @@
+import json
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from config import Config
+from helpers.logger import logger
+from helpers.tools import CommandTimeout, execute
+
+# Stream types offered for extraction
+EXTRACTABLE = ("audio", "subtitle")
+
+
+def _parse_duration(value: Any) -> int:
+    """
+    Convert an ffprobe duration (seconds or an "HH:MM:SS.fff" tag) into whole seconds.
+    """
+    if value in (None, "", "N/A"):
+        return 0
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        h, m, sec = str(value).split(":")
+        return int(int(h) * 3600 + int(m) * 60 + float(sec))
+    except ValueError:
+        return 0
+
+
+def _stream_metadata(stream: Dict[str, Any], fmt: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Derive upload metadata (title, performer, duration, language) for a stream
+    from the ffprobe result, so uploads don't have to re-parse the output file.
+    """
+    tags = stream.get("tags", {})
+    fmt_tags = fmt.get("tags", {})
+    duration = (
+        _parse_duration(stream.get("duration"))
+        or _parse_duration(tags.get("DURATION") or tags.get("duration"))
+        or _parse_duration(fmt.get("duration"))
+    )
+    return {
+        "title": fmt_tags.get("title") or tags.get("title"),
+        "performer": fmt_tags.get("artist") or tags.get("artist"),
+        "duration": duration,
+        "language": tags.get("language", "und"),
+    }
+
+
+def _stream_size(stream: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    """
+    Size hints for a stream: its bitrate, and its total bytes where the muxer
+    (mkvmerge's statistics tags) recorded them.
+    """
+    tags = stream.get("tags", {})
+
+    def _int(value: Any) -> Optional[int]:
+        try:
+            return int(value) or None
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "bit_rate": _int(stream.get("bit_rate")) or _int(tags.get("BPS")),
+        "stream_bytes": _int(tags.get("NUMBER_OF_BYTES")),
+    }
+
+
+class _Profile(NamedTuple):
+    name: str
+    probesize: int
+    # microseconds
+    analyzeduration: int
+    timeout: float
+
+
+# The fast profile reads only the start of the file; the deep one is tried
+# once when it finds no extractable streams (or fails or times out)
+FAST = _Profile("fast", 5 * 1024 * 1024, 5_000_000, Config.PROBE_TIMEOUT)
+DEEP = _Profile("deep", 200 * 1024 * 1024, 60_000_000, Config.PROBE_TIMEOUT * 4)
+
+# Only the fields stream_entries() and the clip path read
+_ENTRIES = (
+    "stream=index,codec_type,codec_name,duration,bit_rate"
+    ":stream_tags=language,title,artist,DURATION,duration,BPS,NUMBER_OF_BYTES"
+    ":format=duration,format_name"
+    ":format_tags=title,artist"
+)
+
+
+class _Stats:
+    """
+    Probe latency of one container type.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.escalations = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.latencies: Deque[float] = deque(maxlen=200)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+        return {
+            "count": self.count,
+            "escalations": self.escalations,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "p50": pct(0.5),
+            "p95": pct(0.95),
+            "max": ordered[-1] if ordered else 0.0,
+        }
+
+
+_stats: Dict[str, _Stats] = {}
+
+
+async def _run(path: Path, profile: _Profile) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    One ffprobe pass. Returns (parsed result or None on failure, timed out).
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-probesize", str(profile.probesize),
+        "-analyzeduration", str(profile.analyzeduration),
+        "-show_entries", _ENTRIES,
+        "-print_format", "json",
+        str(path)
+    ]
+    try:
+        out, err, code, _ = await execute(cmd, timeout=profile.timeout)
+    except CommandTimeout:
+        logger.warning(f"[probe] {profile.name} probe of {path.name} timed out after {profile.timeout}s")
+        return None, True
+    if code != 0:
+        logger.warning(f"[probe] {profile.name} probe of {path.name} failed: {err.strip()[:200]}")
+        return None, False
+    try:
+        return json.loads(out), False
+    except ValueError:
+        return None, False
+
+
+def _extractable(info: Optional[Dict[str, Any]]) -> bool:
+    return bool(info) and any(s.get("codec_type") in EXTRACTABLE for s in info.get("streams", []))
+
+
+async def probe(path: Path) -> Dict[str, Any]:
+    """
+    Probe `path` for its streams and format, bounded in bytes read and time.
+    Escalates once to a deeper probe when the fast one finds nothing to extract.
+    """
+    path = Path(path)
+    started = time.monotonic()
+    escalated = timed_out = False
+    info, timed_out = await _run(path, FAST)
+    if not _extractable(info):
+        escalated = True
+        deep, deep_timeout = await _run(path, DEEP)
+        timed_out = timed_out or deep_timeout
+        if deep is not None:
+            info = deep
+    elapsed = time.monotonic() - started
+
+    container = (info or {}).get("format", {}).get("format_name") or path.suffix.lstrip(".").lower() or "unknown"
+    stats = _stats.setdefault(container, _Stats())
+    stats.count += 1
+    stats.escalations += escalated
+    stats.timeouts += timed_out
+    stats.latencies.append(elapsed)
+    if info is None:
+        stats.failures += 1
+        raise RuntimeError(f"ffprobe could not read {path.name}")
+    logger.debug(
+        f"[probe] {path.name} ({container}) in {elapsed * 1000:.0f} ms"
+        + (" after escalating" if escalated else "")
+    )
+    return info
+
+
+def probe_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Probe latency per container type, for /status and the worker heartbeat.
+    """
+    return {container: stats.snapshot() for container, stats in _stats.items()}
+
+
+def format_probe_stats(title: str, stats: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    /status lines for probe_stats().
+    """
+    if not stats:
+        return []
+    lines = [f"**{title}**:"]
+    for container, s in sorted(stats.items(), key=lambda kv: -kv[1]["count"]):
+        lines.append(
+            f"• `{container}`: `{s['count']}` probes, p50 `{s['p50'] * 1000:.0f} ms`, "
+            f"p95 `{s['p95'] * 1000:.0f} ms`, max `{s['max'] * 1000:.0f} ms`, "
+            f"`{s['escalations']}` deep, `{s['timeouts']}` timeouts, `{s['failures']}` failed"
+        )
+    lines.append("")
+    return lines
+
+
+def stream_entries(
+    info: Dict[str, Any],
+    path: Path,
+    fname: str,
+    user: Any,
+    job: Optional[str]
+) -> Tuple[Dict[str, Dict[str, Any]], List[Tuple[str, str, str]]]:
+    """
+    Build the extraction entries for every audio/subtitle stream of a probe result.
+
+    Returns (entries keyed by stream index, [(index, type, language)] for the keyboard).
+    """
+    fmt = info.get("format", {})
+    entries: Dict[str, Dict[str, Any]] = {}
+    streams = []
+    for stream in info.get("streams", []):
+        t = stream.get("codec_type")
+        if t in EXTRACTABLE:
+            idx = stream["index"]
+            lang = stream.get("tags", {}).get("language", "und")
+            name = stream.get("codec_name", t)  # e.g. "aac", "mp3", "subrip"
+            entries[str(idx)] = {"map": idx, "file": str(path), "location": str(path), "file_name": fname,
+                                 "user_id": user.id,
+                                 "user_first_name": user.first_name or "<unknown>",
+                                 "name": name, "type": t, "job": job,
+                                 "meta": _stream_metadata(stream, fmt),
+                                 **_stream_size(stream), }
+            streams.append((str(idx), t, lang))
+    return entries, streams
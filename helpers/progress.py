@@ -1,13 +1,28 @@
 import time
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from helpers.logger import logger
+from helpers.transfer_control import transfers
 
 # Progress tracking registries
 download_progress: Dict[str, Dict[str, Any]] = {}
 callback_progress: Dict[str, Dict[str, Any]] = {}
 upload_progress: Dict[str, Dict[str, Any]] = {}
 
+# Worker progress snapshots and queue depth, mirrored into the bot process (RUN_MODE=bot)
+remote_progress: Dict[str, Dict[str, Any]] = {}
+queue_status: Dict[str, int] = {}
+
+
+def has_active_transfers() -> bool:
+    """
+    True while any local transfer is running or the shared queue has work.
+    """
+    return bool(
+        download_progress or upload_progress
+        or queue_status.get("queued") or queue_status.get("running")
+    )
+
 
 def human_readable_bytes(size: float) -> str:
     """
@@ -50,6 +65,7 @@ async def progress_func(
     message: Any,
     start_time: float,
     original_message: Any,
+    followers: Optional[List[Any]] = None,
     interval: float = 5.0,
 ) -> None:
     """
@@ -59,11 +75,16 @@ async def progress_func(
         current: Bytes processed so far.
         total: Total bytes to process.
         ud_type: "download" or "upload".
-        message: Current Telegram message object.
+        message: Status message showing this transfer's progress, or None
+            when it has none of its own (batch items share the batch's).
         start_time: Epoch timestamp when transfer started.
-        original_message: The original Telegram message object.
+        original_message: The original Telegram message object; it identifies the transfer.
+        followers: (status message, original message) pairs sharing this transfer.
         interval: Minimum seconds between updates.
     """
+    # Every chunk feeds the adaptive transfer window, before the display throttle
+    transfers.record(f"{ud_type}:{original_message.chat.id}_{original_message.id}", current)
+
     now = time.monotonic()
     elapsed = now - start_time
     if elapsed < 0:
@@ -94,7 +115,12 @@ async def progress_func(
     key = f"{original_message.chat.id}_{original_message.id}_{ud_type}"
     download_progress[key] = record
 
-    callback_key = f"{message.chat.id}_{message.id}_callback"
-    callback_progress[callback_key] = record
+    if message is not None:
+        callback_progress[f"{message.chat.id}_{message.id}_callback"] = record
+
+    for status_msg, media_msg in followers or ():
+        download_progress[f"{media_msg.chat.id}_{media_msg.id}_{ud_type}"] = record
+        if status_msg is not None:
+            callback_progress[f"{status_msg.chat.id}_{status_msg.id}_callback"] = record
 
     #logger.info(f"[progress] {ud_type} {progress_pct:.2f}% ({key})")
@@ -0,0 +1,163 @@
+import math
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import Config
+from helpers import state_db
+from helpers.logger import logger
+
+# Metered resources
+DOWNLOAD = "download"   # bytes fetched from Telegram
+UPLOAD = "upload"       # bytes of extracted streams sent back
+CPU = "cpu"             # ffmpeg CPU seconds
+
+_LABELS = {DOWNLOAD: "download", UPLOAD: "upload", CPU: "processing"}
+
+# Bucket capacity per QUOTA_WINDOW_HOURS; each bucket refills evenly over the window
+_LIMITS: Dict[str, float] = {
+    DOWNLOAD: Config.QUOTA_DOWNLOAD_GB * 1024 ** 3,
+    UPLOAD: Config.QUOTA_UPLOAD_GB * 1024 ** 3,
+    CPU: Config.QUOTA_CPU_MINUTES * 60,
+}
+_WINDOW = max(Config.QUOTA_WINDOW_HOURS, 0.01) * 3600
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS quota (
+    user_id   INTEGER NOT NULL,
+    resource  TEXT NOT NULL,
+    tokens    REAL NOT NULL,
+    updated   REAL NOT NULL,
+    PRIMARY KEY (user_id, resource)
+);
+""")
+
+
+def _parse_tiers(spec: str) -> Dict[int, float]:
+    """
+    "user_id:multiplier,..." -> {user_id: multiplier}; 0 exempts a user.
+    """
+    tiers = {}
+    for item in spec.split(","):
+        user, _, mult = item.partition(":")
+        try:
+            tiers[int(user)] = float(mult)
+        except ValueError:
+            if item.strip():
+                logger.warning(f"Ignoring malformed QUOTA_TIERS entry {item!r}")
+    return tiers
+
+
+_TIERS = _parse_tiers(Config.QUOTA_TIERS or "")
+
+
+def _capacity(user_id: int, resource: str) -> float:
+    """
+    Bucket size for a user, or 0 when the user or resource is unmetered.
+    """
+    if user_id == Config.OWNER_ID:
+        return 0.0
+    return _LIMITS.get(resource, 0.0) * _TIERS.get(user_id, 1.0)
+
+
+def _bucket(
+    conn: sqlite3.Connection, user_id: int, resource: str, capacity: float, now: float
+) -> float:
+    row = conn.execute(
+        "SELECT tokens, updated FROM quota WHERE user_id = ? AND resource = ?", (user_id, resource)
+    ).fetchone()
+    if row is None:
+        return capacity
+    rate = capacity / _WINDOW
+    return min(capacity, row["tokens"] + max(0.0, now - row["updated"]) * rate)
+
+
+def _store(conn: sqlite3.Connection, user_id: int, resource: str, tokens: float, now: float) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO quota (user_id, resource, tokens, updated) VALUES (?, ?, ?, ?)",
+        (user_id, resource, tokens, now),
+    )
+
+
+def _reserve(conn: sqlite3.Connection, user_id: int, resource: str, amount: float, capacity: float) -> float:
+    now = time.time()
+    tokens = _bucket(conn, user_id, resource, capacity, now)
+    # A job bigger than the whole bucket only needs a full bucket
+    need = min(amount, capacity)
+    if tokens < need:
+        return (need - tokens) / (capacity / _WINDOW)
+    _store(conn, user_id, resource, tokens - amount, now)
+    return 0.0
+
+
+def _charge(conn: sqlite3.Connection, user_id: int, resource: str, amount: float, capacity: float) -> None:
+    now = time.time()
+    tokens = _bucket(conn, user_id, resource, capacity, now)
+    _store(conn, user_id, resource, min(capacity, tokens - amount), now)
+
+
+def _check(conn: sqlite3.Connection, user_id: int, resources: Tuple[Tuple[str, float], ...]) -> Tuple[float, str]:
+    now = time.time()
+    worst = (0.0, "")
+    for resource, capacity in resources:
+        tokens = _bucket(conn, user_id, resource, capacity, now)
+        if tokens <= 0:
+            wait = (1 - tokens) / (capacity / _WINDOW)
+            worst = max(worst, (wait, resource))
+    return worst
+
+
+async def reserve(user_id: int, resource: str, amount: float) -> float:
+    """
+    Take `amount` from the user's bucket up front. Returns 0 when admitted,
+    otherwise the seconds until enough has refilled (nothing is taken).
+    """
+    capacity = _capacity(user_id, resource)
+    if capacity <= 0 or amount <= 0:
+        return 0.0
+    try:
+        return await state_db.run(_reserve, user_id, resource, amount, capacity)
+    except Exception as e:
+        # Quotas protect fairness, not correctness; never block a job on them
+        logger.error(f"Quota reserve failed for {user_id}: {e}")
+        return 0.0
+
+
+async def charge(user_id: Optional[int], resource: str, amount: float) -> None:
+    """
+    Record usage measured after the fact; a negative amount refunds a reservation.
+    """
+    if not user_id or not amount:
+        return
+    capacity = _capacity(user_id, resource)
+    if capacity <= 0:
+        return
+    try:
+        await state_db.run(_charge, user_id, resource, amount, capacity)
+    except Exception as e:
+        logger.error(f"Quota charge failed for {user_id}: {e}")
+
+
+async def check(user_id: int, resources: Iterable[str]) -> Tuple[float, str]:
+    """
+    Whether the user may start work metered after the fact. Returns (0, "") if
+    so, else (seconds until the exhausted bucket is positive again, resource).
+    """
+    metered = tuple((r, _capacity(user_id, r)) for r in resources)
+    metered = tuple((r, c) for r, c in metered if c > 0)
+    if not metered:
+        return 0.0, ""
+    try:
+        return await state_db.run(_check, user_id, metered)
+    except Exception as e:
+        logger.error(f"Quota check failed for {user_id}: {e}")
+        return 0.0, ""
+
+
+def exhausted_message(resource: str, wait: float) -> str:
+    """
+    User-facing reply for a job refused by a quota.
+    """
+    minutes = math.ceil(wait / 60)
+    when = "in under a minute" if minutes <= 1 else f"in {minutes} min"
+    return f"⏳ You've used up your {_LABELS.get(resource, resource)} quota for now. It resumes {when}."
@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from pyrogram.errors import FloodWait
+
+from helpers.logger import logger
+
+T = TypeVar("T")
+
+# Priority classes, lowest value served first
+REPLY = 0    # user-facing replies, keyboards and deliveries
+STATUS = 1   # status/progress message edits
+LOG = 2      # log-channel traffic
+
+# Telegram's published bot limits: ~30 messages/s overall, ~1/s per private
+# chat, and 20/min per group or channel.
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30.0
+PRIVATE_RATE = 1.0
+PRIVATE_BURST = 3.0
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3.0
+FLOOD_RETRIES = 2
+_IDLE_BUCKET_TTL = 600.0
+
+
+class TokenBucket:
+    """
+    Token bucket with an optional hard block (set after a FloodWait).
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """
+        Seconds until a token can be taken (0 if one is available now).
+        """
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class _Scheduler:
+    """
+    Grants outbound request slots in priority order, subject to the global
+    bucket and the bucket of the target chat.
+    """
+
+    def __init__(self) -> None:
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, Optional[int], asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def bucket(self, chat_id: Optional[int]) -> Optional[TokenBucket]:
+        if chat_id is None:
+            return None
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if chat_id > 0:
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST)
+            else:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: Optional[int], priority: int) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), chat_id, fut))
+        self._wakeup.set()
+        await fut
+
+    def _grant_next(self, now: float) -> float:
+        """
+        Grant the best ready waiter. Returns 0 if one was granted, else how
+        long to sleep before anything can become ready.
+        """
+        wait = self.global_bucket.delay(now)
+        if wait > 0:
+            return wait
+
+        # Pop waiters in priority order; those whose chat is still throttled
+        # are set aside and pushed back afterwards
+        wait = float("inf")
+        deferred = []
+        granted = False
+        while self._waiters:
+            item = heapq.heappop(self._waiters)
+            _, _, chat_id, fut = item
+            if fut.done():
+                # Cancelled while waiting
+                continue
+            bucket = self.bucket(chat_id)
+            chat_wait = bucket.delay(now) if bucket else 0.0
+            if chat_wait <= 0:
+                self.global_bucket.take()
+                if bucket:
+                    bucket.take()
+                fut.set_result(None)
+                granted = True
+                break
+            deferred.append(item)
+            wait = min(wait, chat_wait)
+        for item in deferred:
+            heapq.heappush(self._waiters, item)
+        return 0.0 if granted else wait
+
+    def _prune(self, now: float) -> None:
+        idle = [
+            chat for chat, b in self.chat_buckets.items()
+            if now - b.updated > _IDLE_BUCKET_TTL and now >= b.blocked_until
+        ]
+        for chat in idle:
+            del self.chat_buckets[chat]
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self._waiters:
+                self._prune(time.monotonic())
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self._grant_next(time.monotonic())
+            if wait <= 0:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def flood_wait(self, chat_id: Optional[int], seconds: float) -> None:
+        """
+        Back off only the scope that hit the FloodWait: the chat if known, else everything.
+        """
+        bucket = self.bucket(chat_id) or self.global_bucket
+        bucket.block(seconds)
+        if self._wakeup:
+            self._wakeup.set()
+
+
+_scheduler = _Scheduler()
+
+
+async def api_call(
+    chat_id: Optional[int],
+    priority: int,
+    fn: Callable[..., Awaitable[T]],
+    /,
+    *args: Any,
+    **kwargs: Any
+) -> T:
+    """
+    Run an outbound Telegram call `fn(*args, **kwargs)` targeting `chat_id`
+    once the rate limiter grants it a slot in the given priority class.
+
+    A FloodWait blocks the affected chat (or the global bucket when `chat_id`
+    is None) and the call is retried up to FLOOD_RETRIES times.
+    """
+    for attempt in range(FLOOD_RETRIES + 1):
+        await _scheduler.acquire(chat_id, priority)
+        try:
+            return await fn(*args, **kwargs)
+        except FloodWait as e:
+            seconds = float(e.value or 1)
+            logger.warning(f"FloodWait {seconds:.0f}s on chat {chat_id} ({getattr(fn, '__name__', fn)})")
+            _scheduler.flood_wait(chat_id, seconds)
+            if attempt == FLOOD_RETRIES:
+                raise
+    raise RuntimeError("unreachable")
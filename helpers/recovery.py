@@ -0,0 +1,115 @@
+import asyncio
+from pathlib import Path
+from typing import Any, Dict
+
+from pyrogram import Client
+
+from config import Config
+from helpers import journal, sources, workspace
+from helpers.download import download_file
+from helpers.ffmpeg import EXTRACTORS
+from helpers.logger import logger
+from helpers.message_editor import edit
+from helpers.rate_limiter import api_call, STATUS
+from helpers.progress import download_progress
+
+# Seconds between sweeps for expired journal entries
+EXPIRE_INTERVAL = 900.0
+
+
+async def _restart_download(client: Client, job: Dict[str, Any]) -> None:
+    media = await client.get_messages(job["chat_id"], job["message_id"])
+    if not media or media.empty:
+        logger.info(f"[recovery] Media for job {job['job']} is gone; dropping it.")
+        await journal.discard(job["job"])
+        return
+
+    # The old status message (or stale keyboard) is superseded by the new download
+    if job["status_msg_id"]:
+        try:
+            await api_call(job["chat_id"], STATUS, client.delete_messages, job["chat_id"], job["status_msg_id"])
+        except Exception:
+            pass
+    asyncio.create_task(download_file(client, media))
+
+
+async def _resume(client: Client, job: Dict[str, Any]) -> None:
+    stage = job["stage"]
+    source = job["source"]
+    if stage != journal.DOWNLOADING and not (source and Path(source).exists()):
+        logger.warning(f"[recovery] Source of job {job['job']} is missing; downloading again.")
+        stage = journal.DOWNLOADING
+
+    if stage == journal.PROBED:
+        # Rebind the keyboard the user is still holding
+        download_progress[job["selection"]] = job["probe"]
+        logger.info(f"[recovery] Rebound stream keyboard {job['selection']}")
+    elif stage == journal.EXTRACTING:
+        message = await client.get_messages(job["chat_id"], job["status_msg_id"])
+        entry = job["chosen"]
+        extract_fn = EXTRACTORS.get(entry.get("type"), EXTRACTORS["subtitle"])
+        logger.info(f"[recovery] Re-running extraction of stream {entry.get('map')} for job {job['job']}")
+        asyncio.create_task(extract_fn(client, message, entry))
+    else:
+        logger.info(f"[recovery] Restarting download for job {job['job']}")
+        await _restart_download(client, job)
+
+
+async def expire_jobs(client: Client) -> int:
+    """
+    Drop stream keyboards nobody answered within JOURNAL_TTL_HOURS, and
+    downloads that died mid-way, deleting the sources only they held.
+    Returns how many jobs expired.
+    """
+    if not Config.JOURNAL_TTL_HOURS:
+        return 0
+    ttl = Config.JOURNAL_TTL_HOURS * 3600
+    jobs = await journal.expire(ttl, max(ttl, Config.DOWNLOAD_TIMEOUT_MAX))
+    for job in jobs:
+        if job["selection"]:
+            download_progress.pop(job["selection"], None)
+        try:
+            if job["source"]:
+                await sources.release(job["source"], job["job"])
+            if job["status_msg_id"]:
+                await edit(client, job["chat_id"], job["status_msg_id"],
+                           "⌛ This request expired. Send the file again to extract its streams.")
+        except Exception as e:
+            logger.warning(f"[recovery] Cleanup of expired job {job['job']} failed: {e}")
+    if jobs:
+        logger.info(f"[recovery] Expired {len(jobs)} idle journaled job(s)")
+    return len(jobs)
+
+
+async def expire_loop(client: Client, stop_event: asyncio.Event) -> None:
+    """
+    Expire idle journaled jobs every EXPIRE_INTERVAL seconds until `stop_event` is set.
+    """
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), EXPIRE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await expire_jobs(client)
+        except Exception:
+            logger.exception("[recovery] Expiring journaled jobs failed")
+
+
+async def resume_jobs(client: Client) -> None:
+    """
+    Resume every job left in the journal by a restart or crash, from its last completed stage.
+    """
+    await expire_jobs(client)
+    jobs = await journal.pending_jobs()
+    # Workspaces of jobs that are not coming back (batches, finished or
+    # discarded jobs interrupted mid-cleanup) only hold disk space
+    await workspace.sweep(job["job"] for job in jobs)
+    if jobs:
+        logger.info(f"[recovery] Resuming {len(jobs)} journaled job(s)")
+    for job in jobs:
+        try:
+            await _resume(client, job)
+        except Exception:
+            logger.exception(f"[recovery] Could not resume job {job['job']}")
+            await journal.discard(job["job"])
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from helpers import journal, state_db
+from helpers.logger import logger
+from helpers.tools import clean_up
+
+# Downloaded sources live in one directory per Telegram file_unique_id, so
+# identical files share a path and different files can never collide.
+DOWNLOAD_DIR = Path("downloads")
+
+# Processes sharing DOWNLOAD_DIR (bot-mode workers) claim a file_unique_id in
+# STATE_DB before downloading it, so only one of them writes to its directory.
+# The owner refreshes the claim every CLAIM_REFRESH seconds; one older than
+# CLAIM_STALE belongs to a dead process and is taken over.
+CLAIM_REFRESH = 15.0
+CLAIM_STALE = 60.0
+CLAIM_POLL = 2.0
+_OWNER = f"{socket.gethostname()}-{os.getpid()}"
+
+state_db.register_schema("""
+CREATE TABLE IF NOT EXISTS source_claims (
+    file_uid TEXT PRIMARY KEY,
+    owner    TEXT NOT NULL,
+    updated  REAL NOT NULL
+);
+""")
+
+# (status message, media message) pairs attached to an in-flight download
+Followers = List[Tuple[Any, Any]]
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.followers: Followers = []
+        self.task: Optional[asyncio.Task] = None
+
+
+_flights: Dict[str, _Flight] = {}
+# Jobs of this process holding a source before the journal references it
+_pins: Dict[str, int] = {}
+
+
+def source_dir(file_unique_id: str) -> Path:
+    return DOWNLOAD_DIR / file_unique_id
+
+
+def existing(file_unique_id: str, file_name: str, size: int) -> Optional[Path]:
+    """
+    A complete earlier download of the file that is still on disk, if any.
+    """
+    if not file_name or not size:
+        return None
+    path = source_dir(file_unique_id) / file_name
+    try:
+        if path.stat().st_size == size:
+            return path.resolve()
+    except OSError:
+        pass
+    return None
+
+
+def _claim(conn: sqlite3.Connection, file_uid: str, owner: str) -> bool:
+    now = time.time()
+    row = conn.execute(
+        "SELECT owner, updated FROM source_claims WHERE file_uid = ?", (file_uid,)
+    ).fetchone()
+    if row and row["owner"] != owner and row["updated"] >= now - CLAIM_STALE:
+        return False
+    conn.execute(
+        "INSERT OR REPLACE INTO source_claims (file_uid, owner, updated) VALUES (?, ?, ?)",
+        (file_uid, owner, now),
+    )
+    return True
+
+
+def _refresh(conn: sqlite3.Connection, file_uid: str, owner: str) -> None:
+    conn.execute(
+        "UPDATE source_claims SET updated = ? WHERE file_uid = ? AND owner = ?",
+        (time.time(), file_uid, owner),
+    )
+
+
+def _unclaim(conn: sqlite3.Connection, file_uid: str, owner: str) -> None:
+    conn.execute("DELETE FROM source_claims WHERE file_uid = ? AND owner = ?", (file_uid, owner))
+
+
+async def _keep_claim(file_uid: str) -> None:
+    while True:
+        await asyncio.sleep(CLAIM_REFRESH)
+        try:
+            await state_db.run(_refresh, file_uid, _OWNER)
+        except Exception as e:
+            logger.warning(f"[sources] Failed to refresh claim on {file_uid}: {e}")
+
+
+async def _claimed(
+    file_unique_id: str,
+    start: Callable[[Followers], Awaitable[Optional[Path]]],
+    followers: Followers,
+    reuse: Callable[[], Optional[Path]]
+) -> Tuple[Optional[Path], bool]:
+    """
+    Run `start` holding the cross-process claim on the file. After waiting
+    for another process's download, its result is reused when complete.
+    """
+    waited = False
+    while not await state_db.run(_claim, file_unique_id, _OWNER):
+        if not waited:
+            logger.info(f"[sources] {file_unique_id} is being downloaded by another process; waiting")
+            waited = True
+        await asyncio.sleep(CLAIM_POLL)
+    try:
+        path = reuse() if waited else None
+        if path:
+            return path, True
+        keeper = asyncio.create_task(_keep_claim(file_unique_id))
+        try:
+            return await start(followers), False
+        finally:
+            keeper.cancel()
+    finally:
+        await state_db.run(_unclaim, file_unique_id, _OWNER)
+
+
+def pin(file_unique_id: str) -> None:
+    _pins[file_unique_id] = _pins.get(file_unique_id, 0) + 1
+
+
+def unpin(file_unique_id: str) -> None:
+    count = _pins.get(file_unique_id, 0) - 1
+    if count > 0:
+        _pins[file_unique_id] = count
+    else:
+        _pins.pop(file_unique_id, None)
+
+
+async def shared(
+    file_unique_id: str,
+    follower: Tuple[Any, Any],
+    start: Callable[[Followers], Awaitable[Optional[Path]]],
+    reuse: Callable[[], Optional[Path]]
+) -> Tuple[Optional[Path], bool]:
+    """
+    Single-flight download of a file: the first caller runs `start(followers)`,
+    later callers attach to it until it finishes. `follower` is the caller's
+    (status message, media message), which the leader mirrors progress into.
+    Across processes the leader first claims the file; if another process
+    held it, `reuse()` returns that process's complete download, if any.
+
+    Returns (path or None, whether the caller joined an in-flight download).
+    """
+    flight = _flights.get(file_unique_id)
+    if flight:
+        flight.followers.append(follower)
+        try:
+            # Shielded so one requester leaving doesn't abort the others' download
+            path, _ = await asyncio.shield(flight.task)
+            return path, True
+        finally:
+            flight.followers.remove(follower)
+
+    flight = _flights[file_unique_id] = _Flight()
+    flight.task = asyncio.create_task(_claimed(file_unique_id, start, flight.followers, reuse))
+    flight.task.add_done_callback(lambda _: _flights.pop(file_unique_id, None))
+    return await asyncio.shield(flight.task)
+
+
+async def release(source: Union[str, Path], job: Optional[str] = None) -> None:
+    """
+    Drop `job`'s claim on a downloaded source and delete it once no other
+    pinned or journaled job references it.
+    """
+    path = Path(source)
+    if _pins.get(path.parent.name):
+        return
+    refs = await journal.source_refs(str(path), exclude=job)
+    if refs:
+        logger.debug(f"[sources] {path.name} still used by {refs} job(s)")
+        return
+    await clean_up(path)
+    # Remove the per-file directory (or job workspace) once it is empty
+    prune(path.parent)
+
+
+def prune(directory: Path) -> None:
+    """
+    Remove `directory` and its parents while they are empty, stopping at DOWNLOAD_DIR.
+    """
+    root = DOWNLOAD_DIR.resolve()
+    directory = directory.resolve()
+    while root in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+        directory = directory.parent
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, List, Tuple, TypeVar
+
+from config import Config
+from helpers.logger import logger
+
+T = TypeVar("T")
+
+# Stages and their static bounds (seconds)
+DOWNLOAD = "download"
+EXTRACT = "extract"
+UPLOAD = "upload"
+
+_BOUNDS: Dict[str, Tuple[float, float]] = {
+    DOWNLOAD: (Config.DOWNLOAD_TIMEOUT_MIN, Config.DOWNLOAD_TIMEOUT_MAX),
+    EXTRACT: (Config.EXTRACT_TIMEOUT_MIN, Config.EXTRACT_TIMEOUT_MAX),
+    UPLOAD: (Config.UPLOAD_TIMEOUT_MIN, Config.UPLOAD_TIMEOUT_MAX),
+}
+
+# Rates assumed until a path has SAMPLES_NEEDED observations, in work units
+# per second: bytes for transfers and stream copies, media seconds for
+# re-encoding. Deliberately pessimistic; the floor/ceiling still apply.
+_DEFAULT_RATES: Dict[str, float] = {
+    DOWNLOAD: 128 * 1024,
+    UPLOAD: 128 * 1024,
+    EXTRACT: 4 * 1024 * 1024,
+    "encode": 2.0,
+}
+SAMPLES = 50
+SAMPLES_NEEDED = 5
+# A job may run this many times longer than the slow end (RATE_PERCENTILE)
+# of recent jobs on the same path before it counts as hung
+SLACK = 4.0
+RATE_PERCENTILE = 0.1
+
+
+class StageTimeout(asyncio.TimeoutError):
+    """
+    A stage ran past its adaptive timeout and was cancelled.
+    """
+
+
+class _Path:
+    """
+    Recent rates of one (stage, codec path), and its outcomes.
+    """
+
+    def __init__(self) -> None:
+        self.rates: Deque[float] = deque(maxlen=SAMPLES)
+        self.completed = 0
+        self.timeouts = 0
+
+    def rate(self, percentile: float) -> float:
+        ordered = sorted(self.rates)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+_paths: Dict[Tuple[str, str], _Path] = {}
+
+
+def _entry(stage: str, path: str) -> _Path:
+    return _paths.setdefault((stage, path), _Path())
+
+
+def limit(stage: str, path: str, work: float) -> float:
+    """
+    Timeout in seconds for `work` units (bytes, or media seconds when
+    re-encoding) on a stage's codec path.
+    """
+    low, high = _BOUNDS[stage]
+    entry = _paths.get((stage, path))
+    if entry and len(entry.rates) >= SAMPLES_NEEDED:
+        rate = entry.rate(RATE_PERCENTILE)
+    else:
+        rate = _DEFAULT_RATES.get(path, _DEFAULT_RATES[stage])
+    expected = work / rate if work > 0 and rate > 0 else high
+    return max(low, min(high, expected * SLACK))
+
+
+def observe(stage: str, path: str, work: float, elapsed: float) -> None:
+    """
+    Record a completed job; its rate informs later timeouts on the same path.
+    """
+    entry = _entry(stage, path)
+    entry.completed += 1
+    if work > 0 and elapsed > 0:
+        entry.rates.append(work / elapsed)
+
+
+def expired(stage: str, path: str, timeout: float, what: str) -> None:
+    """
+    Count a job cancelled for running past `timeout`.
+    """
+    _entry(stage, path).timeouts += 1
+    logger.warning(f"[timeout] {stage}/{path} of {what} cancelled after {timeout:.0f}s")
+
+
+async def bounded(stage: str, path: str, work: float, what: str, aw: Awaitable[T]) -> T:
+    """
+    Await `aw` under the adaptive timeout for its stage and path. A job that
+    runs over is cancelled, counted, and reported as StageTimeout.
+    """
+    timeout = limit(stage, path, work)
+    started = time.monotonic()
+    try:
+        result = await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        expired(stage, path, timeout, what)
+        raise StageTimeout(f"{stage} of {what} timed out after {timeout:.0f}s") from None
+    observe(stage, path, work, time.monotonic() - started)
+    return result
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {
+        f"{stage}/{path}": {
+            "completed": entry.completed,
+            "timeouts": entry.timeouts,
+            "samples": len(entry.rates),
+            "p50": entry.rate(0.5) if entry.rates else 0.0,
+            "slow": entry.rate(RATE_PERCENTILE) if entry.rates else 0.0,
+        }
+        for (stage, path), entry in sorted(_paths.items())
+    }
+
+
+def _unit(key: str, rate: float) -> str:
+    if key.endswith("/encode"):
+        return f"{rate:.1f}x"
+    return f"{rate / (1024 * 1024):.2f} MB/s"
+
+
+def format_snapshot(title: str, snap: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    /status lines for stage timeout metrics.
+    """
+    if not snap:
+        return []
+    lines = [f"**{title}**:"]
+    for key, s in snap.items():
+        lines.append(
+            f"• {key}: `{s['completed']}` done, `{s['timeouts']}` timed out, "
+            f"p50 `{_unit(key, s['p50'])}`, p10 `{_unit(key, s['slow'])}`"
+        )
+    lines.append("")
+    return lines
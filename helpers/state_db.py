@@ -0,0 +1,93 @@
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+from config import Config
+from helpers.logger import logger
+
+T = TypeVar("T")
+
+# One connection per process, serialized by a lock; cross-process safety comes
+# from SQLite's WAL mode and BEGIN IMMEDIATE transactions.
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+_schemas: List[str] = []
+# (table, column, declaration) added to tables created by older versions
+_columns: List[Tuple[str, str, str]] = []
+
+
+def register_schema(ddl: str) -> None:
+    """
+    Register DDL (CREATE ... IF NOT EXISTS) to run when the database is opened.
+    """
+    _schemas.append(ddl)
+    if _conn is not None:
+        with _lock:
+            _conn.executescript(ddl)
+
+
+def register_column(table: str, column: str, declaration: str) -> None:
+    """
+    Register a column that a table registered earlier gained later; it is
+    added with ALTER TABLE to databases created without it.
+    """
+    _columns.append((table, column, declaration))
+    if _conn is not None:
+        with _lock:
+            _add_column(_conn, table, column, declaration)
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> None:
+    existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        try:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        except sqlite3.OperationalError as e:
+            # Another process added it first
+            if "duplicate column" not in str(e):
+                raise
+
+
+def _connection() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(
+            Config.STATE_DB,
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for ddl in _schemas:
+            conn.executescript(ddl)
+        for table, column, declaration in _columns:
+            _add_column(conn, table, column, declaration)
+        logger.info(f"Opened state database {Config.STATE_DB}")
+        _conn = conn
+    return _conn
+
+
+def transact(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Run `fn(conn, *args)` inside a single write transaction (blocking).
+    """
+    with _lock:
+        conn = _connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+
+async def run(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Run `fn(conn, *args)` in a transaction on a worker thread, off the event loop.
+    """
+    return await asyncio.to_thread(transact, fn, *args)
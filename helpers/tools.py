@@ -1,13 +1,19 @@
 import asyncio
 import shlex
-import shutil
 import subprocess
 from pathlib import Path
 from typing import Optional, Tuple, Union, Sequence
 
+from helpers import fs, lifecycle
 from helpers.logger import logger
 
 
+class CommandTimeout(asyncio.TimeoutError):
+    """
+    A command ran past its timeout and was killed.
+    """
+
+
 def _prepare_args(command: Union[str, Sequence[str]]) -> list[str]:
     """
     Prepare command arguments for subprocess execution, handling both string and sequence inputs.
@@ -30,6 +36,9 @@ async def execute(
 
     Returns:
         stdout, stderr, return_code, pid
+
+    Raises:
+        CommandTimeout: The process ran past `timeout` and was killed.
     """
     args = _prepare_args(command)
     try:
@@ -38,6 +47,8 @@ async def execute(
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
+        # Tracked so a hard-cancelled restart kills only our own children
+        lifecycle.register_child(proc.pid)
         try:
             stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
         except asyncio.TimeoutError:
@@ -45,18 +56,90 @@ async def execute(
             await proc.wait()
             msg = f"[execute] Command timeout after {timeout}s"
             logger.error(msg)
-            return "", msg, -1, proc.pid
+            raise CommandTimeout(msg) from None
+        except asyncio.CancelledError:
+            # A cancelled job must not leave its process running
+            proc.kill()
+            raise
+        finally:
+            lifecycle.unregister_child(proc.pid)
 
         out = stdout.decode(errors="replace").strip()
         err = stderr.decode(errors="replace").strip()
         return out, err, proc.returncode, proc.pid
 
+    except CommandTimeout:
+        raise
     except Exception as e:
         err_msg = f"[execute] Exception: {e}"
         logger.error(err_msg)
         return "", err_msg, -1, 0
 
 
+async def execute_bytes(
+    command: Union[str, Sequence[str]],
+    limit: int,
+    timeout: Optional[float] = None
+) -> Tuple[Optional[bytes], str, int]:
+    """
+    Execute a command and capture its raw stdout in memory, stopping the
+    process as soon as stdout grows beyond `limit` bytes.
+
+    Args:
+        command: Command to run (string or list of args).
+        limit: Maximum number of stdout bytes to keep.
+        timeout: Seconds before forcibly terminating the process.
+
+    Returns:
+        stdout (None if it exceeded `limit` or the command failed to run), stderr, return_code
+
+    Raises:
+        CommandTimeout: The process ran past `timeout` and was killed.
+    """
+    args = _prepare_args(command)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except Exception as e:
+        err_msg = f"[execute_bytes] Exception: {e}"
+        logger.error(err_msg)
+        return None, err_msg, -1
+
+    async def read_stdout() -> Optional[bytes]:
+        buf = bytearray()
+        while True:
+            data = await proc.stdout.read(64 * 1024)
+            if not data:
+                return bytes(buf)
+            buf += data
+            if len(buf) > limit:
+                proc.kill()
+                return None
+
+    lifecycle.register_child(proc.pid)
+    try:
+        out, err = await asyncio.wait_for(
+            asyncio.gather(read_stdout(), proc.stderr.read()), timeout
+        )
+        await proc.wait()
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        msg = f"[execute_bytes] Command timeout after {timeout}s"
+        logger.error(msg)
+        raise CommandTimeout(msg) from None
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    finally:
+        lifecycle.unregister_child(proc.pid)
+
+    return out, err.decode(errors="replace").strip(), proc.returncode
+
+
 async def clean_up(
     *paths: Union[str, Path],
     retries: int = 3,
@@ -64,30 +147,12 @@ async def clean_up(
 ) -> None:
     """
     Attempt to delete each provided path (file or directory) up to `retries` times,
-    waiting `delay` seconds between attempts.
+    waiting `delay` seconds between attempts. The deletes run on the filesystem
+    thread pool (helpers.fs), so large files and trees don't block the event loop.
 
     Args:
         paths: Paths to delete.
         retries: Maximum deletion attempts per path.
         delay: Delay between retries in seconds.
     """
-    for raw in paths:
-        path = Path(raw)
-        for attempt in range(1, retries + 1):
-            if not path.exists():
-                logger.info(f"[clean_up] {path!r} not found; skipping.")
-                break
-            try:
-                if path.is_dir():
-                    shutil.rmtree(path)
-                    logger.info(f"[clean_up] Removed directory {path!r} (attempt {attempt}).")
-                else:
-                    path.unlink()
-                    logger.info(f"[clean_up] Deleted file {path!r} (attempt {attempt}).")
-                break
-            except Exception as e:
-                logger.warning(f"[clean_up] Failed to delete {path!r} (attempt {attempt}): {e}")
-                if attempt < retries:
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(f"[clean_up] Could not remove {path!r} after {retries} attempts.")
+    await fs.remove(*paths, retries=retries, delay=delay)
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from config import Config
+from helpers.logger import logger
+
+INITIAL_WINDOW = 4
+CONTROL_INTERVAL = 10.0
+# Aggregate throughput must beat the baseline by GAIN to keep growing the
+# window; falling LOSS below it (or per-transfer speed under the floor)
+# shrinks the window by BACKOFF.
+GAIN = 0.05
+LOSS = 0.20
+BACKOFF = 0.7
+MIN_PER_TRANSFER = 64 * 1024
+# Ticks spent holding at a plateau before probing one slot higher
+PROBE_AFTER = 6
+
+
+def _rate(value: float) -> str:
+    return f"{value / (1024 * 1024):.2f} MB/s"
+
+
+class AdaptiveLimiter:
+    """
+    Admission gate for Telegram transfers whose window of concurrent
+    transfers is tuned AIMD-style from measured throughput.
+    """
+
+    def __init__(self, upper: int, initial: int = INITIAL_WINDOW) -> None:
+        self.upper = max(1, upper)
+        self.window = max(1, min(initial, self.upper))
+        self.active = 0
+        self.waiting = 0
+        self.throughput = 0.0
+        self.per_transfer = 0.0
+        self.decisions: Deque[str] = deque(maxlen=3)
+        self._cond: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._bytes = 0.0
+        self._last: Dict[str, float] = {}
+        self._seen: set = set()
+        self._saturated = False
+        self._baseline: Optional[float] = None
+        self._held = 0
+        self._tick = time.monotonic()
+
+    def _start(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        if self._task is None or self._task.done():
+            self._tick = time.monotonic()
+            self._task = asyncio.create_task(self._control_loop())
+        return self._cond
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Hold one transfer slot for the duration of the block.
+        """
+        cond = self._start()
+        async with cond:
+            self.waiting += 1
+            try:
+                if self.active >= self.window:
+                    self._saturated = True
+                await cond.wait_for(lambda: self.active < self.window)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            if self.active >= self.window:
+                self._saturated = True
+        try:
+            yield
+        finally:
+            async with cond:
+                self.active -= 1
+                cond.notify_all()
+
+    def record(self, key: str, current: float) -> None:
+        """
+        Account bytes reported by a transfer's progress callback.
+        """
+        last = self._last.get(key, 0.0)
+        # A restarted transfer (e.g. the log-channel copy) counts from zero again
+        self._bytes += current - last if current >= last else current
+        self._last[key] = current
+        self._seen.add(key)
+
+    def _decide(self, throughput: float) -> Optional[str]:
+        if self._baseline is None:
+            self._baseline = throughput
+            return "grow"
+        if self.active > 1 and self.per_transfer < MIN_PER_TRANSFER:
+            return "shrink"
+        if throughput > self._baseline * (1 + GAIN):
+            return "grow"
+        if throughput < self._baseline * (1 - LOSS):
+            return "shrink"
+        self._held += 1
+        if self._held >= PROBE_AFTER:
+            return "grow"
+        return None
+
+    async def _adjust(self) -> None:
+        now = time.monotonic()
+        elapsed = max(now - self._tick, 1e-6)
+        self._tick = now
+        throughput = self._bytes / elapsed
+        self._bytes = 0.0
+        # Forget transfers that reported nothing during this interval
+        self._last = {k: v for k, v in self._last.items() if k in self._seen}
+        self._seen = set()
+
+        self.throughput = throughput
+        self.per_transfer = throughput / self.active if self.active else 0.0
+        saturated = self._saturated or self.waiting > 0
+        self._saturated = False
+        # Only demand that hits the window tells us anything about it
+        if not self.active or not saturated:
+            return
+
+        decision = self._decide(throughput)
+        old = self.window
+        if decision == "grow":
+            self.window = min(self.upper, self.window + 1)
+            self._held = 0
+        elif decision == "shrink":
+            self.window = max(1, int(self.window * BACKOFF))
+            self._held = 0
+        self._baseline = 0.7 * self._baseline + 0.3 * throughput
+
+        if self.window != old:
+            note = (
+                f"{time.strftime('%H:%M:%S')} {old}→{self.window} at {_rate(throughput)} "
+                f"({_rate(self.per_transfer)} each)"
+            )
+            self.decisions.append(note)
+            logger.info(f"[transfer] window {note}")
+            async with self._cond:
+                self._cond.notify_all()
+
+    async def _control_loop(self) -> None:
+        while True:
+            await asyncio.sleep(CONTROL_INTERVAL)
+            try:
+                await self._adjust()
+            except Exception:
+                logger.exception("[transfer] Window adjustment failed")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "window": self.window,
+            "upper": self.upper,
+            "active": self.active,
+            "waiting": self.waiting,
+            "throughput": self.throughput,
+            "per_transfer": self.per_transfer,
+            "decisions": list(self.decisions),
+        }
+
+
+def format_snapshot(title: str, snap: Dict[str, Any]) -> list[str]:
+    """
+    /status lines for a limiter snapshot.
+    """
+    lines = [
+        f"**{title}**: window `{snap['window']}/{snap['upper']}`, "
+        f"`{snap['active']}` active, `{snap['waiting']}` waiting",
+        f"• Throughput: `{_rate(snap['throughput'])}` (`{_rate(snap['per_transfer'])}` each)",
+    ]
+    lines.extend(f"• {d}" for d in snap.get("decisions", []))
+    lines.append("")
+    return lines
+
+
+# Shared by every download and upload in this process
+transfers = AdaptiveLimiter(Config.MAX_CONCURRENT_TRANSMISSIONS)
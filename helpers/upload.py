@@ -1,193 +1,403 @@
 import asyncio
+import os
 import time
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 
-from hachoir.metadata import extractMetadata
-from hachoir.parser import createParser
 from pyrogram import Client
 from pyrogram.enums import ParseMode
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.errors import FloodWait
+from pyrogram.types import Message
 
 from config import Config
+from helpers import fs, pipeline, stage_timeouts
+from helpers.client_pool import pool
+from helpers.keyboards import UPLOAD_PROGRESS_KEYBOARD
 from helpers.logger import logger
+from helpers.message_editor import edit_message, forget
+from helpers.rate_limiter import api_call, REPLY, STATUS, LOG
 from helpers.progress import progress_func, upload_progress, callback_progress
-from helpers.tools import clean_up
+from helpers.transfer_control import transfers
 
 # Configuration
 LOG_CHANNEL = Config.LOG_CHANNEL
 BOT_USERNAME = Config.BOT_USERNAME
+METADATA_TIMEOUT = 10.0
 
 
-def _extract_metadata(file_path: Path) -> Dict[str, Any]:
+def _parse_metadata(file_path: Path) -> Dict[str, Any]:
     """
-    Extract metadata (title, artist, duration) from a media file.
+    Extract metadata (title, performer, duration) from a media file with hachoir.
+    Blocking; only used as a fallback when the probe result carried no duration.
     """
-    metadata = extractMetadata(createParser(str(file_path)))
-    data: Dict[str, Any] = {"title": None, "artist": None, "duration": 0}
+    from hachoir.metadata import extractMetadata
+    from hachoir.parser import createParser
+
+    data: Dict[str, Any] = {"title": None, "performer": None, "duration": 0}
+    parser = createParser(str(file_path))
+    if not parser:
+        return data
+    with parser:
+        metadata = extractMetadata(parser)
     if metadata:
         if metadata.has("title"):
             data["title"] = metadata.get("title")
         if metadata.has("artist"):
-            data["artist"] = metadata.get("artist")
+            data["performer"] = metadata.get("artist")
         if metadata.has("duration"):
             data["duration"] = metadata.get("duration").seconds
     return data
 
 
-async def upload_audio(
-    client: Client,
-    message: Message,
-    file_loc: str,
-    username: str,
-    user_id: int,
-    file_name: str
-) -> None:
+async def _resolve_metadata(file_path: Path, meta: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     """
-    Upload an audio stream to the user and log channel with progress.
+    Return upload metadata, preferring what ffprobe already reported for the stream.
+    Falls back to parsing the output in a worker thread, bounded by METADATA_TIMEOUT.
     """
-    unique_id = f"{message.chat.id}_{message.id}_upload"
-    start_time = time.monotonic()
-    upload_progress[unique_id] = {"file_name": file_name, "start_time": start_time, "user_id": user_id}
-
-    # Show initial uploading message
-    status_msg = await message.edit_text(
-        text="**Uploading extracted stream...**",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton(text="Progress", callback_data="progress_msg_upload")]
-        ]),
-        parse_mode=ParseMode.MARKDOWN
-    )
-
-    # Extract metadata
-    file_path = Path(file_loc)
-    meta = _extract_metadata(file_path)
-
+    data: Dict[str, Any] = {"title": None, "performer": None, "duration": 0}
+    data.update(meta or {})
+    if data.get("duration"):
+        return data
     try:
-        await asyncio.sleep(1)
-        logger.info(f"Starting upload for {file_name}")
+        parsed = await asyncio.wait_for(
+            asyncio.to_thread(_parse_metadata, file_path), METADATA_TIMEOUT
+        )
+    except Exception as e:
+        logger.warning(f"Metadata fallback failed for {file_path.name}: {e}")
+        return data
+    for field, value in parsed.items():
+        if not data.get(field):
+            data[field] = value
+    return data
+
 
-        await client.send_audio(
-            chat_id=message.chat.id,
+def _media_kwargs(
+    client: Client, kind: str, file_loc: Union[str, BinaryIO], meta: Dict[str, Any]
+) -> Tuple[Callable[..., Any], Dict[str, Any]]:
+    if kind == "audio":
+        return client.send_audio, dict(
             audio=file_loc,
-            thumb=meta.get("thumbnail"),
-            caption=f"Uploaded by {BOT_USERNAME}",
             title=meta.get("title"),
-            performer=meta.get("artist"),
-            duration=meta.get("duration"),
-            progress=progress_func,
-            progress_args=("upload", status_msg, start_time, message)
+            performer=meta.get("performer"),
+            duration=meta.get("duration")
         )
-    except Exception as e:
-        logger.error(f"upload_audio error for {file_name}: {e}")
-        await status_msg.edit_text(
-            text=f"**Error uploading {file_name}.** Check logs."
+    return client.send_document, dict(document=file_loc)
+
+
+def _log_caption(username: str, user_id: int) -> str:
+    return f"Extracted by: <a href='tg://user?id={user_id}'>{username}</a>"
+
+
+def _size(file_loc: Union[str, BinaryIO]) -> int:
+    if isinstance(file_loc, str):
+        return os.path.getsize(file_loc)
+    return file_loc.getbuffer().nbytes
+
+
+def _bounded(send: Callable[..., Any], kind: str, file_loc: Union[str, BinaryIO]) -> Callable[..., Any]:
+    """
+    `send` under the adaptive upload timeout. The clock starts per attempt,
+    after the rate limiter has granted the call.
+    """
+    size = _size(file_loc)
+
+    async def call(**kwargs: Any) -> Any:
+        return await stage_timeouts.bounded(
+            stage_timeouts.UPLOAD, kind, size, _name(file_loc), send(**kwargs)
         )
-        await clean_up(file_loc)
-        _cleanup_upload(unique_id)
-        return
+    return call
 
-    # Forward to log channel if configured
-    if LOG_CHANNEL:
-        try:
-            await asyncio.sleep(1)
-            logger.info(f"Logging upload for {file_name}")
-            await client.send_audio(
+
+async def _post_via_helper(
+    member: Any,
+    kind: str,
+    file_loc: Union[str, BinaryIO],
+    meta: Dict[str, Any],
+    progress_args: tuple,
+    log_as: Tuple[str, int]
+) -> Optional[Message]:
+    """
+    Upload through a helper bot: it posts the file to LOG_CHANNEL, for the
+    primary bot to copy on to the user, so the file is uploaded once and the
+    log entry comes for free. Returns the post, or None when the helper
+    failed and the primary bot should upload itself.
+    """
+    send, media_kwargs = _media_kwargs(member.client, kind, file_loc, meta)
+    send = _bounded(send, kind, file_loc)
+    started = time.monotonic()
+    try:
+        # Called directly rather than through api_call: a helper's
+        # FloodWait is its own and should fail over, not stall the channel
+        async with transfers.slot():
+            posted = await send(
                 chat_id=int(LOG_CHANNEL),
-                audio=file_loc,
-                thumb=meta.get("thumbnail"),
-                caption=f"Extracted by: <a href='tg://user?id={user_id}'>{username}</a>",
-                title=meta.get("title"),
-                performer=meta.get("artist"),
-                duration=meta.get("duration"),
+                caption=_log_caption(*log_as),
                 parse_mode=ParseMode.HTML,
                 progress=progress_func,
-                progress_args=("upload", status_msg, start_time, message)
+                progress_args=progress_args,
+                **media_kwargs
             )
-        except Exception as e:
-            logger.error(f"Error logging upload for {file_name}: {e}")
-            await status_msg.edit_text(
-                text=f"**Error sending {file_name} to log channel.**"
+    except Exception as e:
+        if isinstance(e, FloodWait):
+            pool.flood(member, float(e.value or 1))
+        else:
+            member.failures += 1
+            logger.warning(f"[pool] Upload via {member.name} failed, using the primary bot: {e}")
+        if not isinstance(file_loc, str):
+            file_loc.seek(0)
+        return None
+    pool.record(member, _size(file_loc), time.monotonic() - started)
+    return posted
+
+
+async def _send_direct(
+    client: Client,
+    member: Any,
+    kind: str,
+    chat_id: int,
+    file_loc: Union[str, BinaryIO],
+    meta: Dict[str, Any],
+    progress_args: tuple,
+    reply_to_message_id: Optional[int]
+) -> None:
+    """
+    Upload from the primary bot, on the pool member leased for it.
+    """
+    kwargs: Dict[str, Any] = dict(
+        chat_id=chat_id,
+        caption=f"Uploaded by {BOT_USERNAME}",
+        reply_to_message_id=reply_to_message_id,
+        progress=progress_func,
+        progress_args=progress_args
+    )
+    send, media_kwargs = _media_kwargs(client, kind, file_loc, meta)
+    send = _bounded(send, kind, file_loc)
+    kwargs.update(media_kwargs)
+    started = time.monotonic()
+    async with transfers.slot():
+        await api_call(chat_id, REPLY, send, **kwargs)
+    pool.record(member, _size(file_loc), time.monotonic() - started)
+
+
+async def send_stream(
+    client: Client,
+    kind: str,
+    chat_id: int,
+    file_loc: Union[str, BinaryIO],
+    meta: Dict[str, Any],
+    progress_args: tuple,
+    reply_to_message_id: Optional[int] = None,
+    log_as: Optional[Tuple[str, int]] = None
+) -> bool:
+    """
+    Send an extracted audio or subtitle file to the user. With `log_as`
+    (username, user_id) a helper bot may do the upload through the log
+    channel; returns True when that already logged the file.
+
+    The upload holds a pool lease whichever client does it, so the primary's
+    own uploads count towards its load and its /status figures.
+    """
+    if log_as and LOG_CHANNEL and pool.helpers:
+        async with pool.lease() as member:
+            if member.primary:
+                await _send_direct(client, member, kind, chat_id, file_loc, meta, progress_args, reply_to_message_id)
+                return False
+            posted = await _post_via_helper(member, kind, file_loc, meta, progress_args, log_as)
+        if posted:
+            await api_call(chat_id, REPLY, client.copy_message,
+                chat_id=chat_id,
+                from_chat_id=int(LOG_CHANNEL),
+                message_id=posted.id,
+                caption=f"Uploaded by {BOT_USERNAME}",
+                reply_to_message_id=reply_to_message_id
             )
-            await clean_up(file_loc)
-            _cleanup_upload(unique_id)
-            return
+            return True
+    async with pool.lease(helpers_ok=False) as member:
+        await _send_direct(client, member, kind, chat_id, file_loc, meta, progress_args, reply_to_message_id)
+    return False
 
-    # Cleanup resources
-    await status_msg.delete()
-    await clean_up(file_loc)
-    _cleanup_upload(unique_id)
 
+async def log_stream(
+    client: Client,
+    kind: str,
+    file_loc: Union[str, BinaryIO],
+    username: str,
+    user_id: int,
+    meta: Dict[str, Any],
+    progress_args: tuple
+) -> None:
+    """
+    Send an extracted file to the log channel, crediting the user. No-op without LOG_CHANNEL.
+    """
+    if not LOG_CHANNEL:
+        return
+    kwargs: Dict[str, Any] = dict(
+        chat_id=int(LOG_CHANNEL),
+        caption=_log_caption(username, user_id),
+        parse_mode=ParseMode.HTML,
+        progress=progress_func,
+        progress_args=progress_args
+    )
+    send, media_kwargs = _media_kwargs(client, kind, file_loc, meta)
+    send = _bounded(send, kind, file_loc)
+    kwargs.update(media_kwargs)
+    async with transfers.slot():
+        await api_call(int(LOG_CHANNEL), LOG, send, **kwargs)
 
-async def upload_subtitle(
+
+def _delivery_stages(
     client: Client,
-    message: Message,
-    file_loc: str,
+    kind: str,
+    chat_id: int,
+    file_loc: Union[str, BinaryIO],
     username: str,
     user_id: int,
-    file_name: str
+    meta: Optional[Dict[str, Any]],
+    progress_args: tuple,
+    reply_to_message_id: Optional[int] = None
+) -> List[pipeline.Stage]:
+    """
+    "meta", "send" (to the user) and "log" stages of an upload. Only the
+    user's copy is critical; the log-channel copy goes after it.
+    """
+    async def resolve(results: pipeline.Results) -> Dict[str, Any]:
+        # Metadata comes from the probe result; only parse the file if it is missing
+        if kind == "audio":
+            return await _resolve_metadata(Path(file_loc), meta)
+        return meta or {}
+
+    async def send(results: pipeline.Results) -> bool:
+        return await send_stream(client, kind, chat_id, file_loc, results["meta"], progress_args,
+                                 reply_to_message_id, log_as=(username, user_id))
+
+    async def log(results: pipeline.Results) -> None:
+        # A helper bot's upload already went through the log channel
+        if not results["send"]:
+            await log_stream(client, kind, file_loc, username, user_id, results["meta"], progress_args)
+
+    return [
+        pipeline.Stage("meta", resolve),
+        pipeline.Stage("send", send, after=("meta",)),
+        pipeline.Stage("log", log, after=("send",), critical=False),
+    ]
+
+
+async def deliver_stream(
+    client: Client,
+    kind: str,
+    chat_id: int,
+    file_loc: Union[str, BinaryIO],
+    username: str,
+    user_id: int,
+    meta: Optional[Dict[str, Any]],
+    progress_args: tuple,
+    reply_to_message_id: Optional[int] = None
 ) -> None:
     """
-    Upload a subtitle file to the user and log channel with progress.
+    Send an extracted file to the user, then to the log channel. Raises if the
+    user send fails; a failed log send is only logged.
+    """
+    await pipeline.run(
+        _delivery_stages(client, kind, chat_id, file_loc, username, user_id, meta,
+                         progress_args, reply_to_message_id),
+        f"{kind} {_name(file_loc)}"
+    )
+
+
+async def _upload(
+    client: Client,
+    kind: str,
+    message: Message,
+    file_loc: Union[str, BinaryIO],
+    username: str,
+    user_id: int,
+    file_name: str,
+    meta: Optional[Dict[str, Any]],
+    status_text: str,
+    error_text: str
+) -> bool:
+    """
+    Upload an extracted stream to the user and log channel, reporting on the
+    job's status message. The status edit and metadata lookup run alongside
+    each other; only a failed send to the user is reported as an error.
+
+    Returns whether the user received the stream.
     """
     unique_id = f"{message.chat.id}_{message.id}_upload"
     start_time = time.monotonic()
     upload_progress[unique_id] = {"file_name": file_name, "start_time": start_time, "user_id": user_id}
+    progress_args = ("upload", message, start_time, message)
 
-    status_msg = await message.edit_text(
-        text="**Uploading extracted subtitle...**",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton(text="Progress", callback_data="progress_msg_upload")]
-        ]),
-        parse_mode=ParseMode.MARKDOWN
-    )
+    async def status(results: pipeline.Results) -> None:
+        await edit_message(client, message,
+            text=status_text,
+            reply_markup=UPLOAD_PROGRESS_KEYBOARD,
+            parse_mode=ParseMode.MARKDOWN
+        )
 
+    stages = [pipeline.Stage("status", status, critical=False)]
+    stages += _delivery_stages(client, kind, message.chat.id, file_loc, username, user_id, meta, progress_args)
     try:
-        await asyncio.sleep(1)
-        logger.info(f"Starting subtitle upload for {file_name}")
-
-        await client.send_document(
-            chat_id=message.chat.id,
-            document=file_loc,
-            caption=f"Uploaded by {BOT_USERNAME}",
-            progress=progress_func,
-            progress_args=("upload", status_msg, start_time, message)
-        )
+        logger.info(f"Starting {kind} upload for {file_name}")
+        await pipeline.run(stages, f"{kind} upload of {file_name}")
     except Exception as e:
-        logger.error(f"upload_subtitle error for {file_name}: {e}")
-        await status_msg.edit_text(
-            text=f"**Error uploading subtitle {file_name}.** Check logs."
-        )
-        await clean_up(file_loc)
+        logger.error(f"{kind} upload error for {file_name}: {e}")
+        await edit_message(client, message, text=error_text, priority=REPLY, final=True)
+        return False
+    else:
+        forget(message.chat.id, message.id)
+        await api_call(message.chat.id, STATUS, message.delete)
+        return True
+    finally:
+        await _discard(file_loc)
         _cleanup_upload(unique_id)
-        return
 
-    # Forward to log channel if configured
-    if LOG_CHANNEL:
-        try:
-            await asyncio.sleep(1)
-            logger.info(f"Logging subtitle for {file_name}")
-            await client.send_document(
-                chat_id=int(LOG_CHANNEL),
-                document=file_loc,
-                caption=f"Extracted by: <a href='tg://user?id={user_id}'>{username}</a>",
-                parse_mode=ParseMode.HTML,
-                progress=progress_func,
-                progress_args=("upload", status_msg, start_time, message)
-            )
-        except Exception as e:
-            logger.error(f"Error logging subtitle {file_name}: {e}")
-            await status_msg.edit_text(
-                text=f"**Error sending subtitle to log channel.**"
-            )
-            await clean_up(file_loc)
-            _cleanup_upload(unique_id)
-            return
-
-    # Cleanup resources
-    await status_msg.delete()
-    await clean_up(file_loc)
-    _cleanup_upload(unique_id)
+
+async def upload_audio(
+    client: Client,
+    message: Message,
+    file_loc: Union[str, BinaryIO],
+    username: str,
+    user_id: int,
+    file_name: str,
+    meta: Optional[Dict[str, Any]] = None
+) -> bool:
+    """
+    Upload an audio stream to the user and log channel with progress.
+    Returns whether the user received it.
+    """
+    return await _upload(client, "audio", message, file_loc, username, user_id, file_name, meta,
+                  "**Uploading extracted stream...**", f"**Error uploading {file_name}.** Check logs.")
+
+
+async def upload_subtitle(
+    client: Client,
+    message: Message,
+    file_loc: Union[str, BinaryIO],
+    username: str,
+    user_id: int,
+    file_name: str,
+    meta: Optional[Dict[str, Any]] = None
+) -> bool:
+    """
+    Upload a subtitle file to the user and log channel with progress.
+    Returns whether the user received it.
+    """
+    return await _upload(client, "subtitle", message, file_loc, username, user_id, file_name, {},
+                  "**Uploading extracted subtitle...**", f"**Error uploading subtitle {file_name}.** Check logs.")
+
+
+def _name(file_loc: Union[str, BinaryIO]) -> str:
+    return Path(file_loc).name if isinstance(file_loc, str) else file_loc.name
+
+
+async def _discard(file_loc: Union[str, BinaryIO]) -> None:
+    """
+    Delete an uploaded output file in the background. In-memory outputs are
+    released by their owner.
+    """
+    if isinstance(file_loc, str):
+        await fs.remove(file_loc, wait=False)
 
 
 def _cleanup_upload(unique_id: str) -> None:
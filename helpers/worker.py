@@ -0,0 +1,221 @@
+import asyncio
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from config import Config
+from helpers import fs, job_history, job_queue, journal, stage_timeouts
+from helpers.batch import run_batch
+from helpers.client_pool import pool
+from helpers.download import download_file
+from helpers.ffmpeg import EXTRACTORS, output_size
+from helpers.logger import logger
+from helpers.message_editor import edit_message
+from helpers.probe import probe_stats
+from helpers.transfer_control import transfers
+from helpers.progress import (
+    download_progress, upload_progress, callback_progress, remote_progress, queue_status
+)
+
+WORKER_ID = Config.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+HEARTBEAT_INTERVAL = 5.0
+STALE_AFTER = 60.0
+POLL_INTERVAL = 1.0
+
+
+async def _sjf_priority(files: List[Tuple[int, Optional[str]]], stages: Tuple[str, ...]) -> float:
+    """
+    Queue priority for shortest-job-first: the enqueue time plus the job's
+    predicted run time. Short jobs overtake long ones, but only those that
+    arrived less than their own predicted run time earlier, so nothing starves.
+    """
+    expected = 0.0
+    for size, name in files:
+        expected += sum((await job_history.predict(size, name, stages)).values())
+    return time.time() + expected
+
+
+async def dispatch_download(client: Client, message: Message) -> None:
+    """
+    Start a download: in the background here, or via the shared queue in bot mode.
+    """
+    if Config.RUN_MODE == "bot":
+        doc = message.document or message.video
+        priority = await _sjf_priority(
+            [(getattr(doc, "file_size", 0) or 0, getattr(doc, "file_name", None))],
+            (job_history.DOWNLOAD, job_history.PROBE)
+        )
+        job_id = await job_queue.enqueue(
+            "download", {"chat_id": message.chat.id, "message_id": message.id}, priority
+        )
+        logger.info(f"Queued download job {job_id} for message {message.chat.id}/{message.id}")
+        return
+    asyncio.create_task(download_file(client, message))
+
+
+async def dispatch_extraction(
+    client: Client,
+    message: Message,
+    stream_type: str,
+    entry: Dict[str, Any]
+) -> None:
+    """
+    Extract and upload a stream here, or hand it to a worker in bot mode.
+    """
+    if Config.RUN_MODE == "bot":
+        source = entry.get("file") or entry.get("location")
+        priority = await _sjf_priority(
+            [(output_size(Path(source)) if source else 0, entry.get("file_name"))],
+            (job_history.EXTRACT, job_history.UPLOAD)
+        )
+        job_id = await job_queue.enqueue("extract", {
+            "chat_id": message.chat.id,
+            "message_id": message.id,
+            "stream_type": stream_type,
+            "entry": entry,
+        }, priority)
+        logger.info(f"Queued extract job {job_id} ({stream_type} {entry.get('map')})")
+        await edit_message(client, message, "⏳ Queued for extraction…")
+        return
+    await EXTRACTORS[stream_type](client, message, entry)
+
+
+async def dispatch_batch(
+    client: Client,
+    status_msg: Message,
+    token: str,
+    message_ids: List[int],
+    policy: str,
+    files: Optional[List[Tuple[int, Optional[str]]]] = None
+) -> None:
+    """
+    Run a batch in the background here, or hand it to a worker in bot mode.
+    `files` ((size, name) per file) feeds the queue's run-time prediction.
+    """
+    if Config.RUN_MODE == "bot":
+        priority = await _sjf_priority(files or [], job_history.STAGES)
+        job_id = await job_queue.enqueue("batch", {
+            "chat_id": status_msg.chat.id,
+            "message_id": status_msg.id,
+            "message_ids": message_ids,
+            "token": token,
+            "policy": policy,
+        }, priority)
+        logger.info(f"Queued batch job {job_id} ({len(message_ids)} files)")
+        await edit_message(client, status_msg, "⏳ Batch queued…")
+        return
+    messages = await client.get_messages(status_msg.chat.id, message_ids)
+    asyncio.create_task(run_batch(client, token, status_msg, messages, policy))
+
+
+async def resolve_selection(key: str) -> Dict[str, Any]:
+    """
+    Entries behind a stream-selection keyboard, from this process or the journal.
+    """
+    bucket = download_progress.get(key)
+    if bucket is None:
+        found = await journal.find_selection(key)
+        bucket = found["entries"] if found else None
+    return bucket or {}
+
+
+async def _run_job(client: Client, job: Dict[str, Any]) -> None:
+    payload = job["payload"]
+    message = await client.get_messages(payload["chat_id"], payload["message_id"])
+    if not message or message.empty:
+        raise RuntimeError("Job message no longer exists")
+
+    if job["kind"] == "download":
+        await download_file(client, message)
+    elif job["kind"] == "batch":
+        # `message` is the batch status message
+        files = await client.get_messages(payload["chat_id"], payload["message_ids"])
+        await run_batch(client, payload["token"], message, files, payload["policy"])
+    elif job["kind"] == "extract":
+        await EXTRACTORS[payload["stream_type"]](client, message, payload["entry"])
+    else:
+        raise ValueError(f"Unknown job kind {job['kind']!r}")
+
+
+async def _job_loop(client: Client, stop_event: asyncio.Event) -> None:
+    while not stop_event.is_set():
+        job = await job_queue.claim(WORKER_ID)
+        if not job:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        logger.info(f"Worker {WORKER_ID} claimed {job['kind']} job {job['id']}")
+        error = None
+        try:
+            await _run_job(client, job)
+        except Exception as e:
+            logger.exception(f"Job {job['id']} failed")
+            error = str(e) or type(e).__name__
+        await job_queue.finish(job["id"], error)
+
+
+def _snapshot() -> Dict[str, Any]:
+    return {
+        "download": dict(download_progress),
+        "upload": dict(upload_progress),
+        "callback": dict(callback_progress),
+        "transfer": transfers.snapshot(),
+        "probe": probe_stats(),
+        "pool": pool.snapshot(),
+        "timeouts": stage_timeouts.snapshot(),
+        "fs": fs.snapshot(),
+    }
+
+
+async def _wait(stop_event: asyncio.Event, timeout: float) -> None:
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _heartbeat_loop(stop_event: asyncio.Event) -> None:
+    while not stop_event.is_set():
+        try:
+            await job_queue.heartbeat(WORKER_ID, _snapshot())
+            requeued, failed = await job_queue.requeue_stale(STALE_AFTER)
+            if requeued:
+                logger.warning(f"Requeued {requeued} job(s) from unresponsive workers")
+            if failed:
+                logger.error(f"Failed {failed} job(s) after {job_queue.MAX_ATTEMPTS} unresponsive workers")
+        except Exception:
+            logger.exception("Worker heartbeat failed")
+        await _wait(stop_event, HEARTBEAT_INTERVAL)
+
+
+async def run_worker(client: Client, stop_event: asyncio.Event) -> None:
+    """
+    Claim and run jobs from the shared queue until `stop_event` is set.
+    """
+    logger.info(f"Worker {WORKER_ID} started with {Config.WORKER_CONCURRENCY} slot(s)")
+    await asyncio.gather(
+        _heartbeat_loop(stop_event),
+        *(_job_loop(client, stop_event) for _ in range(Config.WORKER_CONCURRENCY)),
+    )
+
+
+async def sync_remote_progress(stop_event: asyncio.Event) -> None:
+    """
+    Bot side: mirror worker progress snapshots and queue depth for /status.
+    """
+    while not stop_event.is_set():
+        try:
+            snapshots = await job_queue.worker_snapshots(STALE_AFTER)
+            counts = await job_queue.queue_counts()
+            remote_progress.clear()
+            remote_progress.update(snapshots)
+            queue_status.clear()
+            queue_status.update(counts)
+        except Exception:
+            logger.exception("Failed to sync worker progress")
+        await _wait(stop_event, HEARTBEAT_INTERVAL)
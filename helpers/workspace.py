@@ -0,0 +1,94 @@
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Union
+
+from helpers import fs, sources
+from helpers.logger import logger
+from helpers.tools import clean_up
+
+# Job-private files (extracted outputs, partial clip sources) live in one
+# directory per job, so concurrent jobs - and concurrent extractions within a
+# job - never share a path. Complete downloads stay in the shared per-file
+# directories of helpers.sources, where identical files are deduplicated.
+WORKSPACE_DIR = sources.DOWNLOAD_DIR / "jobs"
+
+
+def path(job: str, *parts: Union[str, int]) -> Path:
+    """
+    A job's workspace, or a part of it such as one extraction's output
+    directory ("s<stream index>"). Not created.
+    """
+    return WORKSPACE_DIR.joinpath(job, *map(str, parts))
+
+
+def create(job: str, *parts: Union[str, int]) -> Path:
+    directory = path(job, *parts)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+async def remove(job: str, *parts: Union[str, int]) -> None:
+    """
+    Delete a workspace (or one part of it), then the job directory once empty.
+    """
+    directory = path(job, *parts)
+    await clean_up(directory)
+    sources.prune(directory.parent)
+
+
+def _size(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                # Allocated rather than apparent size: clip sources are sparse
+                total += os.stat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def usage() -> List[Dict[str, Any]]:
+    """
+    Every workspace on disk with its size in bytes and age in seconds (blocking).
+    """
+    now = time.time()
+    found = []
+    try:
+        entries = list(os.scandir(WORKSPACE_DIR))
+    except FileNotFoundError:
+        return []
+    for entry in entries:
+        if not entry.is_dir():
+            continue
+        try:
+            age = now - entry.stat().st_mtime
+        except OSError:
+            continue
+        found.append({"job": entry.name, "bytes": _size(entry.path), "age": age})
+    return found
+
+
+async def sweep(keep: Iterable[str]) -> int:
+    """
+    Delete the workspaces of jobs not in `keep`, left behind by a crash.
+    Returns how many were removed.
+    """
+    keep = set(keep)
+    removed = 0
+    for item in await fs.run("workspace usage", usage):
+        if item["job"] not in keep:
+            await remove(item["job"])
+            removed += 1
+    if removed:
+        logger.info(f"[workspace] Removed {removed} orphaned job workspace(s)")
+    return removed
+
+
+def format_usage(items: List[Dict[str, Any]]) -> str:
+    """
+    /status line for workspace accounting.
+    """
+    total = sum(i["bytes"] for i in items) / (1024 ** 3)
+    return f"• Job workspaces: `{len(items)}` using `{total:.2f} GB`"
@@ -0,0 +1,415 @@
+"""
+Offline load test for admission and callback handling.
+
+Replays simulated users through the real handlers -- confirm_download, the
+callback router and download_file -- against a fake Pyrogram client with
+configurable API latency, injected FloodWaits and simulated transfer speed.
+Nothing talks to Telegram and ffprobe is not needed.
+
+    python loadtest.py --users 300 --ramp 20 --flood-rate 0.02
+
+Reports admission/callback latency percentiles, event-loop lag, memory growth,
+rejection rates and registry sizes left behind. With --max-* thresholds the
+exit status is 1 when one is exceeded, so scaling changes can be gated on it.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO = Path(__file__).resolve().parent
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200, help="simulated users")
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which users arrive")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean API call latency (s)")
+    parser.add_argument("--flood-rate", type=float, default=0.01, help="share of API calls raising FloodWait")
+    parser.add_argument("--flood-wait", type=int, default=2, help="FloodWait seconds")
+    parser.add_argument("--speed", type=float, default=20.0, help="simulated transfer speed per file (MB/s)")
+    parser.add_argument("--size", type=float, default=50.0, help="simulated file size (MB)")
+    parser.add_argument("--progress-checks", type=int, default=2, help="'Check Progress' presses per download")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-user timeout (s)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dump-tasks", action="store_true", help="print where leftover tasks are waiting")
+    parser.add_argument("--max-admission-p95", type=float, help="fail if admission p95 exceeds this (s)")
+    parser.add_argument("--max-callback-p95", type=float, help="fail if callback p95 exceeds this (s)")
+    parser.add_argument("--max-loop-lag", type=float, help="fail if event-loop lag p99 exceeds this (s)")
+    parser.add_argument("--max-rejection-rate", type=float, help="fail if more than this share is rejected")
+    return parser.parse_args()
+
+
+def _prepare_environment(workdir: Path) -> None:
+    """
+    Point the bot at throwaway state before its modules read the environment.
+    """
+    for name, value in {
+        "APP_ID": "1", "API_HASH": "loadtest", "BOT_TOKEN": "1:loadtest",
+        "BOT_USERNAME": "loadtest_bot", "OWNER_ID": "1", "LOG_CHANNEL": "-1001",
+    }.items():
+        os.environ.setdefault(name, value)
+    os.environ["RUN_MODE"] = "standalone"
+    os.environ["STATE_DB"] = str(workdir / "state.db")
+    os.environ["THRESHOLD"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, str(REPO))
+    os.chdir(workdir)
+
+
+def _percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    ordered = sorted(values)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return (
+        f"p50 {pct(0.50) * 1000:8.1f} ms  p95 {pct(0.95) * 1000:8.1f} ms  "
+        f"p99 {pct(0.99) * 1000:8.1f} ms  max {ordered[-1] * 1000:8.1f} ms  (n={len(ordered)})"
+    )
+
+
+def _p(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+class FakeMessage(SimpleNamespace):
+    """
+    The parts of pyrogram.types.Message the handlers touch.
+    """
+
+    async def reply_text(self, text: str = "", **kwargs: Any) -> "FakeMessage":
+        return await self._client.send_message(
+            chat_id=self.chat.id, text=text, reply_to=self, **kwargs
+        )
+
+    async def edit_text(self, text: str, **kwargs: Any) -> "FakeMessage":
+        await self._client.edit_message_text(chat_id=self.chat.id, message_id=self.id, text=text, **kwargs)
+        return self
+
+    async def delete(self) -> None:
+        await self._client.call("delete_messages")
+
+
+class FakeClient:
+    """
+    Stand-in for pyrogram.Client: every call sleeps for a random latency, may
+    raise FloodWait, and is recorded so simulated users can wait for replies.
+    """
+
+    def __init__(self, args: argparse.Namespace, flood_wait_cls: Any) -> None:
+        self.args = args
+        self.flood_wait_cls = flood_wait_cls
+        self.rng = random.Random(args.seed)
+        self.ids = itertools.count(1_000_000)
+        self.calls = 0
+        self.floods = 0
+        self.inbox: Dict[int, asyncio.Queue] = {}
+
+    def _queue(self, chat_id: int) -> asyncio.Queue:
+        return self.inbox.setdefault(chat_id, asyncio.Queue())
+
+    async def call(self, name: str) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.rng.expovariate(1 / self.args.latency) if self.args.latency > 0 else 0)
+        if self.rng.random() < self.args.flood_rate:
+            self.floods += 1
+            raise self.flood_wait_cls(value=self.args.flood_wait)
+
+    def message(self, chat_id: int, **fields: Any) -> FakeMessage:
+        defaults = dict(empty=False, caption=None, document=None, video=None, reply_to_message=None)
+        return FakeMessage(
+            _client=self, id=next(self.ids), chat=SimpleNamespace(id=chat_id), **{**defaults, **fields}
+        )
+
+    def _deliver(self, chat_id: int, text: str, markup: Any, message: Optional[FakeMessage]) -> None:
+        if "What would you like me to do?" in text:
+            kind = "prompt"
+        elif text.startswith("⚠️"):
+            kind = "reject"
+        elif text.startswith("▶️ Downloading"):
+            kind = "status"
+        elif text.startswith("🔍 Select stream"):
+            kind = "streams"
+        elif text.startswith("❌"):
+            kind = "error"
+        else:
+            return
+        self._queue(chat_id).put_nowait((kind, message, markup))
+
+    async def send_message(
+        self, chat_id: int, text: str, reply_to: Optional[FakeMessage] = None,
+        reply_markup: Any = None, **_: Any
+    ) -> FakeMessage:
+        await self.call("send_message")
+        msg = self.message(chat_id, text=text, reply_to_message=reply_to)
+        self._deliver(chat_id, text, reply_markup, msg)
+        return msg
+
+    async def edit_message_text(
+        self, chat_id: int, message_id: int, text: str, reply_markup: Any = None, **_: Any
+    ) -> None:
+        await self.call("edit_message_text")
+        self._deliver(chat_id, text, reply_markup, self.message(chat_id, text=text))
+
+    async def copy_message(self, **_: Any) -> None:
+        await self.call("copy_message")
+
+    async def download_media(
+        self, media: FakeMessage, file_name: str, progress: Any = None, progress_args: tuple = ()
+    ) -> str:
+        doc = media.document or media.video
+        path = Path(file_name) / doc.file_name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        speed = self.args.speed * 1024 * 1024
+        step = max(speed * 0.25, 1)
+        current = 0
+        while current < doc.file_size:
+            await asyncio.sleep(min(step, doc.file_size - current) / speed)
+            current = min(doc.file_size, current + step)
+            if progress:
+                await progress(current, doc.file_size, *progress_args)
+        # Sparse: only the size is checked
+        with open(path, "wb") as f:
+            f.truncate(doc.file_size)
+        return str(path)
+
+    def __getattr__(self, name: str) -> Any:
+        async def method(*_: Any, **__: Any) -> None:
+            await self.call(name)
+        return method
+
+
+async def _fake_probe(path: Path) -> Dict[str, Any]:
+    await asyncio.sleep(0.05)
+    return {
+        "format": {"format_name": "matroska,webm", "duration": "5400.0"},
+        "streams": [
+            {"index": 1, "codec_type": "audio", "codec_name": "aac", "tags": {"language": "eng"}},
+            {"index": 2, "codec_type": "subtitle", "codec_name": "subrip", "tags": {"language": "eng"}},
+        ],
+    }
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.prompt: List[float] = []
+        self.admission: List[float] = []
+        self.callback: List[float] = []
+        self.loop_lag: List[float] = []
+        self.outcomes: Dict[str, int] = {}
+
+    def outcome(self, kind: str) -> None:
+        self.outcomes[kind] = self.outcomes.get(kind, 0) + 1
+
+
+async def _loop_monitor(stats: Stats, stop: asyncio.Event, interval: float = 0.05) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        before = loop.time()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(0.0, loop.time() - before - interval))
+
+
+async def _wait_for(client: FakeClient, chat_id: int, kinds: Tuple[str, ...], timeout: float) -> Tuple[str, Any, Any]:
+    queue = client._queue(chat_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        kind, msg, markup = await asyncio.wait_for(queue.get(), max(0.0, deadline - time.monotonic()))
+        if kind in kinds or kind in ("reject", "error"):
+            return kind, msg, markup
+
+
+def _query(client: FakeClient, user: Any, message: FakeMessage, data: str) -> Any:
+    async def answer(*_: Any, **__: Any) -> None:
+        await client.call("answer_callback_query")
+    return SimpleNamespace(data=data, from_user=user, message=message, answer=answer)
+
+
+async def _simulate_user(
+    client: FakeClient, stats: Stats, handlers: SimpleNamespace, index: int, delay: float
+) -> None:
+    args = client.args
+    await asyncio.sleep(delay)
+    loop = asyncio.get_running_loop()
+    chat_id = 10_000 + index
+    user = SimpleNamespace(
+        id=chat_id, first_name=f"user{index}", username=None, mention=f"user{index}"
+    )
+    size = int(args.size * 1024 * 1024)
+    doc = SimpleNamespace(
+        file_name=f"movie-{index}.mkv", file_size=size, mime_type="video/x-matroska",
+        file_unique_id=f"uid{index}", file_id=f"fid{index}"
+    )
+    media = client.message(chat_id, from_user=user, document=doc)
+
+    try:
+        # 1. Send the file and wait for the prompt
+        start = loop.time()
+        await handlers.confirm_download(client, media)
+        kind, prompt, _ = await _wait_for(client, chat_id, ("prompt",), args.timeout)
+        stats.prompt.append(loop.time() - start)
+        if kind != "prompt":
+            return stats.outcome(kind)
+        prompt.reply_to_message = media
+
+        # 2. Press "Download" and wait for admission (status message or rejection)
+        start = loop.time()
+        await handlers.callback_handler(client, _query(client, user, prompt, "download_file"))
+        kind, status, _ = await _wait_for(client, chat_id, ("status",), args.timeout)
+        stats.admission.append(loop.time() - start)
+        if kind != "status":
+            return stats.outcome(kind)
+
+        # 3. Check progress while the transfer runs
+        transfer_time = args.size / args.speed if args.speed > 0 else 0
+        for _ in range(args.progress_checks):
+            await asyncio.sleep(transfer_time / (args.progress_checks + 1))
+            start = loop.time()
+            await handlers.callback_handler(client, _query(client, user, status, "progress_msg_download"))
+            stats.callback.append(loop.time() - start)
+
+        # 4. Wait for the stream keyboard, then cancel (drops the journal entry and source)
+        kind, _, markup = await _wait_for(client, chat_id, ("streams",), args.timeout)
+        if kind != "streams":
+            return stats.outcome(kind)
+        cancel = next(
+            b.callback_data for row in markup.inline_keyboard for b in row
+            if (b.callback_data or "").startswith("c:")
+        )
+        start = loop.time()
+        await handlers.callback_handler(client, _query(client, user, status, cancel))
+        stats.callback.append(loop.time() - start)
+        stats.outcome("completed")
+    except asyncio.TimeoutError:
+        stats.outcome("timeout")
+    except Exception as e:
+        stats.outcome(f"crash: {type(e).__name__}")
+
+
+def _dump_tasks() -> None:
+    """
+    Print the await chain of every task still pending, to show where users got stuck.
+    """
+    for task in asyncio.all_tasks():
+        if task is asyncio.current_task():
+            continue
+        coro, chain = task.get_coro(), []
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None)
+            if frame:
+                chain.append(f"{frame.f_code.co_name}:{frame.f_lineno}")
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None)
+        print("  " + " > ".join(chain))
+
+
+def _rss() -> int:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return 0
+
+
+async def _run(args: argparse.Namespace) -> int:
+    from pyrogram.errors import FloodWait
+
+    import helpers.download as download
+    from config import Config
+    from helpers import progress
+    from plugins.callback import callback_handler
+    from plugins.extractor import confirm_download
+
+    download.probe = _fake_probe
+    Config.AUTH_USERS.update(10_000 + i for i in range(args.users))
+    handlers = SimpleNamespace(confirm_download=confirm_download, callback_handler=callback_handler)
+    client = FakeClient(args, FloodWait)
+    stats = Stats()
+    rng = random.Random(args.seed)
+
+    tracemalloc.start()
+    rss_start = _rss()
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_loop_monitor(stats, stop))
+    began = time.monotonic()
+    users = [
+        _simulate_user(client, stats, handlers, i, rng.uniform(0, args.ramp))
+        for i in range(args.users)
+    ]
+    await asyncio.gather(*users)
+    elapsed = time.monotonic() - began
+    # Let detached tasks (cleanups, pending edits) settle before measuring leftovers
+    await asyncio.sleep(4)
+    stop.set()
+    await monitor
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_end = _rss()
+
+    rejected = stats.outcomes.get("reject", 0)
+    rejection_rate = rejected / args.users if args.users else 0.0
+    mb = 1024 * 1024
+    lines = [
+        f"Users: {args.users} over {args.ramp:.0f}s, finished in {elapsed:.1f}s",
+        "Outcomes: " + ", ".join(f"{k}={v}" for k, v in sorted(stats.outcomes.items())),
+        f"Rejection rate: {rejection_rate:.1%}",
+        f"API calls: {client.calls} ({client.calls / elapsed:.1f}/s), FloodWaits injected: {client.floods}",
+        "",
+        f"Prompt latency:    {_percentiles(stats.prompt)}",
+        f"Admission latency: {_percentiles(stats.admission)}",
+        f"Callback latency:  {_percentiles(stats.callback)}",
+        f"Event-loop lag:    {_percentiles(stats.loop_lag)}",
+        "",
+        f"RSS: {rss_start / mb:.1f} MB -> {rss_end / mb:.1f} MB ({(rss_end - rss_start) / mb:+.1f} MB)",
+        f"Python heap (tracemalloc): {current / mb:.1f} MB now, {peak / mb:.1f} MB peak",
+        "",
+        "Left behind:",
+        f"  download_progress={len(progress.download_progress)} "
+        f"callback_progress={len(progress.callback_progress)} "
+        f"upload_progress={len(progress.upload_progress)}",
+        f"  _active_downloads={len(download._active_downloads)}",
+        f"  asyncio tasks={len(asyncio.all_tasks()) - 1}",
+    ]
+    print("\n".join(lines))
+    if args.dump_tasks:
+        print("\nPending tasks:")
+        _dump_tasks()
+
+    failures = []
+    if args.max_admission_p95 is not None and _p(stats.admission, 0.95) > args.max_admission_p95:
+        failures.append("admission p95")
+    if args.max_callback_p95 is not None and _p(stats.callback, 0.95) > args.max_callback_p95:
+        failures.append("callback p95")
+    if args.max_loop_lag is not None and _p(stats.loop_lag, 0.99) > args.max_loop_lag:
+        failures.append("event-loop lag p99")
+    if args.max_rejection_rate is not None and rejection_rate > args.max_rejection_rate:
+        failures.append("rejection rate")
+    if failures:
+        print("\nFAILED: " + ", ".join(failures))
+        return 1
+    return 0
+
+
+def main() -> None:
+    args = _parse_args()
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        _prepare_environment(Path(workdir))
+        code = asyncio.run(_run(args))
+        from helpers.logger import shutdown_logging
+        shutdown_logging()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
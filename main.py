@@ -4,7 +4,11 @@ from pathlib import Path
 
 import pytz
 from pyrogram import Client
+from helpers.client_pool import pool
 from helpers.logger import logger
+from helpers.rate_limiter import api_call, REPLY, LOG
+from helpers.recovery import expire_jobs, expire_loop, resume_jobs
+from helpers.worker import WORKER_ID, run_worker, sync_remote_progress
 from config import Config
 
 # Constants
@@ -34,7 +38,7 @@ async def edit_restart_message(app: Client) -> None:
         message_id = int(RESTART_FILE.read_text().strip())
 
         # Edit message to bot owner
-        await app.edit_message_text(
+        await api_call(Config.OWNER_ID, REPLY, app.edit_message_text,
             chat_id=Config.OWNER_ID,
             message_id=message_id,
             text=restart_text
@@ -44,7 +48,7 @@ async def edit_restart_message(app: Client) -> None:
         for channel in {Config.LOG_CHANNEL, Config.LOG_MEDIA_CHANNEL}:
             if channel:
                 try:
-                    await app.send_message(
+                    await api_call(int(channel), LOG, app.send_message,
                         chat_id=int(channel),
                         text=restart_text
                     )
@@ -60,30 +64,52 @@ async def edit_restart_message(app: Client) -> None:
 async def main() -> None:
     """
     Initialize and run the Pyrogram bot client.
+
+    In worker mode the client handles no updates; it only claims jobs from the
+    shared queue and runs the download/extract/upload pipeline.
     """
+    worker_mode = Config.RUN_MODE == "worker"
     app = Client(
-        "TroJanz",
+        f"TroJanz-worker-{WORKER_ID}" if worker_mode else "TroJanz",
         bot_token=Config.BOT_TOKEN,
         api_id=Config.APP_ID,
         api_hash=Config.API_HASH,
-        plugins=dict(root="plugins"),
-        workers=300,
-        max_concurrent_transmissions=100,
+        plugins=None if worker_mode else dict(root="plugins"),
+        no_updates=worker_mode,
+        workers=Config.WORKERS,
+        max_concurrent_transmissions=Config.MAX_CONCURRENT_TRANSMISSIONS,
     )
+    stop_event = asyncio.Event()
 
     try:
         await app.start()
         me = await app.get_me()
-        logger.info(f"{me.username} has started.")
+        logger.info(f"{me.username} has started in {Config.RUN_MODE} mode.")
+        # In bot mode the workers do the transfers, and start their own helpers
+        if Config.RUN_MODE != "bot":
+            await pool.start(app, Config.HELPER_BOT_TOKENS)
+
+        if worker_mode:
+            await run_worker(app, stop_event)
+            return
+
+        if Config.RUN_MODE == "bot":
+            asyncio.create_task(sync_remote_progress(stop_event))
+            await expire_jobs(app)
+        else:
+            # Workers recover through the shared queue instead
+            await resume_jobs(app)
+        asyncio.create_task(expire_loop(app, stop_event))
         await edit_restart_message(app)
 
         # Keep the bot running until manually stopped
-        await asyncio.Event().wait()
+        await stop_event.wait()
 
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
 
     finally:
+        await pool.stop()
         await app.stop()
 
 if __name__ == "__main__":
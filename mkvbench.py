@@ -0,0 +1,243 @@
+"""
+Benchmark of in-process MKV subtitle extraction against ffmpeg.
+
+Writes a synthetic Matroska file (one video track, audio tracks and SRT, ASS
+and WebVTT subtitle tracks, with random payloads padding it to --size MB),
+then times helpers.mkv.extract_subtitle and an `ffmpeg -map 0:<n> -c copy`
+per subtitle track. Without ffmpeg on PATH only the in-process side runs.
+
+    python mkvbench.py --size 1024 --duration 7200 --subtitle-cues
+
+With --subtitle-cues the Cues index every subtitle block and the file names
+mkvmerge as its writing app (as mkvmerge writes them), so the reader jumps
+straight to the blocks; without, only video keyframes are indexed (as
+ffmpeg writes them) and clusters are walked.
+Outputs of both sides are compared; timings are with a warm page cache.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Tuple
+
+REPO = Path(__file__).resolve().parent
+sys.path.insert(0, str(REPO))
+
+from helpers import mkv  # noqa: E402
+
+FPS = 24
+AUDIO_FRAME = 0.032
+CLUSTER_SECONDS = 2
+SUBTITLE_EVERY = 3.0
+SUBTITLE_LENGTH = 2.0
+_ASS_HEADER = (
+    "[Script Info]\nScriptType: v4.00+\nPlayResX: 1920\nPlayResY: 1080\n\n"
+    "[V4+ Styles]\nFormat: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, "
+    "BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, "
+    "Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n"
+    "Style: Default,Arial,48,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,2,0,2,10,10,10,1\n\n"
+    "[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+)
+# (codec ID, language, codec private, output extension)
+SUBTITLES = [
+    ("S_TEXT/UTF8", "eng", b"", "srt"),
+    ("S_TEXT/ASS", "jpn", _ASS_HEADER.encode(), "ass"),
+    ("S_TEXT/WEBVTT", "fre", b"WEBVTT", "vtt"),
+]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=float, default=256.0, help="approximate file size (MB)")
+    parser.add_argument("--duration", type=float, default=1800.0, help="media duration (s)")
+    parser.add_argument("--audio", type=int, default=2, help="audio tracks")
+    parser.add_argument("--subtitle-cues", action="store_true", help="index every subtitle block in the Cues")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per track and side")
+    parser.add_argument("--keep", type=Path, help="write the file here and keep it")
+    return parser.parse_args()
+
+
+# ---- synthetic Matroska writer ----
+
+def _size(n: int, length: int = 0) -> bytes:
+    length = length or next(i for i in range(1, 9) if n < (1 << 7 * i) - 1)
+    return ((1 << 7 * length) | n).to_bytes(length, "big")
+
+
+def _el(eid: int, payload: bytes) -> bytes:
+    return eid.to_bytes((eid.bit_length() + 7) // 8, "big") + _size(len(payload)) + payload
+
+
+def _uint(eid: int, value: int, length: int = 0) -> bytes:
+    return _el(eid, value.to_bytes(length or max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def _track(number: int, kind: int, codec: str, language: str, extra: bytes = b"") -> bytes:
+    return _el(mkv.TRACK_ENTRY, (
+        _uint(mkv.TRACK_NUMBER, number) + _uint(0x73C5, number) + _uint(mkv.TRACK_TYPE, kind)
+        + _el(mkv.CODEC_ID, codec.encode()) + _el(mkv.LANGUAGE, language.encode()) + extra
+    ))
+
+
+def _subtitle_text(codec: str, n: int) -> bytes:
+    if codec == "S_TEXT/ASS":
+        return f"{n},0,Default,,0,0,0,,Line {n}\\Nsecond row".encode()
+    return f"Line {n}\nsecond row".encode()
+
+
+def write_mkv(out: BinaryIO, size_mb: float, duration: float, audio: int, subtitle_cues: bool) -> Dict[int, int]:
+    """
+    Write the synthetic file; returns the subtitle block count per track number.
+    """
+    video_frames = int(duration * FPS)
+    audio_frames = int(duration / AUDIO_FRAME)
+    audio_bytes = 384
+    video_bytes = max(64, int((size_mb * 1024 * 1024 - audio * audio_frames * audio_bytes) / max(video_frames, 1)))
+    rng = os.urandom(max(video_bytes, audio_bytes))
+
+    out.write(_el(mkv.EBML, _uint(0x4286, 1) + _uint(0x42F7, 1) + _uint(0x42F2, 4) + _uint(0x42F3, 8)
+                  + _el(mkv.DOC_TYPE, b"matroska") + _uint(0x4287, 4) + _uint(0x4285, 2)))
+    out.write(mkv.SEGMENT.to_bytes(4, "big"))
+    size_at = out.tell()
+    out.write(_size(0, 8))
+    segment = out.tell()
+
+    # SeekHead with a fixed-width Cues position, patched at the end
+    def seek(target: int, position: int) -> bytes:
+        return _el(mkv.SEEK, _el(mkv.SEEK_ID, target.to_bytes(4, "big")) + _uint(mkv.SEEK_POSITION, position, 8))
+
+    # Per-block subtitle cues are only trusted in files written by mkvmerge
+    writing_app = b"mkvmerge v80.0 ('mkvbench')" if subtitle_cues else b"mkvbench"
+    info = _el(mkv.INFO, _uint(mkv.TIMECODE_SCALE, 1_000_000) + _el(0x4D80, b"mkvbench")
+               + _el(mkv.WRITING_APP, writing_app) + _el(0x4489, struct.pack(">d", duration * 1000)))
+    numbers = [1] + [2 + i for i in range(audio)] + [2 + audio + i for i in range(len(SUBTITLES))]
+    tracks = _el(mkv.TRACKS, b"".join([
+        _track(1, 1, "V_MPEG4/ISO/AVC", "und", _uint(mkv.DEFAULT_DURATION, 1_000_000_000 // FPS)
+               + _el(0xE0, _uint(0xB0, 1920) + _uint(0xBA, 1080))),
+        *(_track(2 + i, 2, "A_PCM/INT/LIT", "eng",
+                 _el(0xE1, _el(0xB5, struct.pack(">d", 48000.0)) + _uint(0x9F, 2) + _uint(0x6264, 16)))
+          for i in range(audio)),
+        *(_track(2 + audio + i, 0x11, codec, lang, _el(mkv.CODEC_PRIVATE, private) if private else b"")
+          for i, (codec, lang, private, _) in enumerate(SUBTITLES)),
+    ]))
+    seek_head_len = len(_el(mkv.SEEK_HEAD, seek(mkv.INFO, 0) + seek(mkv.TRACKS, 0) + seek(mkv.CUES, 0)))
+    out.write(_el(mkv.SEEK_HEAD, seek(mkv.INFO, seek_head_len) + seek(mkv.TRACKS, seek_head_len + len(info))
+                  + seek(mkv.CUES, 0)))
+    cues_at = out.tell() - 8
+    out.write(info + tracks)
+
+    cue_points: List[Tuple[int, int, int, int, int]] = []  # time, track, cluster, relative, duration
+    counts = {n: 0 for n in numbers[1 + audio:]}
+    subtitle_n = 0
+    for cluster_start in range(0, int(duration * 1000), CLUSTER_SECONDS * 1000):
+        cluster_end = min(cluster_start + CLUSTER_SECONDS * 1000, int(duration * 1000))
+        events: List[Tuple[int, int, int, bytes]] = []  # time, order, track, element
+        for frame in range(-(-cluster_start * FPS // 1000), -(-cluster_end * FPS // 1000)):
+            t = frame * 1000 // FPS
+            events.append((t, 0, 1, bytes([0x80 if frame % FPS == 0 else 0]) + rng[:video_bytes]))
+        for i in range(audio):
+            for frame in range(int(cluster_start / 1000 / AUDIO_FRAME), int(cluster_end / 1000 / AUDIO_FRAME)):
+                events.append((int(frame * AUDIO_FRAME * 1000), 1, 2 + i, b"\x80" + rng[:audio_bytes]))
+        while subtitle_n * SUBTITLE_EVERY * 1000 < cluster_end:
+            t = int(subtitle_n * SUBTITLE_EVERY * 1000)
+            if t >= cluster_start:
+                for i, (codec, *_rest) in enumerate(SUBTITLES):
+                    events.append((t, 2, 2 + audio + i, _subtitle_text(codec, subtitle_n)))
+            subtitle_n += 1
+        events.sort(key=lambda e: (e[0], e[1], e[2]))
+
+        body = bytearray(_uint(mkv.TIMECODE, cluster_start))
+        for t, _, number, payload in events:
+            head = _size(number) + struct.pack(">h", t - cluster_start)
+            if number > 1 + audio:
+                relative = len(body)
+                length = int(SUBTITLE_LENGTH * 1000)
+                body += _el(mkv.BLOCK_GROUP, _el(mkv.BLOCK, head + b"\x00" + payload) + _uint(mkv.BLOCK_DURATION, length))
+                counts[number] += 1
+                if subtitle_cues:
+                    cue_points.append((t, number, out.tell() - segment, relative, length))
+            else:
+                flags = payload[0]
+                body += _el(mkv.SIMPLE_BLOCK, head + bytes([flags]) + payload[1:])
+        cue_points.append((cluster_start, 1, out.tell() - segment, -1, 0))
+        out.write(_el(mkv.CLUSTER, bytes(body)))
+
+    cues_position = out.tell() - segment
+    cue_points.sort()
+    out.write(_el(mkv.CUES, b"".join(
+        _el(mkv.CUE_POINT, _uint(0xB3, t) + _el(mkv.CUE_TRACK_POSITIONS,
+            _uint(mkv.CUE_TRACK, number) + _uint(mkv.CUE_CLUSTER_POSITION, cluster)
+            + (_uint(mkv.CUE_RELATIVE_POSITION, relative) + _uint(mkv.CUE_DURATION, length) if relative >= 0 else b"")))
+        for t, number, cluster, relative, length in cue_points
+    )))
+    end = out.tell()
+    out.seek(cues_at)
+    out.write(cues_position.to_bytes(8, "big"))
+    out.seek(size_at)
+    out.write(_size(end - segment, 8))
+    out.seek(end)
+    return counts
+
+
+# ---- benchmark ----
+
+def _time(fn: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    runs, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - started)
+    return statistics.median(runs), result
+
+
+def _ffmpeg(source: Path, index: int, output: Path) -> bytes:
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", str(source), "-map", f"0:{index}", "-c", "copy", str(output)],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    return output.read_bytes()
+
+
+def _normalise(data: bytes) -> List[bytes]:
+    return [line.rstrip() for line in data.replace(b"\r\n", b"\n").strip().split(b"\n")]
+
+
+def main() -> None:
+    args = _parse_args()
+    with tempfile.TemporaryDirectory(prefix="mkvbench-") as workdir:
+        source = args.keep or Path(workdir) / "synthetic.mkv"
+        started = time.perf_counter()
+        with open(source, "wb") as out:
+            counts = write_mkv(out, args.size, args.duration, args.audio, args.subtitle_cues)
+        size = source.stat().st_size
+        print(f"Wrote {source} ({size / 1024 ** 2:.0f} MB, {args.duration:.0f}s, "
+              f"{args.audio} audio + {len(SUBTITLES)} subtitle tracks, "
+              f"{'per-block' if args.subtitle_cues else 'keyframe'} cues) in {time.perf_counter() - started:.1f}s")
+        ffmpeg = shutil.which("ffmpeg")
+        if not ffmpeg:
+            print("ffmpeg not found on PATH: timing the in-process reader only")
+
+        print(f"\n{'track':<16}{'blocks':>8}{'in-process':>14}{'ffmpeg':>12}{'speedup':>10}  output")
+        for i, (codec, lang, _, ext) in enumerate(SUBTITLES):
+            index = 1 + args.audio + i
+            name = mkv.CODECS[codec]
+            native_s, native = _time(lambda: mkv.extract_subtitle(source, index, name, lang), args.repeat)
+            line = f"{name + ' (' + lang + ')':<16}{counts[index + 1]:>8}{native_s * 1000:>11.1f} ms"
+            if ffmpeg:
+                output = Path(workdir) / f"ffmpeg.{ext}"
+                ffmpeg_s, reference = _time(lambda: _ffmpeg(source, index, output), args.repeat)
+                same = _normalise(native) == _normalise(reference)
+                line += f"{ffmpeg_s * 1000:>9.1f} ms{ffmpeg_s / native_s:>9.1f}x  {'matches' if same else 'DIFFERS'}"
+            else:
+                line += f"{'-':>12}{'-':>10}  {len(native)} bytes"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
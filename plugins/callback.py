@@ -1,122 +1,248 @@
-import asyncio
-from typing import Any, Dict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
 
-from pyrogram import Client, filters
-from pyrogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram import Client
+from pyrogram.types import CallbackQuery, InlineKeyboardMarkup
 from pyrogram.errors import QueryIdInvalid
-from config import Config
 from script import Script
-from helpers.tools import clean_up
-from helpers.download import download_file, _user_download_counts, _active_downloads
-from helpers.ffmpeg import extract_audio, extract_subtitle
+from helpers import batch, journal, lifecycle, quota, sources
+from helpers.ffmpeg import subtitle_bundle
+from helpers.keyboards import START_KEYBOARD, HELP_KEYBOARD, ABOUT_KEYBOARD, SUBTITLE_BUNDLE
 from helpers.logger import logger
-from helpers.progress import download_progress, upload_progress, callback_progress
-from update import UPSTREAM_REPO
+from helpers.message_editor import edit_message
+from helpers.rate_limiter import api_call, REPLY
+from helpers.progress import download_progress, upload_progress, callback_progress, remote_progress
+from helpers.worker import dispatch_batch, dispatch_download, dispatch_extraction, resolve_selection
+
+Handler = Callable[[Client, CallbackQuery, str], Awaitable[None]]
+
+
+class _Route(NamedTuple):
+    handler: Handler
+    # Answer the query before running the handler; handlers that show an
+    # alert answer it themselves.
+    auto_answer: bool
+
+
+# Routing tables: exact callback data, "<prefix>:<arg>" data, and the legacy
+# "<prefix>_<arg>" format still carried by older (journaled) keyboards.
+_EXACT: Dict[str, _Route] = {}
+_PREFIX: Dict[str, _Route] = {}
+_LEGACY_PREFIX: Dict[str, _Route] = {}
+
+_PROGRESS_TEMPLATE = (
+    "Progress Details...\n\n"
+    "Completed: {current}\n"
+    "Total: {total}\n"
+    "Speed: {speed}\n"
+    "Progress: {progress:.2f}%\n"
+    "Elapsed: {elapsed}\n"
+    "ETA: {eta}"
+)
+
+
+def _route(
+    *exact: str,
+    prefix: Optional[str] = None,
+    legacy: tuple = (),
+    auto_answer: bool = True
+) -> Callable[[Handler], Handler]:
+    """
+    Register a handler for exact callback data and/or a callback data prefix.
+    """
+    def register(fn: Handler) -> Handler:
+        route = _Route(fn, auto_answer)
+        for name in exact:
+            _EXACT[name] = route
+        if prefix:
+            _PREFIX[prefix] = route
+        for name in legacy:
+            _LEGACY_PREFIX[name] = route
+        return fn
+    return register
+
+
+def _resolve(data: str) -> tuple[Optional[_Route], str]:
+    route = _EXACT.get(data)
+    if route:
+        return route, data
+    head, sep, arg = data.partition(":")
+    if sep and head in _PREFIX:
+        return _PREFIX[head], arg
+    head, sep, arg = data.partition("_")
+    if sep and head in _LEGACY_PREFIX:
+        return _LEGACY_PREFIX[head], arg
+    return None, data
 
 
 @Client.on_callback_query()
 async def callback_handler(client: Client, query: CallbackQuery) -> None:
     """
     Central handler for all callback queries (button presses).
-    Handles navigation (start/help/about), download initiation, progress alerts,
-    extraction commands, and cancellation.
+    Dispatches through the routing tables and answers every query promptly.
     """
     data = query.data or ""
+    route, arg = _resolve(data)
+    if not route:
+        logger.info(f"Unhandled callback data: {data}")
+        await _answer(query)
+        return
+
+    if route.auto_answer:
+        await _answer(query)
+    try:
+        await route.handler(client, query, arg)
+    except QueryIdInvalid:
+        logger.warning(f"CallbackQuery invalid while handling `{data}`")
+    except Exception as e:
+        logger.error(f"Error handling callback `{data}`: {e}")
+
+
+async def _answer(query: CallbackQuery, text: Optional[str] = None, show_alert: bool = False) -> None:
+    try:
+        await query.answer(text, show_alert=show_alert)
+    except QueryIdInvalid:
+        pass
+
+
+async def _quota_exhausted(query: CallbackQuery) -> bool:
+    """
+    Refuse extraction work with an alert while the user's upload or
+    processing quota is used up.
+    """
+    wait, resource = await quota.check(query.from_user.id, (quota.UPLOAD, quota.CPU))
+    if not wait:
+        return False
+    await _answer(query, quota.exhausted_message(resource, wait), show_alert=True)
+    return True
+
+
+# ------- NAVIGATION BUTTONS -------
+_NAVIGATION: Dict[str, tuple[Callable[[str], str], InlineKeyboardMarkup]] = {
+    "start_data": (Script.start_msg, START_KEYBOARD),
+    "help_data": (lambda _: Script.help_msg(), HELP_KEYBOARD),
+    "about_data": (lambda _: Script.about_msg(), ABOUT_KEYBOARD),
+}
+
+
+@_route(*_NAVIGATION)
+async def _navigate(client: Client, query: CallbackQuery, data: str) -> None:
+    template_fn, keyboard = _NAVIGATION[data]
+    await api_call(query.message.chat.id, REPLY, query.message.edit_text,
+        text=template_fn(query.from_user.mention),
+        disable_web_page_preview=True,
+        reply_markup=keyboard
+    )
+
+
+# ------- DOWNLOAD BUTTON -------
+@_route("download_file", auto_answer=False)
+async def _start_download(client: Client, query: CallbackQuery, data: str) -> None:
+    if lifecycle.is_draining():
+        return await _answer(query, lifecycle.DRAIN_MESSAGE, show_alert=True)
+    await _answer(query)
+    # Delete prompt and start download in background
+    await api_call(query.message.chat.id, REPLY, query.message.delete)
+    await dispatch_download(client, query.message.reply_to_message)
+
+
+# ------- PROGRESS ALERTS -------
+@_route("progress_msg_download", "progress_msg_upload", auto_answer=False)
+async def _show_progress(client: Client, query: CallbackQuery, data: str) -> None:
+    prog_key = f"{query.message.chat.id}_{query.message.id}_callback"
+    entry = callback_progress.get(prog_key)
+    if not entry:
+        # In bot mode the transfer runs in a worker process
+        for snapshot in remote_progress.values():
+            entry = snapshot.get("callback", {}).get(prog_key)
+            if entry:
+                break
+    try:
+        text = _PROGRESS_TEMPLATE.format(**entry) if entry else "Processing..."
+    except Exception:
+        text = "Processing..."
+    await _answer(query, text, show_alert=True)
+
+
+# ------- CANCEL BUTTON -------
+@_route("cancel", "close", prefix="c", legacy=("cancel",), auto_answer=False)
+async def _cancel(client: Client, query: CallbackQuery, arg: str) -> None:
     chat_id = query.message.chat.id
     msg_id = query.message.id
-    #await query.answer()
-
-    # ------- NAVIGATION BUTTONS -------
-    if data in ("start_data", "help_data", "about_data"):
-        mapping = {
-            "start_data": (Script.start_msg, [[InlineKeyboardButton("HELP", callback_data="help_data"), InlineKeyboardButton("ABOUT", callback_data="about_data")], [InlineKeyboardButton("⭕️Owner⭕️", url=f"https://t.me/{Config.BOT_USERNAME}")]]),
-            "help_data": (lambda _: Script.help_msg(), [[InlineKeyboardButton("BACK", callback_data="start_data"), InlineKeyboardButton("ABOUT", callback_data="about_data")], [InlineKeyboardButton("⭕️SUPPORT⭕️", url=f"https://t.me/{Config.BOT_USERNAME}")]]),
-            "about_data": (lambda _: Script.about_msg(), [[InlineKeyboardButton("BACK", callback_data="help_data"), InlineKeyboardButton("START", callback_data="start_data")], [InlineKeyboardButton("SOURCE CODE", url=UPSTREAM_REPO)]])
-        }
-        try:
-            template_fn, kb = mapping[data]
-            text = template_fn(query.from_user.mention)
-            await query.message.edit_text(
-                text=text,
-                disable_web_page_preview=True,
-                reply_markup=InlineKeyboardMarkup(kb)
-            )
-        except QueryIdInvalid:
-            logger.warning("CallbackQuery invalid during navigation")
-        except Exception as e:
-            logger.error(f"Error handling `{data}` navigation: {e}")
+    # cleanup entries if present
+    for registry in (download_progress, upload_progress, callback_progress):
+        registry.pop(f"{chat_id}_{msg_id}", None)
+
+    # Stream keyboard ("c:<token>" or legacy "cancel_<key>"): drop the journaled
+    # job and its downloaded source
+    key = arg
+    if key not in ("cancel", "close"):
+        download_progress.pop(key, None)
+        # Batch prompt or running batch
+        await batch.cancel(key)
+        found = await journal.find_selection(key)
+        if found:
+            await journal.discard(found["job"])
+            # Other users' jobs may share the downloaded source
+            for source in {e.get("file") for e in found["entries"].values()} - {None}:
+                await sources.release(source, found["job"])
+
+    await edit_message(client, query.message, "**Cancelled…**", priority=REPLY, final=True)
+    await _answer(query, "Cancelled.", show_alert=True)
+
+
+# ------- STREAM EXTRACTION -------
+@_route(prefix="s", legacy=("audio", "subtitle"), auto_answer=False)
+async def _extract(client: Client, query: CallbackQuery, arg: str) -> None:
+    if lifecycle.is_draining():
+        # The keyboard is journaled and keeps working after the restart
+        return await _answer(query, lifecycle.DRAIN_MESSAGE, show_alert=True)
+    # The keyboard stays, so the user can pick again once the quota refills
+    if await _quota_exhausted(query):
         return
+    await _answer(query)
 
-    # ------- DOWNLOAD BUTTON -------
-    if data == "download_file":
-        # Delete prompt and start download in background
-        try:
-            await query.message.delete()
-            asyncio.create_task(download_file(client, query.message.reply_to_message))
-        except Exception as e:
-            logger.error(f"Error initiating download: {e}")
+    if ":" in arg:
+        # "<token>:<index>"
+        key, _, idx_s = arg.rpartition(":")
+    else:
+        # legacy "<type>_<index>_<chat>-<msg>", with the type already stripped
+        idx_s, _, key = arg.partition("_")
+
+    entries = await resolve_selection(key)
+    entry = subtitle_bundle(entries) if idx_s == SUBTITLE_BUNDLE else entries.get(idx_s)
+    if not entry:
+        await edit_message(client, query.message, "**Details Not Found**", priority=REPLY, final=True)
         return
+    try:
+        await dispatch_extraction(client, query.message, entry.get("type", "audio"), entry)
+    except Exception:
+        await edit_message(client, query.message, "**Operation Failed**", priority=REPLY, final=True)
+        raise
+
 
-    # ------- PROGRESS ALERTS -------
-    if data.startswith("progress_msg_"):
-        prog_key = f"{chat_id}_{msg_id}_callback"
-        registry = callback_progress
-        entry = registry.get(prog_key)
-        if not entry:
-            return await query.answer("Processing...", show_alert=True)
-
-        msg = (
-            "Progress Details...\n\n"
-            "Completed: {current}\n"
-            "Total: {total}\n"
-            "Speed: {speed}\n"
-            "Progress: {progress:.2f}%\n"
-            "Elapsed: {elapsed}\n"
-            "ETA: {eta}"
-        )
-        try:
-            return await query.answer(msg.format(**entry), show_alert=True)
-        except Exception:
-            await query.answer("Processing...", show_alert=True)
+# ------- BATCH POLICY -------
+@_route(prefix="b", auto_answer=False)
+async def _batch(client: Client, query: CallbackQuery, arg: str) -> None:
+    if lifecycle.is_draining():
+        return await _answer(query, lifecycle.DRAIN_MESSAGE, show_alert=True)
+    if await _quota_exhausted(query):
         return
+    await _answer(query)
 
-    # ------- CANCEL BUTTON -------
-    if data in ("cancel", "close"):  # support both keys
-        try:
-            key_parts = data.split("_")
-            # cleanup entries if present
-            for registry in (download_progress, upload_progress, callback_progress):
-                registry.pop(f"{chat_id}_{msg_id}", None)
-            await query.message.edit_text("**Cancelled…**")
-            await query.answer("Cancelled.", show_alert=True)
-        except Exception as e:
-            logger.error(f"Error cancelling operation: {e}")
+    # "<token>:<policy>"
+    token, _, policy = arg.rpartition(":")
+    prompt = batch.take_prompt(token)
+    if not prompt or (policy != "each" and policy not in batch.POLICIES):
+        await edit_message(client, query.message, "**Details Not Found**", priority=REPLY, final=True)
         return
 
-    # ------- STREAM EXTRACTION -------
-    if data.startswith(('audio_', 'subtitle_')):
-        try:
-            stream_type, idx_s, key = data.split('_', 2)
-            #idx = int(idx_s)
-            bucket = download_progress.get(key,{})
-
-            # key was message_chat-message_id
-            #entry: Dict[str, Any] = download_progress.get(key) or {}
-            entry = bucket.get(idx_s)
-            if not entry:
-                await query.message.edit_text("**Details Not Found**")
-                return
-            if stream_type == 'audio':
-                await extract_audio(client, query.message, entry)
-            else:
-                await extract_subtitle(client, query.message, entry)
-        except QueryIdInvalid:
-            logger.warning("CallbackQuery invalid during extraction")
-        except Exception as e:
-            await query.message.edit_text("**Operation Failed**")
-            logger.error(f"Error in extraction callback `{data}`: {e}")
+    if policy == "each":
+        await edit_message(client, query.message,
+            f"▶️ Processing {len(prompt['message_ids'])} files one by one…", priority=REPLY, final=True)
+        for msg in await client.get_messages(prompt["chat_id"], prompt["message_ids"]):
+            if msg and not msg.empty:
+                await dispatch_download(client, msg)
         return
 
-    # Unhandled callback
-    logger.info(f"Unhandled callback data: {data}")
-    await query.answer()
+    await edit_message(client, query.message, "📦 Starting batch…", priority=REPLY, final=True)
+    await dispatch_batch(client, query.message, token, prompt["message_ids"], policy, prompt.get("files"))
@@ -1,13 +1,43 @@
 import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
 from pyrogram import filters, Client
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram.types import InlineKeyboardMarkup, Message
 
 from config import Config
 from script import Script
+from helpers import batch, job_history, lifecycle
+from helpers.keyboards import DOWNLOAD_PROMPT_KEYBOARD, batch_keyboard
+from helpers.clip import format_clip, parse_clip
 from helpers.logger import logger
+from helpers.message_editor import edit_message
+from helpers.rate_limiter import api_call, REPLY
 from helpers.progress import human_readable_bytes
 
 
+# Files arriving from the same user within this many seconds of each other
+# are offered together as a batch. A lone file is prompted for at once, and
+# its prompt becomes a batch prompt if more files follow; only the parts of a
+# media group (which arrive as separate updates) wait for the window.
+_BATCH_WINDOW = 2.0
+
+
+class _Window:
+    def __init__(self) -> None:
+        self.messages: List[Message] = []
+        self.last = 0.0
+        # Prompt shown for the files so far, and its batch token if any
+        self.prompt: Optional[Message] = None
+        self.token: Optional[str] = None
+        # Pending prompt for a media group still arriving
+        self.timer: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+
+_windows: Dict[int, _Window] = {}
+
+
 @Client.on_message(filters.private & (filters.document | filters.video))
 async def confirm_download(client: Client, message: Message) -> None:
     """
@@ -18,33 +48,125 @@ async def confirm_download(client: Client, message: Message) -> None:
     if user_id not in Config.AUTH_USERS and user_id != Config.OWNER_ID:
         return
 
+    if lifecycle.is_draining():
+        await api_call(message.chat.id, REPLY, message.reply_text, lifecycle.DRAIN_MESSAGE, quote=True)
+        return
+
     media = message.document or message.video
     mime = getattr(media, "mime_type", "")
 
     # Only accept video files
-    if mime.startswith("video/"):
-        fname = getattr(media, "file_name", "<unknown>")
-        fsize = getattr(media, "file_size", 0)
-        size_str = human_readable_bytes(fsize)
-
-        logger.info(f"User {user_id} requested to download {fname} ({size_str})")
-        await asyncio.sleep(1)
-
-        await message.reply_text(
-            text=(f"**{Script.start_msg('')}**\n"  # You can customize prompt text here
-                  f"File: **{fname}**\n"
-                  f"Size: `{size_str}`\n"
-                  "What would you like me to do?"),
-            quote=True,
-            disable_web_page_preview=True,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("DOWNLOAD and PROCESS", callback_data="download_file")],
-                [InlineKeyboardButton("CANCEL", callback_data="cancel")]
-            ])
-        )
-    else:
-        await message.reply_text(
+    if not mime.startswith("video/"):
+        await api_call(message.chat.id, REPLY, message.reply_text,
             text="❌ Invalid media type. Please send a video file.",
             quote=True,
             disable_web_page_preview=True
-        )
\ No newline at end of file
+        )
+        return
+
+    now = time.monotonic()
+    for uid, old in list(_windows.items()):
+        if now - old.last > _BATCH_WINDOW and not old.timer:
+            del _windows[uid]
+    window = _windows.setdefault(user_id, _Window())
+    window.messages.append(message)
+    window.last = now
+
+    if getattr(message, "media_group_id", None) or window.timer:
+        # Restart the group's timer with every part
+        if window.timer:
+            window.timer.cancel()
+        window.timer = asyncio.create_task(_prompt_after(client, window))
+        return
+    await _prompt(client, window)
+
+
+async def _prompt_after(client: Client, window: _Window) -> None:
+    await asyncio.sleep(_BATCH_WINDOW)
+    window.timer = None
+    window.last = time.monotonic()
+    await _prompt(client, window)
+
+
+async def _prompt(client: Client, window: _Window) -> None:
+    """
+    Show the window's files: a single-file prompt for the first, then the
+    same message edited into a batch prompt as more arrive.
+    """
+    async with window.lock:
+        messages = sorted(window.messages, key=lambda m: m.id)
+        try:
+            if len(messages) == 1:
+                window.prompt = await _single_prompt(messages[0])
+                return
+            if window.token:
+                batch.take_prompt(window.token)
+            window.token = batch.register_prompt(messages)
+            text, markup = await _batch_prompt(messages, window.token)
+            if window.prompt:
+                try:
+                    await edit_message(client, window.prompt, text, reply_markup=markup,
+                                       priority=REPLY, final=True)
+                    return
+                except Exception:
+                    # The earlier prompt was already answered; start over
+                    # with the files it didn't cover
+                    batch.take_prompt(window.token)
+                    window.messages, window.token = [messages[-1]], None
+                    window.prompt = await _single_prompt(messages[-1])
+                    return
+            window.prompt = await api_call(messages[0].chat.id, REPLY, messages[0].reply_text,
+                text=text,
+                quote=True,
+                disable_web_page_preview=True,
+                reply_markup=markup
+            )
+        except Exception:
+            logger.exception(f"Failed to prompt user {messages[0].from_user.id}")
+
+
+async def _single_prompt(message: Message) -> Message:
+    media = message.document or message.video
+    fname = getattr(media, "file_name", "<unknown>")
+    fsize = getattr(media, "file_size", 0)
+    size_str = human_readable_bytes(fsize)
+
+    clip = parse_clip(message.caption)
+    logger.info(f"User {message.from_user.id} requested to download {fname} ({size_str})")
+    # Expected time from similar recent jobs; a clip's partial download isn't modelled
+    eta = None if clip else job_history.format_eta(await job_history.predict(fsize, fname))
+
+    return await api_call(message.chat.id, REPLY, message.reply_text,
+        text=(f"**{Script.start_msg('')}**\n"  # You can customize prompt text here
+              f"File: **{fname}**\n"
+              f"Size: `{size_str}`\n"
+              + (f"Clip: `{format_clip(clip)}`\n" if clip else "")
+              + (f"Expected time: `{eta}`\n" if eta else "")
+              + "What would you like me to do?"),
+        quote=True,
+        disable_web_page_preview=True,
+        reply_markup=DOWNLOAD_PROMPT_KEYBOARD
+    )
+
+
+async def _batch_prompt(messages: List[Message], token: str) -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Text and keyboard of the prompt for a batch of files.
+    """
+    total = sum(getattr(m.document or m.video, "file_size", 0) or 0 for m in messages)
+    extra = len(messages) - batch.MAX_BATCH_FILES
+    logger.info(
+        f"User {messages[0].from_user.id} sent {len(messages)} files "
+        f"({human_readable_bytes(total)}) for a batch"
+    )
+
+    expected = 0.0
+    for size, name in map(batch.file_hint, messages[:batch.MAX_BATCH_FILES]):
+        expected += sum((await job_history.predict(size, name)).values())
+    text = (
+        f"📦 **{len(messages)} files** (`{human_readable_bytes(total)}`)\n"
+        + (f"Expected time: `~{job_history.format_duration(expected)}`\n" if expected else "")
+        + (f"Only the first {batch.MAX_BATCH_FILES} will be processed.\n" if extra > 0 else "")
+        + "\nPick what to extract from every file, or handle them one by one:"
+    )
+    return text, batch_keyboard(token, [(code, label) for code, (label, _) in batch.POLICIES.items()])
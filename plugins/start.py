@@ -1,19 +1,23 @@
 import os
 import sys
-import shutil
 import asyncio
 from pathlib import Path
-from subprocess import CalledProcessError
 
 from pyrogram import Client, filters
 from pyrogram.enums import ParseMode
-from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
+from pyrogram.types import Message
 
 from config import Config
-from helpers.progress import download_progress, upload_progress
+from helpers.progress import has_active_transfers
 from script import Script
-from helpers.logger import logger
+from helpers import lifecycle
+from helpers.keyboards import START_KEYBOARD, HELP_KEYBOARD, ABOUT_KEYBOARD
+from helpers.logger import logger, LOG_FILE, flush_logs, shutdown_logging
+from helpers.message_editor import edit_message
+from helpers.rate_limiter import api_call, REPLY, STATUS
 from utils.status_utils import get_status_text
+from utils.memstat_utils import get_memstat_text, start_tracing, stop_tracing
+from utils.perf_utils import get_perf_text
 from helpers.message_updater import keep_updating_status
 from helpers.tools import clean_up
 
@@ -27,16 +31,10 @@ async def start_command(client: Client, message: Message) -> None:
     """
     Handle /start command: send welcome message with keyboard.
     """
-    await message.reply_text(
+    await api_call(message.chat.id, REPLY, message.reply_text,
         text=Script.start_msg(message.from_user.mention),
         disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("HELP", callback_data="help_data"),
-                InlineKeyboardButton("ABOUT", callback_data="about_data"),
-            ],
-            [InlineKeyboardButton("⭕️Owner⭕️", url=f"https://t.me/{Config.BOT_USERNAME}")]
-        ])
+        reply_markup=START_KEYBOARD
     )
 
 
@@ -45,16 +43,10 @@ async def help_command(client: Client, message: Message) -> None:
     """
     Handle /help command: send usage instructions.
     """
-    await message.reply_text(
+    await api_call(message.chat.id, REPLY, message.reply_text,
         text=Script.help_msg(),
         disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("BACK", callback_data="start_data"),
-                InlineKeyboardButton("ABOUT", callback_data="about_data"),
-            ],
-            [InlineKeyboardButton("⭕️SUPPORT⭕️", url=f"https://t.me/{Config.BOT_USERNAME}")]
-        ])
+        reply_markup=HELP_KEYBOARD
     )
 
 
@@ -63,21 +55,10 @@ async def about_command(client: Client, message: Message) -> None:
     """
     Handle /about command: send bot details.
     """
-    await message.reply_text(
+    await api_call(message.chat.id, REPLY, message.reply_text,
         text=Script.about_msg(),
         disable_web_page_preview=True,
-        reply_markup=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("BACK", callback_data="help_data"),
-                InlineKeyboardButton("START", callback_data="start_data"),
-            ],
-            [
-                InlineKeyboardButton(
-                    "SOURCE CODE",
-                    url=Config.UPSTREAM_REPO if hasattr(Config, 'UPSTREAM_REPO') else "https://github.com/pachax001/Stream-Extract-Bot"
-                )
-            ]
-        ])
+        reply_markup=ABOUT_KEYBOARD
     )
 
 
@@ -86,56 +67,92 @@ async def send_log(client: Client, message: Message) -> None:
     """
     Handle /log command: send the log.txt file to owner.
     """
-    log_path = Path("log.txt")
+    log_path = Path(LOG_FILE)
+    # Records are written by a background thread; make sure the file is current
+    await asyncio.to_thread(flush_logs)
     if log_path.exists():
-        await client.send_document(
+        await api_call(message.chat.id, REPLY, client.send_document,
             chat_id=message.chat.id,
             document=str(log_path),
             caption="Log file"
         )
     else:
-        await message.reply_text("No log file found.")
+        await api_call(message.chat.id, REPLY, message.reply_text, "No log file found.")
 
 
-async def _is_ffmpeg_running() -> bool:
+@Client.on_message(filters.command("memstat") & filters.private & filters.user(Config.OWNER_ID))
+async def memstat_command(client: Client, message: Message) -> None:
     """
-    Check if any ffmpeg process is active on the system.
+    Handle /memstat [on [frames]|off|reset]: report memory use, registry sizes and
+    asyncio tasks; `on`/`off` toggle tracemalloc, `reset` moves the diff baseline.
     """
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            "pgrep", "-f", "ffmpeg",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-        out, _ = await proc.communicate()
-        return bool(out.strip())
-    except CalledProcessError:
-        return False
+    args = message.command[1:]
+    action = args[0].lower() if args else ""
+    notes = []
+    if action == "on":
+        frames = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
+        notes.append(start_tracing(frames))
+    elif action == "off":
+        notes.append(stop_tracing())
+    elif action not in ("", "reset"):
+        await api_call(message.chat.id, REPLY, message.reply_text, "Usage: /memstat [on [frames]|off|reset]")
+        return
+
+    report = await get_memstat_text(reset=action == "reset")
+    text = "\n\n".join(notes + [report])
+    await api_call(message.chat.id, REPLY, message.reply_text, text[:4096], parse_mode=ParseMode.MARKDOWN)
+
+
+@Client.on_message(filters.command("perf") & filters.private & filters.user(Config.OWNER_ID))
+async def perf_command(client: Client, message: Message) -> None:
+    """
+    Handle /perf: per-stage p50/p95 durations and throughput of recent jobs.
+    """
+    text = await get_perf_text()
+    await api_call(message.chat.id, REPLY, message.reply_text, text[:4096], parse_mode=ParseMode.MARKDOWN)
 
 
 @Client.on_message(filters.command("restart") & filters.private & filters.user(Config.OWNER_ID))
 async def restart_command(client: Client, message: Message) -> None:
     """
-    Handle /restart: cleanup, update code, and restart the bot.
+    Handle /restart: drain in-flight jobs, update code, and restart the bot.
+
+    New jobs are refused while draining. Jobs still running at the DRAIN_TIMEOUT
+    deadline lose only their own ffmpeg children; the journal resumes them after restart.
     """
     logger.info("Restarting the bot...")
-    resp = await message.reply_text("Restarting the bot...")
+    resp = await api_call(message.chat.id, REPLY, message.reply_text, "♻️ Draining before restart…")
 
     # Save message ID for post-restart edit
     RESTART_FILE.write_text(str(resp.id))
 
-    # Cleanup downloads directory
-    if DOWNLOADS_DIR.exists():
-        shutil.rmtree(DOWNLOADS_DIR, ignore_errors=True)
+    async def _report(jobs: dict, left: float) -> None:
+        listing = "\n".join(f"• {label}" for label in list(jobs.values())[:10])
+        await edit_message(client, resp,
+            f"♻️ Draining before restart…\n"
+            f"In-flight jobs: `{len(jobs)}`\n"
+            f"Deadline in: `{int(left)}s`\n\n{listing}"
+        )
+
+    drained = await lifecycle.drain(Config.DRAIN_TIMEOUT, _report)
+    await edit_message(client, resp,
+        "♻️ All jobs finished. Updating…" if drained
+        else "♻️ Drain deadline reached. Updating, unfinished jobs resume after restart…",
+        final=True
+    )
 
-    # Terminate ffmpeg if running
-    if await _is_ffmpeg_running():
-        await asyncio.create_subprocess_exec("pkill", "-9", "-f", "ffmpeg")
+    # Run update script and wait for it
+    proc = await asyncio.create_subprocess_exec(sys.executable, "update.py")
+    await proc.wait()
 
-    # Run update script
-    await asyncio.create_subprocess_exec("python3", "update.py")
+    # Hard-cancel: kill only the children we started, then restart straight away so
+    # interrupted jobs keep their journal entries
+    if not drained:
+        killed = lifecycle.kill_children()
+        logger.warning(f"Killed {killed} tracked child process(es) before restart")
 
     # Restart process
+    shutdown_logging()
     os.execl(sys.executable, sys.executable, "main.py")
 
 
@@ -147,22 +164,22 @@ async def status_command(client: Client, message: Message) -> None:
     old_msg_id = _last_status.get(user_id)
     if old_msg_id:
         try:
-            await client.delete_messages(chat_id=message.chat.id, message_ids=old_msg_id)
+            await api_call(message.chat.id, STATUS, client.delete_messages, chat_id=message.chat.id, message_ids=old_msg_id)
         except:
             pass
 
     # Compose status
-    report = get_status_text(mount_point=str(Path.cwd()))
-    status_msg = await message.reply_text(report, parse_mode=ParseMode.MARKDOWN)
+    report = await get_status_text(mount_point=str(Path.cwd()))
+    status_msg = await api_call(message.chat.id, REPLY, message.reply_text, report[:4096], parse_mode=ParseMode.MARKDOWN)
 
     # Remember it
     _last_status[user_id] = status_msg.id
 
     # If no transfers at all, auto-delete after 5s
-    if not download_progress and not upload_progress:
+    if not has_active_transfers():
         await asyncio.sleep(5)
         try:
-            await status_msg.delete()
+            await api_call(status_msg.chat.id, STATUS, status_msg.delete)
         except:
             pass
         # clear our record
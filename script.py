@@ -16,7 +16,10 @@ class Script:
         "🌀 <i>Send me any valid video file.</i>\n"
         "🌀 <i>Click Download and Process to download the file to my server.</i>\n"
         "🌀 <i>Wait while I process the video!</i>\n"
-        "🌀 <i>Select the stream(s) you want to extract.</i>\n\n"
+        "🌀 <i>Select the stream(s) you want to extract.</i>\n"
+        "🌀 <i>Add a caption like <code>clip 01:02:03-01:02:13</code> to extract only that part.</i>\n"
+        "🌀 <i>Use ALL SUBTITLES (ZIP) to get every subtitle track in one archive.</i>\n"
+        "🌀 <i>Send several files at once (or an album) to extract from all of them in one batch.</i>\n\n"
         "© @gunaya001"
     )
 
@@ -0,0 +1,148 @@
+import asyncio
+import sys
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import psutil
+
+from helpers import batch, download, lifecycle, message_editor, pipeline, sources
+from helpers.logger import logger
+from helpers.progress import download_progress, callback_progress, upload_progress, remote_progress
+from helpers.rate_limiter import _scheduler
+
+# Frames kept per allocation when tracing; more frames cost more memory
+TRACE_FRAMES = 1
+TOP_SITES = 10
+# Containers are walked at most this deep when estimating their size
+_SIZE_DEPTH = 4
+
+# Snapshot the current report is diffed against (taken when tracing starts)
+_baseline: Optional[tracemalloc.Snapshot] = None
+
+
+def _registries() -> Dict[str, Any]:
+    """
+    Long-lived module-level state that grows with traffic.
+    """
+    return {
+        "download_progress": download_progress,
+        "callback_progress": callback_progress,
+        "upload_progress": upload_progress,
+        "remote_progress": remote_progress,
+        "_active_downloads": download._active_downloads,
+        "lifecycle jobs": lifecycle._active_jobs,
+        "message editors": message_editor._editors,
+        "rate limiter buckets": _scheduler.chat_buckets,
+        "shared downloads": sources._flights,
+        "batch prompts": batch._prompts,
+        "detached pipeline stages": pipeline._detached,
+    }
+
+
+def _deep_sizeof(obj: Any, seen: set, depth: int = 0) -> int:
+    """
+    Approximate size of a container and the plain data it holds. Stops at
+    _SIZE_DEPTH and does not descend into arbitrary objects (messages, tasks).
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if depth >= _SIZE_DEPTH:
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_sizeof(key, seen, depth + 1) + _deep_sizeof(value, seen, depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += _deep_sizeof(item, seen, depth + 1)
+    return size
+
+
+def _human(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def start_tracing(frames: int = TRACE_FRAMES) -> str:
+    global _baseline
+    if tracemalloc.is_tracing():
+        return "tracemalloc is already running."
+    tracemalloc.start(frames)
+    _baseline = tracemalloc.take_snapshot()
+    logger.info(f"[memstat] tracemalloc started ({frames} frame(s))")
+    return f"tracemalloc started with {frames} frame(s); baseline taken."
+
+
+def stop_tracing() -> str:
+    global _baseline
+    if not tracemalloc.is_tracing():
+        return "tracemalloc is not running."
+    tracemalloc.stop()
+    _baseline = None
+    logger.info("[memstat] tracemalloc stopped")
+    return "tracemalloc stopped."
+
+
+def _top_sites(reset: bool) -> List[str]:
+    """
+    Allocation sites that grew the most since the baseline (blocking).
+    """
+    global _baseline
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    if _baseline is None:
+        stats = snapshot.statistics("lineno")
+        lines = ["**Top allocation sites** (no baseline):"]
+        lines.extend(f"• `{s.traceback[0]}`: {_human(s.size)} in {s.count} blocks" for s in stats[:TOP_SITES])
+    else:
+        stats = snapshot.compare_to(_baseline, "lineno")
+        lines = ["**Growth since baseline**:"]
+        lines.extend(
+            f"• `{s.traceback[0]}`: {_human(s.size_diff):>9} ({s.count_diff:+d} blocks), now {_human(s.size)}"
+            for s in stats[:TOP_SITES]
+        )
+    if reset or _baseline is None:
+        _baseline = snapshot
+        lines.append("_Baseline reset._")
+    return lines
+
+
+async def get_memstat_text(reset: bool = False) -> str:
+    """
+    Memory report: process RSS, registry sizes, asyncio tasks and, while
+    tracemalloc runs, the allocation sites that grew since the baseline.
+    """
+    lines: List[str] = []
+    try:
+        rss = psutil.Process().memory_info().rss
+        lines.extend([f"**Process RSS**: `{_human(rss)}`", ""])
+    except Exception as e:
+        logger.error(f"Failed to read RSS: {e}")
+
+    lines.append("**Registries** (entries, approx. size):")
+    for name, registry in _registries().items():
+        lines.append(f"• `{name}`: `{len(registry)}`, `{_human(_deep_sizeof(registry, set()))}`")
+    lines.append("")
+
+    tasks = asyncio.all_tasks()
+    by_coro = Counter(getattr(t.get_coro(), "__qualname__", "?") for t in tasks)
+    lines.append(f"**Asyncio tasks**: `{len(tasks)}`")
+    lines.extend(f"• `{name}`: `{count}`" for name, count in by_coro.most_common(5))
+    lines.append("")
+
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"**tracemalloc**: `{_human(current)}` traced, `{_human(peak)}` peak")
+        # Snapshots of a large heap take a while; keep them off the event loop
+        lines.extend(await asyncio.to_thread(_top_sites, reset))
+    else:
+        lines.append("**tracemalloc**: off (`/memstat on` to start)")
+    return "\n".join(lines)
@@ -0,0 +1,23 @@
+from typing import List
+
+from helpers import job_history
+from helpers.job_history import format_duration
+
+
+async def get_perf_text() -> str:
+    """
+    Per-stage performance over recent jobs: count, p50/p95 duration and
+    median throughput for each stage and codec path.
+    """
+    stats = await job_history.stage_stats()
+    if not stats:
+        return "**Job performance**: no finished jobs recorded yet."
+    lines: List[str] = [f"**Job performance** (last `{job_history.WINDOW}` stage records):", ""]
+    for s in stats:
+        name = f"{s['stage']}/{s['path']}" if s["path"] else s["stage"]
+        rate = f", `{s['rate'] / (1024 * 1024):.2f} MB/s`" if s["rate"] else ""
+        lines.append(
+            f"• {name}: `{s['count']}` jobs, p50 `{format_duration(s['p50'])}`, "
+            f"p95 `{format_duration(s['p95'])}`{rate}"
+        )
+    return "\n".join(lines)
@@ -1,10 +1,14 @@
-import shutil
 import psutil
 from pathlib import Path
 from typing import Any, Dict, List
 
-from helpers.progress import download_progress, upload_progress
+from helpers.progress import download_progress, upload_progress, remote_progress, queue_status
+from config import Config
+from helpers.client_pool import pool, format_pool
 from helpers.logger import logger
+from helpers import fs, stage_timeouts, workspace
+from helpers.probe import probe_stats, format_probe_stats
+from helpers.transfer_control import transfers, format_snapshot
 
 
 def _format_transfer_section(
@@ -31,7 +35,7 @@ def _format_transfer_section(
     return lines
 
 
-def get_status_text(mount_point: str = "/") -> str:
+async def get_status_text(mount_point: str = "/") -> str:
     """
     Returns a multi-line status report including:
       - Ongoing downloads
@@ -43,27 +47,54 @@ def get_status_text(mount_point: str = "/") -> str:
 
     # Downloads
     if download_progress:
-        logger.info("Reporting active downloads")
+        logger.debug("Reporting active downloads", extra={"sample": 10})
         lines.extend(_format_transfer_section("Ongoing Downloads", download_progress))
     else:
         lines.append("**No downloads in progress.**\n")
 
     # Uploads
     if upload_progress:
-        logger.info("Reporting active uploads")
+        logger.debug("Reporting active uploads", extra={"sample": 10})
         lines.extend(_format_transfer_section("Ongoing Uploads", upload_progress))
     else:
         lines.append("**No uploads in progress.**\n")
 
+    # Worker processes (RUN_MODE=bot)
+    if queue_status or remote_progress:
+        lines.append(
+            f"**Job Queue**: `{queue_status.get('queued', 0)}` queued, "
+            f"`{queue_status.get('running', 0)}` running\n"
+        )
+    for worker, snapshot in remote_progress.items():
+        for kind in ("download", "upload"):
+            registry = snapshot.get(kind) or {}
+            if registry:
+                lines.extend(_format_transfer_section(f"{worker} {kind}s", registry))
+        if snapshot.get("transfer"):
+            lines.extend(format_snapshot(f"{worker} Transfer Window", snapshot["transfer"]))
+        lines.extend(format_probe_stats(f"{worker} Probe Latency", snapshot.get("probe") or {}))
+        lines.extend(format_pool(f"{worker} Bot Pool", snapshot.get("pool") or []))
+        lines.extend(stage_timeouts.format_snapshot(f"{worker} Stage Timeouts", snapshot.get("timeouts") or {}))
+        lines.extend(fs.format_snapshot(f"{worker} Filesystem", snapshot.get("fs") or {}))
+
+    # Adaptive transfer concurrency (the bot process itself transfers nothing in bot mode)
+    if Config.RUN_MODE != "bot":
+        lines.extend(format_snapshot("Transfer Window", transfers.snapshot()))
+        lines.extend(format_probe_stats("Probe Latency", probe_stats()))
+        lines.extend(format_pool("Bot Pool", pool.snapshot()))
+        lines.extend(stage_timeouts.format_snapshot("Stage Timeouts", stage_timeouts.snapshot()))
+    lines.extend(fs.format_snapshot("Filesystem", fs.snapshot()))
+
     # Disk usage
     try:
-        total, used, free = shutil.disk_usage(mount_point)
+        total, used, free = await fs.disk_usage(mount_point)
         total_gb, used_gb, free_gb = (v / (1024**3) for v in (total, used, free))
         lines.extend([
             "**Disk Usage**:",
             f"• Total: `{total_gb:.2f} GB`",
             f"• Used:  `{used_gb:.2f} GB`",
             f"• Free:  `{free_gb:.2f} GB`",
+            workspace.format_usage(await fs.run("workspace usage", workspace.usage)),
             ""
         ])
     except Exception as e: